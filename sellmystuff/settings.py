@@ -2,6 +2,7 @@
 Django settings for Sell My Stuff project.
 """
 
+import os
 from pathlib import Path
 from decouple import config
 
@@ -36,6 +37,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Serve static files efficiently
+    'store.performance.PerformanceMiddleware',  # Removes itself unless PERFORMANCE_INSTRUMENTATION is on
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -44,6 +46,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-request timings (DB, templates, Stripe, SMTP) in a Server-Timing
+# header and a JSON log line, plus EXPLAIN for slow queries
+PERFORMANCE_INSTRUMENTATION = config('PERFORMANCE_INSTRUMENTATION', default=False, cast=bool)
+PERFORMANCE_SLOW_QUERY_MS = config('PERFORMANCE_SLOW_QUERY_MS', default=100, cast=float)
+
 ROOT_URLCONF = 'sellmystuff.urls'
 
 TEMPLATES = [
@@ -128,6 +135,53 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Catalogue pages are cached per catalogue version (see store/cache.py).
+# The cache must be shared by every process that changes the catalogue,
+# including the background worker, so production uses Redis via REDIS_URL
+# (render.yaml provisions one). Without a shared backend the page cache is
+# off and a local-memory cache only holds the catalogue version. Set
+# CACHE_BACKEND=file (one host, shared disk) or locmem (a single-process
+# development server) to cache pages without Redis.
+REDIS_URL = config('REDIS_URL', default='')
+CACHE_BACKEND = config('CACHE_BACKEND', default='redis' if REDIS_URL else 'none')
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+elif CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': config('CACHE_DIR', default=str(BASE_DIR / '.cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+CATALOGUE_PAGE_CACHE = CACHE_BACKEND != 'none'
+
+# Seconds a cached catalogue page is kept; pages are invalidated by version
+# bumps long before this in practice, it just bounds stale entries
+CATALOGUE_CACHE_TIMEOUT = config('CATALOGUE_CACHE_TIMEOUT', default=3600, cast=int)
+
+# The infinite-scroll card data is written as precompressed JSON files under
+# MEDIA_ROOT/CATALOGUE_SNAPSHOT_DIR (see store/snapshots.py), which the
+# browser pages through without further requests to Django. The web service
+# builds them in a background thread, since it serves MEDIA_ROOT; they need
+# the shared catalogue version to tell when they are stale, so they are off
+# by default without a shared cache
+CATALOGUE_SNAPSHOTS = config('CATALOGUE_SNAPSHOTS', default=CATALOGUE_PAGE_CACHE, cast=bool)
+CATALOGUE_SNAPSHOT_DIR = 'catalogue'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 # Note: Production settings override this with stricter requirements
@@ -179,10 +233,63 @@ WHITENOISE_AUTOREFRESH = DEBUG  # Auto-refresh in development
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Browser cache lifetime (seconds) for media files without a content hash in
+# their name; hashed names are always cached for a year
+MEDIA_CACHE_MAX_AGE = config('MEDIA_CACHE_MAX_AGE', default=3600, cast=int)
+
+# Hand media file transfers to a front proxy: 'x-accel-redirect' (nginx) or
+# 'x-sendfile' (Apache/lighttpd). Empty means Django streams the files itself.
+# For nginx, MEDIA_ACCEL_REDIRECT_PREFIX must match an `internal` location
+# aliased to MEDIA_ROOT.
+MEDIA_SENDFILE_BACKEND = config('MEDIA_SENDFILE_BACKEND', default='')
+MEDIA_ACCEL_REDIRECT_PREFIX = config('MEDIA_ACCEL_REDIRECT_PREFIX', default='/protected-media/')
+
+# Uploads are checked while they stream in (store.uploadhandlers): files that
+# aren't images, or are too big, are dropped before being buffered or spooled
+FILE_UPLOAD_HANDLERS = [
+    'store.uploadhandlers.ImageUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+UPLOAD_MAX_IMAGE_SIZE = config('UPLOAD_MAX_IMAGE_SIZE', default=5 * 1024 * 1024, cast=int)
+UPLOAD_MAX_REQUEST_SIZE = config('UPLOAD_MAX_REQUEST_SIZE', default=50 * 1024 * 1024, cast=int)
+UPLOAD_MAX_IMAGE_PIXELS = config('UPLOAD_MAX_IMAGE_PIXELS', default=40_000_000, cast=int)
+
+# Widths (px) of the resized JPEG/WebP copies rendered for each item photo
+# Regenerate existing images after changing: python manage.py build_derivatives
+ITEM_IMAGE_WIDTHS = [320, 640, 1280]
+
+# Uploaded photos are normalized before storing: EXIF rotation applied,
+# metadata stripped, long edge capped (px) and re-encoded at this JPEG quality
+ITEM_IMAGE_MAX_EDGE = config('ITEM_IMAGE_MAX_EDGE', default=2048, cast=int)
+ITEM_IMAGE_QUALITY = config('ITEM_IMAGE_QUALITY', default=85, cast=int)
+# Processes used to normalize a batch of uploaded photos in parallel
+IMAGE_PROCESS_WORKERS = config('IMAGE_PROCESS_WORKERS', default=min(4, os.cpu_count() or 1), cast=int)
+
 # Stripe configuration
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY', default='')
 STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
 
+# Stripe API client: timeouts (seconds) and retries for transient errors.
+# STRIPE_API_BASE points the client at another host (e.g. a local fake).
+STRIPE_CONNECT_TIMEOUT = config('STRIPE_CONNECT_TIMEOUT', default=5, cast=float)
+STRIPE_READ_TIMEOUT = config('STRIPE_READ_TIMEOUT', default=20, cast=float)
+STRIPE_MAX_RETRIES = config('STRIPE_MAX_RETRIES', default=3, cast=int)
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='')
+
+# Calls per second across all threads of a process (Stripe allows 25/s in
+# test mode, 100/s live), and threads used by bulk admin actions
+STRIPE_MAX_REQUESTS_PER_SECOND = config('STRIPE_MAX_REQUESTS_PER_SECOND', default=20, cast=float)
+STRIPE_BULK_WORKERS = config('STRIPE_BULK_WORKERS', default=8, cast=int)
+
+# Webhook events are queued and processed by `python manage.py run_worker`.
+# Failed events are retried with backoff up to this many times.
+WEBHOOK_MAX_ATTEMPTS = config('WEBHOOK_MAX_ATTEMPTS', default=8, cast=int)
+
+# Payment Links for new items are also created by the worker, retried with
+# backoff up to this many times.
+PAYMENT_LINK_MAX_ATTEMPTS = config('PAYMENT_LINK_MAX_ATTEMPTS', default=8, cast=int)
+
 # Email configuration (using Brevo/SendinBlue SMTP)
 # Brevo free tier: 300 emails/day, works great for small ecommerce sites
 # Get credentials from: https://app.brevo.com/settings/keys/api
@@ -195,6 +302,13 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@example.com')
 ADMIN_EMAIL = config('ADMIN_EMAIL', default='')  # Email address to receive sale notifications
 
+# Emails are queued in the outbox and sent by `python manage.py run_worker`.
+# The worker stops sending once this many have gone out in the last 24 hours
+# (leftovers wait for the window to free up) and gives up on a message after
+# EMAIL_MAX_ATTEMPTS failures.
+EMAIL_DAILY_QUOTA = config('EMAIL_DAILY_QUOTA', default=300, cast=int)
+EMAIL_MAX_ATTEMPTS = config('EMAIL_MAX_ATTEMPTS', default=6, cast=int)
+
 # Item upload password (simple authentication for mobile upload form)
 ITEM_UPLOAD_PASSWORD = config('ITEM_UPLOAD_PASSWORD', default='')
 
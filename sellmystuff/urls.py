@@ -5,9 +5,9 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from django.views.static import serve
 from django.urls import re_path
-import os
+
+from store.media import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -21,8 +21,8 @@ if settings.DEBUG:
     # Use static() helper in development
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 else:
-    # Use serve view in production for more reliable file serving
-    media_root = os.path.abspath(str(settings.MEDIA_ROOT))
+    # Stream files with Range, conditional GET and long-lived caching
+    # (or hand them to the proxy, see MEDIA_SENDFILE_BACKEND)
     urlpatterns += [
-        re_path(r'^media/(?P<path>.*)$', serve, {'document_root': media_root}),
+        re_path(r'^media/(?P<path>.*)$', serve_media),
     ]
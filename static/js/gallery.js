@@ -5,6 +5,7 @@
 
 document.addEventListener('DOMContentLoaded', function() {
     const mainImage = document.querySelector('.item-image-main img');
+    const mainSource = document.querySelector('.item-image-main picture source');
     const thumbnails = document.querySelectorAll('.gallery-thumbnail');
     
     if (!mainImage || thumbnails.length === 0) {
@@ -19,13 +20,22 @@ document.addEventListener('DOMContentLoaded', function() {
     // Handle thumbnail clicks
     thumbnails.forEach(function(thumbnail) {
         thumbnail.addEventListener('click', function() {
-            const newSrc = this.src;
+            // Thumbnails are small derivatives; the main image uses the
+            // larger src/srcset carried in data attributes when present
+            const newSrc = this.dataset.src || this.src;
+            const newSrcset = this.dataset.srcset || '';
+            const newWebpSrcset = this.dataset.webpSrcset || '';
             
             // Update main image with fade effect
             mainImage.style.opacity = '0';
             
             setTimeout(function() {
+                if (mainSource) {
+                    mainSource.srcset = newWebpSrcset;
+                }
+                mainImage.srcset = newSrcset;
                 mainImage.src = newSrc;
+                mainImage.dataset.fullSrc = newSrc;
                 mainImage.classList.add('fade-in');
                 mainImage.style.opacity = '1';
                 
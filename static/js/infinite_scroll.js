@@ -8,12 +8,18 @@
 
     // Configuration
     const SCROLL_THRESHOLD = 200; // Load when 200px from bottom
+    const PAGE_SIZE = 12; // Must match ItemListView.paginate_by
     const DEBOUNCE_DELAY = 100; // Debounce scroll events
+    // Must match the "card" sizes preset in store/templatetags/store_images.py
+    const CARD_SIZES = '(min-width: 1024px) 25vw, (min-width: 768px) 33vw, (min-width: 480px) 50vw, 100vw';
 
     // State
     let isLoading = false;
     let hasMoreItems = true;
     let currentPage = 1;
+    let nextCursor = null; // Opaque cursor from the server; preferred over page numbers
+    let snapshotURL = null; // Precomputed catalogue snapshot (store/snapshots.py), if any
+    let snapshot = null; // { items, position } once the snapshot is loaded
     let scrollTimeout = null;
 
     // Get current category from URL
@@ -25,7 +31,13 @@
     // Build URL for fetching next page
     function buildNextPageURL(page) {
         const url = new URL(window.location.href);
-        url.searchParams.set('page', page);
+        if (nextCursor) {
+            url.searchParams.delete('page');
+            url.searchParams.set('cursor', nextCursor);
+        } else {
+            url.searchParams.delete('cursor');
+            url.searchParams.set('page', page);
+        }
         const category = getCategoryFromURL();
         if (category) {
             url.searchParams.set('category', category);
@@ -33,11 +45,23 @@
         return url.toString();
     }
 
+    // Create card image HTML, using responsive derivatives when available
+    function createItemImage(item) {
+        if (!item.primary_image_url) {
+            return '<div class="item-image-placeholder">No Image</div>';
+        }
+        if (!item.primary_image_srcset) {
+            return `<img src="${escapeHtml(item.primary_image_url)}" alt="${escapeHtml(item.title)}" class="item-image" loading="lazy">`;
+        }
+        return `<picture>
+                <source type="image/webp" srcset="${escapeHtml(item.primary_image_webp_srcset)}" sizes="${CARD_SIZES}">
+                <img src="${escapeHtml(item.primary_image_url)}" srcset="${escapeHtml(item.primary_image_srcset)}" sizes="${CARD_SIZES}" alt="${escapeHtml(item.title)}" class="item-image" loading="lazy">
+            </picture>`;
+    }
+
     // Create item card HTML
     function createItemCard(item) {
-        const imageHTML = item.primary_image_url
-            ? `<img src="${escapeHtml(item.primary_image_url)}" alt="${escapeHtml(item.title)}" class="item-image">`
-            : '<div class="item-image-placeholder">No Image</div>';
+        const imageHTML = createItemImage(item);
 
         const soldBadge = item.is_sold
             ? '<span class="item-badge item-badge-sold">Sold</span>'
@@ -46,7 +70,7 @@
         const cardClass = item.is_sold ? 'item-card item-card-sold' : 'item-card';
 
         return `
-            <div class="${cardClass}">
+            <div class="${cardClass}" data-item-id="${escapeHtml(String(item.id))}">
                 <a href="${escapeHtml(item.detail_url)}">
                     <div class="item-image-container">
                         ${imageHTML}
@@ -100,6 +124,98 @@
         }
     }
 
+    // Append cards to the grid
+    function appendItems(items) {
+        const itemGrid = document.querySelector('.item-grid');
+        if (!itemGrid) {
+            return;
+        }
+        items.forEach(function(item) {
+            const cardHTML = createItemCard(item);
+            const tempDiv = document.createElement('div');
+            tempDiv.innerHTML = cardHTML.trim();
+            itemGrid.appendChild(tempDiv.firstElementChild);
+        });
+    }
+
+    // Load the snapshot and find where the server-rendered cards end in it.
+    // Returns false if it can't be used (e.g. it predates the page).
+    async function loadSnapshot() {
+        const response = await fetch(snapshotURL);
+        if (!response.ok) {
+            return false;
+        }
+        const data = await response.json();
+        const cards = document.querySelectorAll('.item-grid .item-card');
+        const lastCard = cards[cards.length - 1];
+        const lastId = lastCard ? parseInt(lastCard.dataset.itemId, 10) : NaN;
+        const index = data.items.findIndex(function(item) { return item.id === lastId; });
+        if (index === -1) {
+            return false;
+        }
+        snapshot = { items: data.items, position: index + 1 };
+        return true;
+    }
+
+    // Next page from the snapshot; no request after the first
+    async function loadNextSnapshotPage() {
+        if (!snapshot) {
+            let loaded = false;
+            try {
+                loaded = await loadSnapshot();
+            } catch (error) {
+                console.error('Error loading catalogue snapshot:', error);
+            }
+            if (!loaded) {
+                // Fall back to fetching pages from the server
+                snapshotURL = null;
+                return loadNextServerPage();
+            }
+        }
+        const items = snapshot.items.slice(snapshot.position, snapshot.position + PAGE_SIZE);
+        snapshot.position += items.length;
+        appendItems(items);
+        hasMoreItems = snapshot.position < snapshot.items.length;
+    }
+
+    // Next page as JSON from ItemListView
+    async function loadNextServerPage() {
+        const nextPage = currentPage + 1;
+        const url = buildNextPageURL(nextPage);
+
+        const response = await fetch(url, {
+            headers: {
+                'X-Requested-With': 'XMLHttpRequest',
+            },
+        });
+
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const data = await response.json();
+
+        if (data.items && data.items.length > 0) {
+            appendItems(data.items);
+
+            // Update state
+            currentPage = nextPage;
+            nextCursor = data.next_cursor || null;
+            hasMoreItems = data.has_next;
+
+            // Update URL without reload (for bookmarking)
+            if (data.has_next) {
+                window.history.pushState(
+                    { page: nextPage, cursor: nextCursor },
+                    '',
+                    url
+                );
+            }
+        } else {
+            hasMoreItems = false;
+        }
+    }
+
     // Load next page of items
     async function loadNextPage() {
         if (isLoading || !hasMoreItems) {
@@ -111,47 +227,10 @@
         hideNoMoreItems();
 
         try {
-            const nextPage = currentPage + 1;
-            const url = buildNextPageURL(nextPage);
-
-            const response = await fetch(url, {
-                headers: {
-                    'X-Requested-With': 'XMLHttpRequest',
-                },
-            });
-
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-
-            const data = await response.json();
-
-            if (data.items && data.items.length > 0) {
-                const itemGrid = document.querySelector('.item-grid');
-                if (itemGrid) {
-                    // Append new items
-                    data.items.forEach(function(item) {
-                        const cardHTML = createItemCard(item);
-                        const tempDiv = document.createElement('div');
-                        tempDiv.innerHTML = cardHTML.trim();
-                        itemGrid.appendChild(tempDiv.firstElementChild);
-                    });
-
-                    // Update state
-                    currentPage = nextPage;
-                    hasMoreItems = data.has_next;
-
-                    // Update URL without reload (for bookmarking)
-                    if (data.has_next) {
-                        window.history.pushState(
-                            { page: nextPage },
-                            '',
-                            url
-                        );
-                    }
-                }
+            if (snapshotURL) {
+                await loadNextSnapshotPage();
             } else {
-                hasMoreItems = false;
+                await loadNextServerPage();
             }
 
             if (!hasMoreItems) {
@@ -202,13 +281,24 @@
         if (!itemGrid) {
             return; // No item grid on this page
         }
+        snapshotURL = itemGrid.dataset.snapshotUrl || null;
 
         // Check if there are more items initially
         const paginationInfo = document.querySelector('.pagination');
         if (paginationInfo) {
-            // Check if there's a "next" link to determine if more items exist
-            const hasNextLink = paginationInfo.querySelector('a[href*="page="]');
-            hasMoreItems = !!hasNextLink;
+            // data-has-next says whether more items exist; it survives the
+            // static export, which rewrites the "next" link to /page/N/.
+            // Pages rendered before it was added only have the link.
+            const hasNext = paginationInfo.dataset.hasNext;
+            const nextLink = paginationInfo.querySelector('a[href*="cursor="], a[href*="page="]');
+            hasMoreItems = hasNext !== undefined ? hasNext === 'true' : !!nextLink;
+            if (nextLink) {
+                nextCursor = new URL(nextLink.href, window.location.href).searchParams.get('cursor');
+                const page = new URL(window.location.href).searchParams.get('page');
+                if (page) {
+                    currentPage = parseInt(page, 10) || 1;
+                }
+            }
         } else {
             // No pagination info means either no items or only one page
             // Check if we have items - if yes and no pagination, assume no more items
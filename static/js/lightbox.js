@@ -42,14 +42,14 @@ document.addEventListener('DOMContentLoaded', function () {
 
   // Open on click/tap
   mainContainer.addEventListener('click', function () {
-    openLightbox(mainImg.src, mainImg.alt);
+    openLightbox(mainImg.dataset.fullSrc || mainImg.currentSrc || mainImg.src, mainImg.alt);
   });
 
   // Open on keyboard (Enter/Space)
   mainContainer.addEventListener('keydown', function (e) {
     if (e.key === 'Enter' || e.key === ' ') {
       e.preventDefault();
-      openLightbox(mainImg.src, mainImg.alt);
+      openLightbox(mainImg.dataset.fullSrc || mainImg.currentSrc || mainImg.src, mainImg.alt);
     }
   });
 
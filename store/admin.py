@@ -1,8 +1,17 @@
 from django.contrib import admin
 from django.contrib import messages
+from django.core.exceptions import ValidationError
+from django.db.models import Count
+from django.forms.models import BaseInlineFormSet
 from django.utils.html import format_html
-from .models import Category, Item, ItemImage
-from .stripe_service import create_payment_link_for_item
+from django.utils import timezone
+from .models import Category, Item, ItemImage, OutboundEmail, WebhookEvent
+from . import payment_links
+from .payment_links import requeue as requeue_payment_links
+from .imaging import derivative_url
+from .cache import bump_catalogue_version
+from .pagination import EstimatedCountPaginator
+from .search import search_items
 
 
 @admin.register(Category)
@@ -13,15 +22,40 @@ class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     ordering = ['order', 'name']
     
+    def get_queryset(self, request):
+        """Count each category's items in the changelist query itself."""
+        return super().get_queryset(request).annotate(item_count=Count('items'))
+    
     def item_count(self, obj):
         """Display number of items in this category."""
-        return obj.items.count()
+        return obj.item_count
     item_count.short_description = 'Items'
+    item_count.admin_order_field = 'item_count'
+    
+    def delete_queryset(self, request, queryset):
+        """Bulk delete, invalidating cached catalogue pages as Category.delete() does."""
+        super().delete_queryset(request, queryset)
+        bump_catalogue_version()
+
+
+class ItemImageInlineFormSet(BaseInlineFormSet):
+    def clean(self):
+        """Only one image can be primary (the database enforces it too)."""
+        super().clean()
+        primaries = [
+            form for form in self.forms
+            if getattr(form, 'cleaned_data', None)
+            and form.cleaned_data.get('is_primary')
+            and not form.cleaned_data.get('DELETE')
+        ]
+        if len(primaries) > 1:
+            raise ValidationError('Only one image can be marked as primary.')
 
 
 class ItemImageInline(admin.TabularInline):
     """Inline admin for item images with thumbnail preview."""
     model = ItemImage
+    formset = ItemImageInlineFormSet
     extra = 1
     fields = ['image_preview', 'image', 'sort_order', 'is_primary']
     readonly_fields = ['image_preview']
@@ -31,7 +65,7 @@ class ItemImageInline(admin.TabularInline):
         if obj.pk and obj.image:
             return format_html(
                 '<img src="{}" style="max-width: 100px; max-height: 100px; object-fit: contain;" />',
-                obj.image.url
+                derivative_url(obj, 100)
             )
         return '(No image)'
     image_preview.short_description = 'Preview'
@@ -39,8 +73,13 @@ class ItemImageInline(admin.TabularInline):
 
 @admin.register(Item)
 class ItemAdmin(admin.ModelAdmin):
-    list_display = ['title', 'category', 'price_amount', 'currency', 'status', 'created_at', 'payment_link_status']
+    list_display = ['thumbnail', 'title', 'category', 'price_amount', 'currency', 'status', 'created_at', 'payment_link_status']
+    list_display_links = ['thumbnail', 'title']
     list_filter = ['status', 'category', 'currency', 'created_at']
+    list_select_related = ['category', 'primary_image']
+    paginator = EstimatedCountPaginator
+    # Skip the second, unfiltered COUNT(*) shown next to filtered results
+    show_full_result_count = False
     search_fields = ['title', 'description']
     prepopulated_fields = {'slug': ('title',)}
     readonly_fields = [
@@ -48,6 +87,10 @@ class ItemAdmin(admin.ModelAdmin):
         'stripe_payment_link_url',
         'stripe_product_id',
         'stripe_price_id',
+        'link_status',
+        'link_attempts',
+        'link_next_attempt_at',
+        'link_error',
         'created_at',
         'updated_at',
         'sold_at',
@@ -62,6 +105,10 @@ class ItemAdmin(admin.ModelAdmin):
                 'stripe_payment_link_url',
                 'stripe_product_id',
                 'stripe_price_id',
+                'link_status',
+                'link_attempts',
+                'link_next_attempt_at',
+                'link_error',
             ),
             'classes': ('collapse',),
         }),
@@ -71,49 +118,126 @@ class ItemAdmin(admin.ModelAdmin):
         }),
     )
     inlines = [ItemImageInline]
+    actions = ['create_missing_links', 'deactivate_links', 'mark_sold', 'relist']
+    
+    def thumbnail(self, obj):
+        """Display the primary image's smallest derivative."""
+        if obj.primary_image_id and obj.primary_image.image:
+            return format_html(
+                '<img src="{}" style="max-width: 60px; max-height: 60px; object-fit: contain;" />',
+                derivative_url(obj.primary_image, 60)
+            )
+        return ''
+    thumbnail.short_description = 'Photo'
     
     def payment_link_status(self, obj):
         """Display payment link status."""
-        if obj.stripe_payment_link_url:
+        if obj.has_payment_link:
             return format_html(
                 '<a href="{}" target="_blank">View Link</a>',
                 obj.stripe_payment_link_url
             )
+        if obj.link_status == Item.LINK_FAILED:
+            return 'Failed'
+        if obj.link_status in (Item.LINK_DEACTIVATING, Item.LINK_DEACTIVATED):
+            return obj.get_link_status_display()
+        if obj.is_live:
+            return 'Pending'
         return 'Not created'
     payment_link_status.short_description = 'Payment Link'
     
+    def create_missing_links(self, request, queryset):
+        """Queue live items without a Payment Link for the worker to create one."""
+        count = requeue_payment_links(queryset)
+        if count:
+            messages.success(request, f'{count} item(s) queued for payment link creation.')
+        else:
+            messages.info(request, 'None of the selected items are waiting for a payment link.')
+    create_missing_links.short_description = 'Create missing payment links'
+    
+    def deactivate_links(self, request, queryset):
+        """Take the selected items' Payment Links down; the worker deactivates them in Stripe."""
+        count = payment_links.deactivate_links(queryset)
+        if count:
+            messages.success(request, f'{count} payment link(s) queued for deactivation.')
+        else:
+            messages.info(request, 'None of the selected items have an active payment link.')
+    deactivate_links.short_description = 'Deactivate payment links'
+    
+    def mark_sold(self, request, queryset):
+        """Mark items as sold; the worker deactivates their Payment Links."""
+        count = payment_links.mark_sold(queryset)
+        if count:
+            messages.success(
+                request,
+                f'{count} item(s) marked as sold. Their payment links will be '
+                'deactivated in the background.'
+            )
+        else:
+            messages.info(request, 'All of the selected items are already sold.')
+    mark_sold.short_description = 'Mark as sold'
+    
+    def relist(self, request, queryset):
+        """Put sold items back on sale; the worker creates their new Payment Links."""
+        relisted, retried = payment_links.relist(queryset)
+        if relisted:
+            messages.success(
+                request,
+                f'{relisted} item(s) relisted. Their new payment links will be '
+                'created in the background.'
+            )
+        # Items whose old link may still be active stay sold
+        skipped = queryset.filter(status=Item.STATUS_SOLD).count()
+        if skipped:
+            retried_note = f' ({retried} after a failed deactivation, now retried)' if retried else ''
+            messages.warning(
+                request,
+                f'{skipped} sold item(s) are still waiting for their old payment link '
+                f'to be deactivated{retried_note}; try again in a minute.'
+            )
+        elif not relisted:
+            messages.info(request, 'None of the selected items are sold.')
+    relist.short_description = 'Relist sold items'
+    
+    def delete_queryset(self, request, queryset):
+        """
+        Bulk delete through Item.delete(), which also unindexes the items,
+        releases their photo files and invalidates cached catalogue pages
+        (queryset.delete() would skip all three).
+        """
+        for item in queryset:
+            item.delete()
+    
+    def get_search_results(self, request, queryset, search_term):
+        """Search titles and descriptions through the full-text index."""
+        if not search_term.strip():
+            return super().get_search_results(request, queryset, search_term)
+        return search_items(queryset, search_term), False
+    
+    def save_related(self, request, form, formsets, change):
+        """Re-sync the denormalized primary image once inline images are saved."""
+        super().save_related(request, form, formsets, change)
+        form.instance.refresh_primary_image()
+    
     def save_model(self, request, obj, form, change):
         """
-        Create Stripe Payment Link when item is saved.
-        Only create if it doesn't already exist.
+        Save the item; its Stripe Payment Link is created by the
+        background worker (store.payment_links).
         
-        The Payment Link will be automatically deactivated after the first
+        Saving an item whose link creation failed queues it again. The
+        Payment Link will be automatically deactivated after the first
         successful payment via webhook to enforce single-payment limit.
         """
-        # Save the item first so it has an ID
         super().save_model(request, obj, form, change)
         
-        # Create Payment Link if it doesn't exist and item has required fields
-        if not obj.stripe_payment_link_id and obj.title and obj.price_amount:
-            try:
-                payment_link_id, payment_link_url, product_id, price_id = \
-                    create_payment_link_for_item(obj)
-                obj.stripe_payment_link_id = payment_link_id
-                obj.stripe_payment_link_url = payment_link_url
-                obj.stripe_product_id = product_id
-                obj.stripe_price_id = price_id
-                obj.save()  # Save again with Stripe fields
-                messages.success(
-                    request,
-                    f'Stripe Payment Link created successfully. '
-                    f'Link: {payment_link_url}'
-                )
-            except Exception as e:
-                messages.error(
-                    request,
-                    f'Error creating Stripe Payment Link: {str(e)}. '
-                    f'Item saved but payment link not created.'
-                )
+        if obj.is_live and not obj.has_payment_link:
+            if obj.link_status == Item.LINK_FAILED:
+                requeue_payment_links(Item.objects.filter(pk=obj.pk))
+            messages.info(
+                request,
+                'The Stripe Payment Link will be created in the background '
+                'and shown here once it is ready.'
+            )
 
 
 @admin.register(ItemImage)
@@ -121,14 +245,114 @@ class ItemImageAdmin(admin.ModelAdmin):
     list_display = ['item', 'image_preview', 'sort_order', 'is_primary', 'created_at']
     list_filter = ['is_primary', 'created_at']
     search_fields = ['item__title']
+    list_select_related = ['item']
+    # Newest first by primary key: answered by the index, no sort
+    ordering = ['-id']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     readonly_fields = ['image_preview']
+    actions = ['make_primary']
+    
+    def make_primary(self, request, queryset):
+        """Make the selected images their items' primary images (one per item)."""
+        chosen = {}
+        for image in queryset.select_related('item').order_by('sort_order', 'created_at'):
+            chosen.setdefault(image.item_id, image)
+        for image in chosen.values():
+            image.item.set_primary_image(image)
+        messages.success(request, f'{len(chosen)} primary image(s) updated.')
+    make_primary.short_description = 'Make primary image'
+    
+    def delete_queryset(self, request, queryset):
+        """
+        Bulk delete through ItemImage.delete(), which moves each item's
+        primary image pointer to a remaining image, releases the files and
+        invalidates cached catalogue pages.
+        """
+        for image in queryset.select_related('item'):
+            image.delete()
     
     def image_preview(self, obj):
         """Display thumbnail preview of image."""
         if obj.pk and obj.image:
             return format_html(
                 '<img src="{}" style="max-width: 150px; max-height: 150px; object-fit: contain;" />',
-                obj.image.url
+                derivative_url(obj, 150)
             )
         return '(No image)'
     image_preview.short_description = 'Preview'
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    """Read-only view of the Stripe webhook inbox."""
+    list_display = ['stripe_event_id', 'event_type', 'status', 'attempts', 'created_at', 'processed_at']
+    list_filter = ['status', 'event_type']
+    search_fields = ['stripe_event_id']
+    readonly_fields = [
+        'stripe_event_id',
+        'event_type',
+        'payload',
+        'status',
+        'attempts',
+        'next_attempt_at',
+        'locked_at',
+        'last_error',
+        'created_at',
+        'processed_at',
+    ]
+    actions = ['retry_events']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def retry_events(self, request, queryset):
+        """Re-queue failed events so the worker picks them up immediately."""
+        count = queryset.exclude(status=WebhookEvent.STATUS_DONE).update(
+            status=WebhookEvent.STATUS_PENDING,
+            attempts=0,
+            next_attempt_at=timezone.now(),
+            locked_at=None,
+        )
+        messages.success(request, f'{count} event(s) queued for retry.')
+    retry_events.short_description = 'Retry selected events'
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    """Read-only view of the email outbox."""
+    list_display = ['subject', 'recipient_list', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['subject', 'recipients']
+    readonly_fields = [
+        'subject',
+        'body',
+        'from_email',
+        'recipients',
+        'status',
+        'attempts',
+        'next_attempt_at',
+        'locked_at',
+        'last_error',
+        'created_at',
+        'sent_at',
+    ]
+    actions = ['retry_emails']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def recipient_list(self, obj):
+        return ', '.join(obj.recipients)
+    recipient_list.short_description = 'To'
+    
+    def retry_emails(self, request, queryset):
+        """Re-queue failed emails so the worker sends them on its next pass."""
+        count = queryset.filter(status=OutboundEmail.STATUS_FAILED).update(
+            status=OutboundEmail.STATUS_PENDING,
+            attempts=0,
+            next_attempt_at=timezone.now(),
+            locked_at=None,
+        )
+        messages.success(request, f'{count} email(s) queued for retry.')
+    retry_emails.short_description = 'Retry selected failed emails'
@@ -0,0 +1,100 @@
+"""
+Versioned cache for catalogue pages.
+
+Rendered list pages (HTML and the infinite-scroll JSON) are cached under
+keys that include a catalogue version. Anything that changes what the
+catalogue shows (saving or deleting items, images or categories, and a
+webhook marking an item SOLD) bumps the version, so every old page key
+is abandoned at once and expires on its own. No pattern deletes are
+needed, so this works the same on locmem, file and Redis backends.
+
+Bumps are deferred to transaction commit so a page can't be cached under
+a new version from data that was later rolled back.
+
+Pages are only cached when CATALOGUE_PAGE_CACHE is on, which settings
+turns off unless a backend shared with the worker is configured: a
+per-process cache would never see the worker's bumps and would serve
+stale pages.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'store:catalogue:version'
+STATS_KEYS = {
+    'hits': 'store:catalogue:hits',
+    'misses': 'store:catalogue:misses',
+}
+
+
+def catalogue_version():
+    """Current catalogue version, initialising it if the cache is empty."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _bump():
+    # A timestamp rather than incr(): unique across processes without
+    # needing an atomic counter, which the file backend can't provide
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def bump_catalogue_version():
+    """Invalidate every cached catalogue page once the current transaction commits."""
+    transaction.on_commit(_bump)
+
+
+def page_cache_enabled():
+    return getattr(settings, 'CATALOGUE_PAGE_CACHE', True)
+
+
+def page_cache_key(variant, params):
+    """
+    Cache key for one catalogue page.
+
+    ``variant`` distinguishes representations (e.g. 'html', 'json') and
+    ``params`` is the request's query dict.
+    """
+    query = '&'.join(f'{k}={v}' for k, v in sorted(params.items()))
+    digest = hashlib.md5(query.encode()).hexdigest()
+    return f'store:catalogue:{catalogue_version()}:{variant}:{digest}'
+
+
+def _count(stat):
+    key = STATS_KEYS[stat]
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr(); drop this sample
+        pass
+
+
+def get_page(key):
+    """Return a cached page or None, recording a hit or miss."""
+    page = cache.get(key)
+    _count('hits' if page is not None else 'misses')
+    return page
+
+
+def set_page(key, page):
+    cache.set(key, page, getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 3600))
+
+
+def cache_stats():
+    """Hit/miss counters since the cache was last cleared."""
+    stats = {name: cache.get(key) or 0 for name, key in STATS_KEYS.items()}
+    total = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / total, 3) if total else 0.0
+    stats['version'] = cache.get(VERSION_KEY)
+    return stats
+
+
+def reset_stats():
+    cache.delete_many(list(STATS_KEYS.values()))
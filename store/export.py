@@ -0,0 +1,379 @@
+"""
+Static-site export of the storefront.
+
+Renders the browsing pages (the item list for every category and page,
+every item detail page and How to buy) through the normal views, and
+writes them to a directory any static host can serve:
+
+- list URLs lose their query strings: /?category=chairs&page=2 becomes
+  /category/chairs/page/2/, each page an index.html;
+- static assets are copied under content-hashed names (css/style.css
+  becomes css/style.<hash>.css) so they can be cached forever;
+- item photos, their derivatives and the catalogue snapshots (which the
+  infinite scroll pages through, see store.snapshots) are copied under
+  their existing (already content-addressed) media paths;
+- anything the export doesn't contain (forms, upload, admin) points at
+  the Django site given as ``dynamic_url``, which keeps handling uploads,
+  admin and webhooks.
+
+Pages are rendered in parallel across processes. A manifest in the output
+directory records a fingerprint of every page's inputs, so later exports
+only render pages whose item, category, template or asset changed, and
+remove pages that no longer exist.
+"""
+import hashlib
+import html
+import json
+import logging
+import math
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.db import connections
+from django.template import engines
+from django.test import Client
+from django.test.utils import override_settings
+
+from .snapshots import (
+    ALL_ITEMS, read_manifest, refresh_snapshots, snapshot_dir, write_atomic,
+)
+from .storage import image_file_names
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.export-manifest.json'
+
+# Bump when the export's own output format changes, to re-render everything
+EXPORT_FORMAT = 1
+
+# Fields that change what an item's pages show; link retry bookkeeping doesn't
+ITEM_FIELDS = [
+    'id', 'slug', 'title', 'description', 'category_id', 'price_amount', 'currency', 'status',
+    'stripe_payment_link_url', 'link_status', 'primary_image_id', 'created_at', 'updated_at', 'sold_at',
+]
+IMAGE_FIELDS = ['id', 'item_id', 'image', 'sort_order', 'is_primary', 'derivatives']
+
+ATTRIBUTE_RE = re.compile(r'(?P<space>\s)(?P<name>href|src|action|srcset|data-[\w-]+)="(?P<value>[^"]*)"')
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def list_page_path(category_slug, page):
+    """Exported path of one item list page."""
+    path = f'/category/{category_slug}/' if category_slug else '/'
+    return path if page == 1 else f'{path}page/{page}/'
+
+
+def page_file(output, path):
+    """File in ``output`` that serves ``path``."""
+    return Path(output, path.strip('/'), 'index.html')
+
+
+def collect_assets():
+    """
+    Return {static name: hashed name} for every file the static finders
+    see, named the way ManifestStaticFilesStorage would.
+    """
+    assets = {}
+    for finder in finders.get_finders():
+        for name, storage in finder.list(['CVS', '.*', '*~']):
+            if name in assets:
+                continue  # The first finder wins, as for {% static %}
+            digest = hashlib.md5()
+            with storage.open(name) as f:
+                for chunk in f.chunks():
+                    digest.update(chunk)
+            root, ext = os.path.splitext(name)
+            assets[name] = f'{root}.{digest.hexdigest()[:12]}{ext}'
+    return assets
+
+
+def _template_digest():
+    digest = hashlib.sha256()
+    for engine in engines.all():
+        for directory in getattr(engine, 'template_dirs', ()):
+            for path in sorted(Path(directory).rglob('*.html')):
+                digest.update(str(path.relative_to(directory)).encode())
+                digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def plan_pages(assets, dynamic_url):
+    """
+    Return {exported path: (request URL, fingerprint)} for every page.
+
+    Three queries: categories, items and images.
+    """
+    from .models import Category, Item, ItemImage
+    from .views import ItemListView
+
+    categories = list(Category.objects.order_by('order', 'name').values_list('slug', 'name', 'order'))
+    site = _digest([EXPORT_FORMAT, _template_digest(), assets, dynamic_url, categories])
+
+    images = {}
+    for image in ItemImage.objects.order_by('sort_order', 'id').values(*IMAGE_FIELDS):
+        images.setdefault(image['item_id'], []).append(image)
+    items = list(
+        Item.objects.order_by('-created_at', '-id')
+        .values(*ITEM_FIELDS, 'category__slug')
+    )
+    item_digests = {item['id']: _digest([item, images.get(item['id'], [])]) for item in items}
+
+    pages = {'/how-to-buy/': ('/how-to-buy/', site)}
+    for item in items:
+        path = f"/item/{item['id']}/"
+        pages[path] = (path, _digest([site, item_digests[item['id']]]))
+
+    files = read_manifest().get('files', {})
+    by_category = {ALL_ITEMS: [item['id'] for item in items]}
+    by_category.update((slug, []) for slug, _, _ in categories)
+    for item in items:
+        if item['category__slug'] is not None:
+            by_category[item['category__slug']].append(item['id'])
+
+    page_size = ItemListView.paginate_by
+    for slug, item_ids in by_category.items():
+        page_count = max(1, math.ceil(len(item_ids) / page_size))
+        for page in range(1, page_count + 1):
+            query = f'category={slug}&page={page}' if slug else f'page={page}'
+            shown = item_ids[(page - 1) * page_size:page * page_size]
+            pages[list_page_path(slug, page)] = (f'/?{query}', _digest([
+                site, slug, page, page_count, files.get(slug), [item_digests[pk] for pk in shown],
+            ]))
+    return pages
+
+
+class PageRenderer:
+    """Renders pages through the test client and rewrites their links."""
+
+    def __init__(self, output, assets, exported_paths, dynamic_url):
+        self.output = Path(output)
+        self.assets = assets
+        self.exported_paths = exported_paths
+        self.dynamic_url = dynamic_url.rstrip('/')
+        self.static_url = settings.STATIC_URL
+        self.media_url = settings.MEDIA_URL
+        self.client = Client()
+
+    def render(self, path, url):
+        """Render one page; return (path, status code, static names used)."""
+        response = self.client.get(url)
+        if response.status_code != 200:
+            return path, response.status_code, set()
+        used = set()
+
+        def rewrite(match):
+            value = self.rewrite_attribute(match['name'], html.unescape(match['value']), used)
+            return f'{match["space"]}{match["name"]}="{html.escape(value)}"'
+
+        content = ATTRIBUTE_RE.sub(rewrite, response.content.decode())
+        target = page_file(self.output, path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(target, content.encode())
+        return path, 200, used
+
+    def rewrite_attribute(self, name, value, used):
+        if name == 'action':
+            # Forms need Django
+            return self.dynamic(value)
+        if name.endswith('srcset'):
+            candidates = []
+            for candidate in value.split(','):
+                url, _, descriptor = candidate.strip().partition(' ')
+                candidates.append(f'{self.rewrite_url(url, used)} {descriptor}'.strip())
+            return ', '.join(candidates)
+        return self.rewrite_url(value, used)
+
+    def dynamic(self, url):
+        return f'{self.dynamic_url}{url}' if self.dynamic_url and url.startswith('/') else url
+
+    def rewrite_url(self, url, used):
+        if url.startswith('?'):
+            url = '/' + url
+        if not url.startswith('/') or url.startswith('//'):
+            return url
+        parts = urlsplit(url)
+        if parts.path.startswith(self.static_url):
+            name = parts.path[len(self.static_url):]
+            if name in self.assets:
+                used.add(name)
+                return self.static_url + self.assets[name]
+            return url
+        if parts.path.startswith(self.media_url):
+            return url
+        if parts.path == '/':
+            params = dict(parse_qsl(parts.query))
+            page = params.pop('page', '1')
+            slug = params.pop('category', '')
+            if not params and page.isdigit():
+                mapped = list_page_path(slug, int(page))
+                if mapped in self.exported_paths:
+                    return mapped
+        elif not parts.query and parts.path in self.exported_paths:
+            return url
+        return self.dynamic(url)
+
+
+_renderer = None
+
+
+def _worker_settings():
+    return override_settings(
+        # Every page renders afresh, not from the shared catalogue cache
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+        ALLOWED_HOSTS=['testserver'],
+        # Plain /static/ URLs; the export hashes them itself
+        STORAGES={**settings.STORAGES, 'staticfiles': {
+            'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+        }},
+        PERFORMANCE_INSTRUMENTATION=False,
+        CATALOGUE_SNAPSHOTS=True,
+    )
+
+
+def _init_worker(output, assets, exported_paths, dynamic_url):
+    global _renderer
+    import django
+    django.setup()
+    _worker_settings().enable()
+    _renderer = PageRenderer(output, assets, exported_paths, dynamic_url)
+
+
+def _render_page(page):
+    return _renderer.render(*page)
+
+
+def render_pages(output, pages, assets, exported_paths, dynamic_url, workers):
+    """Render ``pages`` ([(path, url)]), across ``workers`` processes if more than one."""
+    if workers < 2 or len(pages) < 2:
+        with _worker_settings():
+            renderer = PageRenderer(output, assets, exported_paths, dynamic_url)
+            return [renderer.render(*page) for page in pages]
+    # Children must open their own database connections
+    connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(str(output), assets, exported_paths, dynamic_url),
+    ) as pool:
+        return list(pool.map(_render_page, pages, chunksize=max(1, len(pages) // (workers * 4))))
+
+
+def _copy_if_changed(source, target):
+    """Copy ``source`` over ``target`` unless it's already there; True if copied."""
+    try:
+        st = os.stat(source)
+    except FileNotFoundError:
+        logger.warning("Not exported, file missing: %s", source)
+        return False
+    try:
+        existing = os.stat(target)
+        if existing.st_size == st.st_size and existing.st_mtime_ns == st.st_mtime_ns:
+            return False
+    except FileNotFoundError:
+        target.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(source, target)
+    return True
+
+
+def copy_static(output, assets, names):
+    """Copy the used static files under their hashed names."""
+    copied = 0
+    static_root = Path(output, settings.STATIC_URL.strip('/'))
+    for name in names:
+        copied += _copy_if_changed(finders.find(name), static_root / assets[name])
+    return copied
+
+
+def copy_media(output):
+    """Copy every item photo, derivative and current catalogue snapshot."""
+    from .models import ItemImage
+
+    target_root = Path(output, settings.MEDIA_URL.strip('/'))
+    storage = ItemImage._meta.get_field('image').storage
+    sources = {}
+    for image, derivatives in ItemImage.objects.values_list('image', 'derivatives'):
+        for name in image_file_names(image, derivatives):
+            sources[name] = storage.path(name)
+    directory = snapshot_dir().relative_to(settings.MEDIA_ROOT)
+    for name in read_manifest().get('files', {}).values():
+        for suffix in ('', '.gz', '.br'):
+            source = snapshot_dir() / f'{name}{suffix}'
+            if source.exists():
+                sources[f'{directory}/{name}{suffix}'] = source
+    return sum(_copy_if_changed(source, target_root / name) for name, source in sorted(sources.items()))
+
+
+def _remove_page(output, path):
+    target = page_file(output, path)
+    try:
+        target.unlink()
+    except FileNotFoundError:
+        return
+    # Drop directories the page leaves empty
+    parent = target.parent
+    while parent != Path(output):
+        try:
+            parent.rmdir()
+        except OSError:
+            break
+        parent = parent.parent
+
+
+def export_site(output, workers=1, full=False, dynamic_url=''):
+    """
+    Export the storefront to ``output``; return a dict of counts
+    (rendered, unchanged, removed, failed, static, media).
+    """
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    manifest_path = output / MANIFEST_NAME
+    try:
+        previous = {} if full else json.loads(manifest_path.read_text()).get('pages', {})
+    except (OSError, ValueError):
+        previous = {}
+
+    # The exported lists always scroll through snapshots, whether or not
+    # the site itself uses them
+    with override_settings(CATALOGUE_SNAPSHOTS=True):
+        refresh_snapshots()
+
+    assets = collect_assets()
+    pages = plan_pages(assets, dynamic_url)
+    stale = [
+        (path, url) for path, (url, fingerprint) in pages.items()
+        if previous.get(path) != fingerprint or not page_file(output, path).exists()
+    ]
+    results = render_pages(output, stale, assets, frozenset(pages), dynamic_url, workers)
+
+    failed = {path for path, status, _ in results if status != 200}
+    for path, status, _ in results:
+        if status != 200:
+            logger.error("Export of %s failed with status %s", path, status)
+    used = set()
+    for _, _, names in results:
+        used |= names
+    removed = [path for path in previous if path not in pages]
+    for path in removed:
+        _remove_page(output, path)
+
+    counts = {
+        'rendered': len(results) - len(failed),
+        'unchanged': len(pages) - len(stale),
+        'removed': len(removed),
+        'failed': len(failed),
+        'static': copy_static(output, assets, used),
+        'media': copy_media(output),
+    }
+    write_atomic(manifest_path, json.dumps({
+        'pages': {path: fingerprint for path, (_, fingerprint) in pages.items() if path not in failed},
+    }, indent=2, sort_keys=True).encode())
+    return counts
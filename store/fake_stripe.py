@@ -0,0 +1,194 @@
+"""
+Local stand-in for the parts of the Stripe API the store uses.
+
+FakeStripeServer answers the calls stripe_service makes (create price,
+create payment link, deactivate payment link, list a checkout session's
+line items) from memory, with configurable latency and injected errors,
+so link creation, webhooks and sale bursts can be load-tested offline.
+Point the app at it with STRIPE_API_BASE (see the fake_stripe command).
+
+Like Stripe, a create sent again with the same Idempotency-Key returns
+the original object. A checkout session id made by session_id_for_price()
+lists that price as its line item, for exercising the line-item fallback
+in handle_checkout_session_completed.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+ROUTES = [
+    ('POST', re.compile(r'^/v1/prices$'), 'create_price'),
+    ('POST', re.compile(r'^/v1/payment_links$'), 'create_payment_link'),
+    ('POST', re.compile(r'^/v1/payment_links/(?P<id>[^/]+)$'), 'update_payment_link'),
+    ('GET', re.compile(r'^/v1/checkout/sessions/(?P<id>[^/]+)/line_items$'), 'list_line_items'),
+]
+
+
+def session_id_for_price(price_id, token=''):
+    """A checkout session id whose line item is ``price_id``."""
+    return f"cs_fake{token or uuid.uuid4().hex[:8]}_{price_id}"
+
+
+def _price_for_session(session_id):
+    _, separator, price = session_id.partition('_price_')
+    return f"price_{price}" if separator else None
+
+
+def _new_id(prefix):
+    return f"{prefix}_fake{uuid.uuid4().hex[:16]}"
+
+
+class FakeStripe:
+    """The fake's state and behaviour, independent of HTTP."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.prices = {}
+        self.payment_links = {}
+        self.idempotent = {}
+        self.stats = Counter()
+
+    def delay(self):
+        with self.lock:
+            seconds = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def injected_error(self):
+        """(status, error body) to fail this call with, or None."""
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return 429, {'type': 'invalid_request_error', 'code': 'rate_limit', 'message': 'Too many requests (injected)'}
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500, {'type': 'api_error', 'message': 'Internal error (injected)'}
+        return None
+
+    def handle(self, method, path, params, idempotency_key=None):
+        """Return (status, body) for one API call."""
+        for route_method, pattern, name in ROUTES:
+            match = pattern.match(path)
+            if match and route_method == method:
+                break
+        else:
+            return 404, {'error': {'type': 'invalid_request_error', 'message': f'Unrecognized request URL ({method} {path})'}}
+
+        self.delay()
+        error = self.injected_error()
+        with self.lock:
+            self.stats[name] += 1
+            if error:
+                self.stats[f'{name} ({error[0]})'] += 1
+                return error[0], {'error': error[1]}
+            if idempotency_key and (name, idempotency_key) in self.idempotent:
+                self.stats['idempotent replays'] += 1
+                return 200, self.idempotent[name, idempotency_key]
+            status, body = getattr(self, name)(params, **match.groupdict())
+            if idempotency_key and status == 200:
+                self.idempotent[name, idempotency_key] = body
+            return status, body
+
+    def create_price(self, params):
+        price = {
+            'id': _new_id('price'),
+            'object': 'price',
+            'active': True,
+            'currency': params.get('currency', 'nzd'),
+            'unit_amount': int(params.get('unit_amount', 0)),
+            'product': _new_id('prod'),
+            'type': 'one_time',
+        }
+        self.prices[price['id']] = price
+        return 200, price
+
+    def create_payment_link(self, params):
+        link_id = _new_id('plink')
+        link = {
+            'id': link_id,
+            'object': 'payment_link',
+            'active': True,
+            'url': f"https://buy.stripe.com/test_{link_id}",
+            'metadata': {
+                key[len('metadata['):-1]: value
+                for key, value in params.items() if key.startswith('metadata[')
+            },
+            'price': params.get('line_items[0][price]'),
+        }
+        self.payment_links[link_id] = link
+        return 200, link
+
+    def update_payment_link(self, params, id):
+        link = self.payment_links.get(id)
+        if link is None:
+            # Links made by another run of the fake (or real Stripe): accept them
+            link = self.payment_links[id] = {'id': id, 'object': 'payment_link', 'active': True, 'url': ''}
+        if 'active' in params:
+            link['active'] = params['active'] == 'true'
+        return 200, link
+
+    def list_line_items(self, params, id):
+        price_id = _price_for_session(id)
+        data = []
+        if price_id:
+            data.append({
+                'id': _new_id('li'),
+                'object': 'item',
+                'quantity': 1,
+                'price': self.prices.get(price_id) or {'id': price_id, 'object': 'price'},
+            })
+        return 200, {'object': 'list', 'data': data, 'has_more': False, 'url': f'/v1/checkout/sessions/{id}/line_items'}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _respond(self, method):
+        url = urlparse(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        params = dict(parse_qsl(body or url.query, keep_blank_values=True))
+        status, payload = self.server.fake.handle(method, url.path, params, self.headers.get('Idempotency-Key'))
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Request-Id', _new_id('req'))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._respond('GET')
+
+    def do_POST(self):
+        self._respond('POST')
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    """HTTP front end for FakeStripe; port 0 picks a free port."""
+
+    daemon_threads = True
+
+    def __init__(self, fake, host='127.0.0.1', port=0, verbose=False):
+        self.fake = fake
+        self.verbose = verbose
+        super().__init__((host, port), _Handler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
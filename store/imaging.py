@@ -0,0 +1,318 @@
+"""
+Responsive image derivatives for item photos.
+
+Phone uploads can be several megabytes. When an ItemImage is saved we
+render a handful of smaller widths (as JPEG and WebP) with Pillow and
+record their storage names on the image, so templates and the JSON feed
+can hand browsers a srcset instead of the original file.
+
+Uploads are normalized first (EXIF rotation applied, metadata such as GPS
+position stripped, long edge capped, re-encoded), so the stored original
+is smaller and leaks nothing. Batches of uploads are processed across a
+process pool (see save_uploads).
+"""
+import io
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WIDTHS = (320, 640, 1280)
+FORMATS = {
+    'jpeg': {'ext': 'jpg', 'mime': 'image/jpeg', 'options': {'quality': 82, 'optimize': True, 'progressive': True}},
+    'webp': {'ext': 'webp', 'mime': 'image/webp', 'options': {'quality': 80, 'method': 4}},
+}
+DERIVATIVES_DIR = 'items/derivatives'
+
+
+def get_widths():
+    """Return the configured derivative widths, smallest first."""
+    return sorted(getattr(settings, 'ITEM_IMAGE_WIDTHS', DEFAULT_WIDTHS))
+
+
+def normalization_options():
+    """Settings for normalize_image, read in the parent so children need no Django."""
+    return {
+        'max_edge': getattr(settings, 'ITEM_IMAGE_MAX_EDGE', 2048),
+        'quality': getattr(settings, 'ITEM_IMAGE_QUALITY', 85),
+    }
+
+
+def _normalized(source, max_edge):
+    """Upright copy of ``source`` with its long edge capped at ``max_edge``."""
+    long_edge = max(source.size)
+    if long_edge > max_edge:
+        # JPEGs can decode at 1/2, 1/4 or 1/8 scale, far cheaper than a
+        # full decode and resample; allow landing up to a quarter under
+        # max_edge to take advantage of it
+        scale = max_edge * 0.75 / long_edge
+        source.draft('RGB', (math.ceil(source.width * scale), math.ceil(source.height * scale)))
+    image = ImageOps.exif_transpose(source)
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return image
+
+
+def _encode_normalized(image, quality, icc_profile):
+    buffer = io.BytesIO()
+    extra = {'icc_profile': icc_profile} if icc_profile else {}
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if has_alpha:
+        image.convert('RGBA').save(buffer, 'PNG', optimize=True, **extra)
+        return buffer.getvalue(), 'png'
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True, **extra)
+    return buffer.getvalue(), 'jpg'
+
+
+def normalize_image(data, max_edge=2048, quality=85):
+    """
+    Normalize an uploaded photo.
+
+    Applies EXIF orientation, drops all metadata (EXIF, GPS, comments;
+    the ICC colour profile is kept), shrinks the long edge to ``max_edge``
+    and re-encodes. Images with transparency stay PNG, everything else
+    becomes a progressive JPEG. Animated GIFs keep their first frame.
+
+    Pure Pillow work. Returns (bytes, extension).
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        icc_profile = source.info.get('icc_profile')
+        return _encode_normalized(_normalized(source, max_edge), quality, icc_profile)
+
+
+def prepare_upload(data, max_edge, quality, widths):
+    """
+    Normalize one upload and render its derivatives.
+
+    Runs in a pool process: takes and returns only plain data. Returns
+    {'content': bytes, 'ext': str, 'derivatives': render_derivatives(...)}.
+    Derivatives are rendered from the normalized image already in memory
+    rather than decoding the upload again.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        icc_profile = source.info.get('icc_profile')
+        image = _normalized(source, max_edge)
+        content, ext = _encode_normalized(image, quality, icc_profile)
+        return {
+            'content': content,
+            'ext': ext,
+            'derivatives': _render(image, widths),
+        }
+
+
+def render_derivatives(fileobj, widths=None):
+    """
+    Render resized copies of an image.
+
+    Pure Pillow work with no database or storage access, so it is safe to
+    call from worker threads or processes.
+
+    Returns a dict of {width: {'height': int, 'jpeg': bytes, 'webp': bytes}}.
+    Widths larger than the original are skipped; if every width is larger,
+    a single derivative at the original width is produced instead.
+    """
+    widths = widths or get_widths()
+    with Image.open(fileobj) as source:
+        return _render(ImageOps.exif_transpose(source), widths)
+
+
+def _render(image, widths):
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    original_width, original_height = image.size
+
+    targets = [w for w in widths if w <= original_width] or [original_width]
+    rendered = {}
+    # Largest first, each resized from the previous one: cheaper than
+    # resampling the full image every time
+    base = image
+    for width in sorted(targets, reverse=True):
+        height = max(1, round(original_height * width / original_width))
+        resized = base if width == base.width else base.resize((width, height), Image.LANCZOS)
+        entry = {'height': height}
+        for fmt, spec in FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, fmt.upper(), **spec['options'])
+            entry[fmt] = buffer.getvalue()
+        rendered[width] = entry
+        base = resized
+    return rendered
+
+
+def derivative_name(source_name, width, fmt):
+    """Storage name for one derivative of the given source file."""
+    stem = os.path.splitext(os.path.basename(source_name))[0]
+    return f"{DERIVATIVES_DIR}/{stem}-{width}w.{FORMATS[fmt]['ext']}"
+
+
+def store_derivatives(source_name, rendered, storage):
+    """
+    Write rendered derivatives to storage.
+
+    Returns the dict recorded on ItemImage.derivatives:
+    {'<width>': {'height': int, 'jpeg': name, 'webp': name}}.
+    """
+    derivatives = {}
+    for width, entry in rendered.items():
+        record = {'height': entry['height']}
+        for fmt in FORMATS:
+            name = derivative_name(source_name, width, fmt)
+            record[fmt] = storage.save(name, ContentFile(entry[fmt]))
+        derivatives[str(width)] = record
+    return derivatives
+
+
+def generate_derivatives(item_image):
+    """
+    Render and store derivatives for an ItemImage and record them on the row.
+
+    Uses update() so the image's save() is not re-entered. Derivatives
+    from an earlier render that are no longer needed are released.
+    """
+    from .models import ItemImage
+    from .storage import image_file_names, release_files
+
+    field = item_image.image
+    previous = image_file_names(None, item_image.derivatives)
+    field.open('rb')
+    try:
+        rendered = render_derivatives(field)
+    finally:
+        field.close()
+    derivatives = store_derivatives(field.name, rendered, field.storage)
+    ItemImage.objects.filter(pk=item_image.pk).update(derivatives=derivatives)
+    item_image.derivatives = derivatives
+    release_files(field.name, previous - image_file_names(None, derivatives), field.storage, item_image.pk)
+    return derivatives
+
+
+def has_current_derivatives(item_image):
+    """True if every configured width (that fits the original) has been rendered."""
+    if not item_image.derivatives:
+        return False
+    recorded = {int(w) for w in item_image.derivatives}
+    largest = max(recorded)
+    return all(w in recorded for w in get_widths() if w <= largest)
+
+
+def _sorted_entries(item_image):
+    return sorted(
+        ((int(w), entry) for w, entry in (item_image.derivatives or {}).items()),
+        key=lambda pair: pair[0],
+    )
+
+
+def build_srcset(item_image, fmt='jpeg'):
+    """Return a srcset string for an ItemImage, or '' if it has no derivatives."""
+    storage = item_image.image.storage
+    return ', '.join(
+        f"{storage.url(entry[fmt])} {width}w"
+        for width, entry in _sorted_entries(item_image)
+        if entry.get(fmt)
+    )
+
+
+def derivative_url(item_image, min_width=0, fmt='jpeg'):
+    """
+    URL of the smallest derivative at least ``min_width`` wide.
+
+    Falls back to the largest derivative, then to the original upload.
+    """
+    entries = _sorted_entries(item_image)
+    if not entries:
+        return item_image.image.url if item_image.image else ''
+    chosen = next((entry for width, entry in entries if width >= min_width), entries[-1][1])
+    return item_image.image.storage.url(chosen[fmt])
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.IMAGE_PROCESS_WORKERS)
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def prepare_uploads(blobs):
+    """
+    prepare_upload() for several uploads, in parallel when there is more
+    than one. Results are in the same order as ``blobs``.
+    """
+    prepare = partial(prepare_upload, widths=get_widths(), **normalization_options())
+    if len(blobs) < 2 or settings.IMAGE_PROCESS_WORKERS < 2:
+        return [prepare(blob) for blob in blobs]
+    try:
+        return list(_get_pool().map(prepare, blobs))
+    except BrokenProcessPool:
+        # A child died (e.g. killed for memory); start a fresh pool next
+        # time and finish this batch here
+        logger.exception("Image process pool broke; processing uploads inline")
+        _reset_pool()
+        return [prepare(blob) for blob in blobs]
+
+
+def save_uploads(item, files):
+    """
+    Store uploaded photos for an item: the first becomes the primary image.
+
+    Photos are normalized and their derivatives rendered across the
+    process pool, then written to storage and inserted with a single
+    bulk_create. Returns the created ItemImages.
+    """
+    from .cache import bump_catalogue_version
+    from .models import Item, ItemImage
+
+    prepared = prepare_uploads([upload.read() for upload in files])
+
+    # Only an item without photos gets a new primary image
+    first_is_primary = item.primary_image_id is None
+    field = ItemImage._meta.get_field('image')
+    images = []
+    for index, (upload, result) in enumerate(zip(files, prepared)):
+        stem = os.path.splitext(os.path.basename(upload.name))[0] or 'photo'
+        image = ItemImage(item=item, sort_order=index, is_primary=(first_is_primary and index == 0))
+        name = field.generate_filename(image, f"{stem}.{result['ext']}")
+        image.image.name = field.storage.save(name, ContentFile(result['content']))
+        image.derivatives = store_derivatives(image.image.name, result['derivatives'], field.storage)
+        images.append(image)
+
+    # bulk_create skips ItemImage.save(): the rows arrive with is_primary
+    # already right, so only the item's pointer needs writing. A concurrent
+    # upload that also claimed primary fails on the one-primary constraint.
+    with transaction.atomic():
+        images = ItemImage.objects.bulk_create(images)
+        if first_is_primary and images:
+            if images[0].pk is None:
+                # Backend can't return ids from a bulk insert (MySQL)
+                item.refresh_primary_image()
+            else:
+                item._point_to_primary(images[0])
+        else:
+            Item.objects.filter(pk=item.pk).update(updated_at=timezone.now())
+    bump_catalogue_version()
+    return images
@@ -0,0 +1,173 @@
+"""
+Email outbox.
+
+Code that needs to send email calls enqueue_email(), which only inserts
+an OutboundEmail row. The run_worker command calls send_pending_emails()
+to deliver due messages over one reused SMTP connection, retrying
+failures with backoff and staying under EMAIL_DAILY_QUOTA (Brevo's free
+tier allows 300 emails/day).
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Min
+from django.utils import timezone
+
+from .models import OutboundEmail
+from .performance import timed
+from .retry import next_attempt_at
+
+logger = logging.getLogger(__name__)
+
+# A SENDING message whose worker hasn't finished after this long is
+# assumed to belong to a crashed worker and may be claimed again
+SENDING_TIMEOUT = timedelta(minutes=10)
+
+
+def enqueue_email(subject, body, from_email, recipients):
+    """Queue an email for the worker to send."""
+    return OutboundEmail.objects.create(
+        subject=subject[:255],
+        body=body,
+        from_email=from_email,
+        recipients=list(recipients),
+    )
+
+
+def quota_remaining(now=None):
+    """Emails that can still be sent within the rolling 24-hour quota."""
+    now = now or timezone.now()
+    sent = OutboundEmail.objects.filter(
+        status=OutboundEmail.STATUS_SENT,
+        sent_at__gte=now - timedelta(days=1),
+    ).count()
+    return max(0, settings.EMAIL_DAILY_QUOTA - sent)
+
+
+def _due(now):
+    return (
+        OutboundEmail.objects.filter(
+            status=OutboundEmail.STATUS_PENDING,
+            next_attempt_at__lte=now,
+        )
+        | OutboundEmail.objects.filter(
+            status=OutboundEmail.STATUS_SENDING,
+            locked_at__lt=now - SENDING_TIMEOUT,
+        )
+    )
+
+
+def _claim(message, now):
+    """Atomically claim a message; False if another worker has it."""
+    claimed = _due(now).filter(pk=message.pk).update(
+        status=OutboundEmail.STATUS_SENDING,
+        locked_at=now,
+        attempts=F('attempts') + 1,
+    ) == 1
+    if claimed:
+        message.attempts += 1
+    return claimed
+
+
+def send_pending_emails(limit=50):
+    """
+    Send due emails from the outbox over a single connection.
+
+    Returns the number of messages attempted (sent or failed).
+    """
+    now = timezone.now()
+    limit = min(limit, quota_remaining(now))
+    if limit <= 0:
+        if _due(now).exists():
+            logger.warning("Daily email quota of %s reached; holding queued emails", settings.EMAIL_DAILY_QUOTA)
+        return 0
+
+    batch = [m for m in _due(now).order_by('created_at')[:limit] if _claim(m, now)]
+    if not batch:
+        return 0
+
+    max_attempts = getattr(settings, 'EMAIL_MAX_ATTEMPTS', 6)
+    sent = failed = 0
+    started = time.monotonic()
+    connection = get_connection()
+    reconnect = False
+    try:
+        with timed('smtp'):
+            connection.open()
+        for message in batch:
+            if reconnect:
+                # The connection may be unusable after an error; start a fresh one
+                connection.close()
+                with timed('smtp'):
+                    connection.open()
+                reconnect = False
+            try:
+                with timed('smtp'):
+                    connection.send_messages([EmailMessage(
+                        message.subject,
+                        message.body,
+                        message.from_email,
+                        message.recipients,
+                    )])
+            except Exception as e:
+                logger.error(
+                    "Failed to send email %s to %s (attempt %s): %s",
+                    message.pk, ', '.join(message.recipients), message.attempts, e,
+                )
+                message.last_error = f"{type(e).__name__}: {e}"
+                if message.attempts >= max_attempts:
+                    message.status = OutboundEmail.STATUS_FAILED
+                else:
+                    message.status = OutboundEmail.STATUS_PENDING
+                    message.next_attempt_at = next_attempt_at(message.attempts, base=30)
+                failed += 1
+                reconnect = True
+            else:
+                message.status = OutboundEmail.STATUS_SENT
+                message.sent_at = timezone.now()
+                message.last_error = ''
+                sent += 1
+                logger.info("Email %s sent to %s", message.pk, ', '.join(message.recipients))
+            message.locked_at = None
+            message.save(update_fields=[
+                'status', 'attempts', 'next_attempt_at', 'locked_at', 'last_error', 'sent_at',
+            ])
+    except Exception:
+        # Couldn't connect at all: put unsent messages back for a later retry
+        logger.exception("Email connection failed")
+        unsent = [m.pk for m in batch if m.status == OutboundEmail.STATUS_SENDING]
+        OutboundEmail.objects.filter(pk__in=unsent).update(
+            status=OutboundEmail.STATUS_PENDING,
+            locked_at=None,
+            next_attempt_at=next_attempt_at(1, base=30),
+        )
+        failed += len(unsent)
+    finally:
+        connection.close()
+
+    logger.info(
+        "Email batch: %s sent, %s failed in %.2fs", sent, failed, time.monotonic() - started
+    )
+    return sent + failed
+
+
+def outbox_metrics():
+    """Snapshot of outbox health, e.g. for the email_outbox command or monitoring."""
+    now = timezone.now()
+    pending = OutboundEmail.objects.filter(status=OutboundEmail.STATUS_PENDING)
+    oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+    return {
+        'pending': pending.count(),
+        'sending': OutboundEmail.objects.filter(status=OutboundEmail.STATUS_SENDING).count(),
+        'failed': OutboundEmail.objects.filter(status=OutboundEmail.STATUS_FAILED).count(),
+        'sent_24h': OutboundEmail.objects.filter(
+            status=OutboundEmail.STATUS_SENT,
+            sent_at__gte=now - timedelta(days=1),
+        ).count(),
+        'daily_quota': settings.EMAIL_DAILY_QUOTA,
+        'quota_remaining': quota_remaining(now),
+        'oldest_pending_seconds': int((now - oldest).total_seconds()) if oldest else 0,
+    }
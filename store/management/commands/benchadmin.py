@@ -0,0 +1,147 @@
+"""
+Query-count benchmark for the store's admin changelists.
+
+Renders the first changelist page of each store model as a superuser and
+reports the queries and time it took, failing if a page runs more
+queries than --max-queries. The count must not depend on the number of
+rows, so --seed adds that many scratch items (with categories and two
+images each) inside a transaction that is rolled back afterwards, which
+makes a per-row query show up clearly. Safe to run against any database.
+"""
+import statistics
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from store.models import Category, Item, ItemImage, OutboundEmail, WebhookEvent
+
+MODELS = [Category, Item, ItemImage, WebhookEvent, OutboundEmail]
+
+
+class Rollback(Exception):
+    """Raised to roll back the scratch rows once the pages are measured."""
+
+
+class Command(BaseCommand):
+    help = 'Count the queries each store admin changelist page runs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Add this many scratch items (rolled back afterwards) before measuring.',
+        )
+        parser.add_argument(
+            '--max-queries', type=int, default=12,
+            help='Fail if a changelist page runs more queries than this (default: 12).',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Render each page this many times for the timing (default: 5).',
+        )
+        parser.add_argument(
+            '--search', default='',
+            help='Also measure changelists searched for this term.',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    self._seed(options['seed'])
+                failures = self._measure(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        if failures:
+            raise CommandError(
+                f'{len(failures)} changelist(s) over {options["max_queries"]} queries: '
+                f'{", ".join(failures)}'
+            )
+        self.stdout.write(self.style.SUCCESS('All changelists within the query budget.'))
+
+    def _measure(self, options):
+        user = get_user_model()(username='benchadmin', is_staff=True, is_superuser=True, is_active=True)
+        factory = RequestFactory()
+        failures = []
+        for model in MODELS:
+            model_admin = admin.site._registry[model]
+            url = f'/admin/{model._meta.app_label}/{model._meta.model_name}/'
+            params = {'q': options['search']} if options['search'] and model_admin.search_fields else {}
+            timings = []
+            for _ in range(max(1, options['repeat'])):
+                request = factory.get(url, params)
+                request.user = user
+                request.session = SessionStore()
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = model_admin.changelist_view(request)
+                    response.render()
+                    timings.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} returned {response.status_code}')
+            queries = len(captured.captured_queries)
+            line = (
+                f'{model._meta.verbose_name_plural}: {queries} queries, '
+                f'median {statistics.median(timings) * 1000:.1f}ms over {len(timings)} run(s)'
+            )
+            if queries > options['max_queries']:
+                failures.append(str(model._meta.verbose_name_plural))
+                self.stderr.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        return failures
+
+    def _seed(self, count):
+        token = uuid.uuid4().hex[:8]
+        categories = Category.objects.bulk_create(
+            Category(name=f'Bench {token} {n}', slug=f'bench-{token}-{n}') for n in range(10)
+        )
+        items = Item.objects.bulk_create(
+            (
+                Item(
+                    title=f'Bench item {n}',
+                    slug=f'bench-{token}-{n}',
+                    description='Scratch item for benchadmin',
+                    price_amount=Decimal('10.00'),
+                    category=categories[n % len(categories)],
+                )
+                for n in range(count)
+            ),
+            batch_size=500,
+        )
+        # Rows only: the files don't need to exist to list them
+        derivatives = {'320': {
+            'height': 240,
+            'jpeg': f'items/derivatives/bench-{token}-320w.jpg',
+            'webp': f'items/derivatives/bench-{token}-320w.webp',
+        }}
+        ItemImage.objects.bulk_create(
+            (
+                ItemImage(
+                    item=item,
+                    image=f'items/bench-{token}-{item.pk}-{n}.jpg',
+                    sort_order=n,
+                    is_primary=(n == 0),
+                    derivatives=derivatives,
+                )
+                for item in Item.objects.filter(slug__startswith=f'bench-{token}-')
+                for n in range(2)
+            ),
+            batch_size=500,
+        )
+        Item.objects.filter(slug__startswith=f'bench-{token}-').update(
+            primary_image=Subquery(
+                ItemImage.objects.filter(item=OuterRef('pk'), is_primary=True).values('pk')[:1]
+            )
+        )
+        self.stdout.write(f'Seeded {len(items)} items and {2 * len(items)} images (rolled back afterwards).')
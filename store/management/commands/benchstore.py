@@ -0,0 +1,271 @@
+"""
+Catalogue benchmark with query and latency budgets.
+
+Creates a scratch test database (like the test runner does), seeds a
+synthetic catalogue into it and drives the main paths through the Django
+test client: the item list, a category-filtered list, the infinite-scroll
+JSON and catalogue snapshot, item detail, item creation (with a photo)
+and the Stripe webhook.
+For each it reports p50/p95 latency, throughput and queries per request,
+then checks them against store/bench_budgets.json. A path that runs more
+queries than its budget (a new N+1 on primary_image, say) fails the run.
+
+The page cache is replaced with a dummy cache so every request renders,
+uploads go to a temporary MEDIA_ROOT and Stripe is not called. The real
+database and media are never touched.
+"""
+import io
+import json
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import OuterRef, Subquery
+from django.test import Client, RequestFactory
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from PIL import Image
+
+from store.media import serve_media
+from store.snapshots import refresh_snapshots, snapshot_url
+from store.webhooks import signature_header
+
+BUDGETS_PATH = Path(__file__).resolve().parents[2] / 'bench_budgets.json'
+WEBHOOK_SECRET = 'whsec_benchstore'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the catalogue paths on a seeded scratch database and check the budgets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=2000, help='Items to seed (default: 2000).')
+        parser.add_argument('--categories', type=int, default=12, help='Categories to seed (default: 12).')
+        parser.add_argument('--images', type=int, default=3, help='Images per item (default: 3).')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per path (default: 50).')
+        parser.add_argument(
+            '--budgets', default=str(BUDGETS_PATH),
+            help='Budgets file (default: store/bench_budgets.json).',
+        )
+        parser.add_argument(
+            '--skip-latency', action='store_true',
+            help='Only check query budgets (latency depends on the machine).',
+        )
+        parser.add_argument(
+            '--write-budgets', action='store_true',
+            help='Write the measured query counts, and 3x the measured p95 (at least 50ms), to the budgets file.',
+        )
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp(prefix='benchstore-')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        setup_test_environment()
+        try:
+            with override_settings(
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+                MEDIA_ROOT=media_root,
+                STRIPE_SECRET_KEY='',
+                STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+                IMAGE_PROCESS_WORKERS=1,
+                PERFORMANCE_INSTRUMENTATION=False,
+                # As deployed, with a shared cache (which the dummy one
+                # stands in for, missing every time)
+                CATALOGUE_PAGE_CACHE=True,
+                CATALOGUE_SNAPSHOTS=True,
+            ):
+                started = time.perf_counter()
+                self.seed(options['items'], options['categories'], options['images'])
+                self.stdout.write(
+                    f"Seeded {options['items']} items, {options['categories']} categories and "
+                    f"{options['items'] * options['images']} images in {time.perf_counter() - started:.1f}s"
+                )
+                results = self.run_paths(max(1, options['requests']))
+        finally:
+            teardown_test_environment()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.report(results)
+        if options['write_budgets']:
+            self.write_budgets(options['budgets'], results)
+            return
+        self.check_budgets(options['budgets'], results, options['skip_latency'])
+
+    def seed(self, item_count, category_count, images_per_item):
+        from store.models import Category, Item, ItemImage
+
+        self.categories = Category.objects.bulk_create(
+            Category(name=f'Category {n}', slug=f'category-{n}', order=n) for n in range(category_count)
+        )
+        Item.objects.bulk_create(
+            (
+                Item(
+                    title=f'Bench item {n}',
+                    slug=f'bench-item-{n}',
+                    description='A synthetic item for benchmarking. ' * 5,
+                    price_amount=Decimal(10 + n % 90),
+                    category=self.categories[n % category_count] if category_count else None,
+                    status=Item.STATUS_SOLD if n % 7 == 0 else Item.STATUS_LIVE,
+                    link_status=Item.LINK_READY,
+                    stripe_payment_link_id=f'plink_bench_{n}',
+                    stripe_payment_link_url=f'https://buy.stripe.com/bench_{n}',
+                )
+                for n in range(item_count)
+            ),
+            batch_size=500,
+        )
+        # Rows only: templates build URLs from the names, no files needed
+        ItemImage.objects.bulk_create(
+            (
+                ItemImage(
+                    item_id=pk,
+                    image=f'items/bench-{pk}-{n}.jpg',
+                    sort_order=n,
+                    is_primary=(n == 0),
+                    derivatives={
+                        str(width): {
+                            'height': width * 3 // 4,
+                            'jpeg': f'items/derivatives/bench-{pk}-{n}-{width}w.jpg',
+                            'webp': f'items/derivatives/bench-{pk}-{n}-{width}w.webp',
+                        }
+                        for width in (320, 640, 1280)
+                    },
+                )
+                for pk in Item.objects.values_list('pk', flat=True)
+                for n in range(images_per_item)
+            ),
+            batch_size=500,
+        )
+        Item.objects.update(primary_image=Subquery(
+            ItemImage.objects.filter(item=OuterRef('pk'), is_primary=True).values('pk')[:1]
+        ))
+        self.item_pks = list(Item.objects.values_list('pk', flat=True))
+        refresh_snapshots(force=True)
+
+    def run_paths(self, count):
+        client = Client()
+        uploader = Client()
+        session = uploader.session
+        session['item_upload_authenticated'] = True
+        session.save()
+        categories = [c.slug for c in self.categories] or ['']
+        items = self.item_pks or [0]
+        photo = self.photo()
+        snapshot_path = snapshot_url().removeprefix(settings.MEDIA_URL)
+        factory = RequestFactory()
+
+        def create(n):
+            return uploader.post('/add-item/', {
+                'title': f'Created chair {n}',
+                'description': 'Made by benchstore',
+                'price_amount': '25.00',
+                'images': SimpleUploadedFile(f'chair-{n}.jpg', photo, content_type='image/jpeg'),
+            })
+
+        def snapshot(n):
+            # Served from disk by the production media view: no queries
+            response = serve_media(factory.get('/', HTTP_ACCEPT_ENCODING='gzip'), snapshot_path)
+            b''.join(response.streaming_content)
+            response.close()
+            return response
+
+        def webhook(n):
+            payload = json.dumps({
+                'id': f'evt_bench_{uuid.uuid4().hex}',
+                'object': 'event',
+                'type': 'checkout.session.completed',
+                'data': {'object': {'id': f'cs_bench_{n}', 'payment_link': f'plink_bench_{n}'}},
+            })
+            return client.post(
+                '/webhooks/stripe/', payload, content_type='application/json',
+                HTTP_STRIPE_SIGNATURE=signature_header(payload, WEBHOOK_SECRET),
+            )
+
+        paths = {
+            'list': lambda n: client.get('/'),
+            'filtered_list': lambda n: client.get('/', {'category': categories[n % len(categories)]}),
+            'json': lambda n: client.get('/', HTTP_X_REQUESTED_WITH='XMLHttpRequest'),
+            'snapshot': snapshot,
+            'detail': lambda n: client.get(f'/item/{items[(n * 37) % len(items)]}/'),
+            'create': create,
+            'webhook': webhook,
+        }
+        expected = {'create': 302}
+        results = {}
+        for name, request in paths.items():
+            request(-1)  # warm up imports, templates and connections
+            latencies = []
+            queries = []
+            wall_started = time.perf_counter()
+            for n in range(count):
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = request(n)
+                    latencies.append(time.perf_counter() - started)
+                status = expected.get(name, 200)
+                if response.status_code != status:
+                    raise CommandError(f'{name}: expected {status}, got {response.status_code}')
+                queries.append(len(captured.captured_queries))
+            wall = time.perf_counter() - wall_started
+            latencies.sort()
+            results[name] = {
+                'p50_ms': statistics.median(latencies) * 1000,
+                'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+                'throughput': count / wall,
+                'max_queries': max(queries),
+            }
+        return results
+
+    def photo(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (1200, 900), (180, 120, 60)).save(buffer, 'JPEG', quality=85)
+        return buffer.getvalue()
+
+    def report(self, results):
+        self.stdout.write(f"{'path':<15}{'p50 ms':>10}{'p95 ms':>10}{'req/s':>10}{'queries':>10}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<15}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                f"{result['throughput']:>10.1f}{result['max_queries']:>10}"
+            )
+
+    def check_budgets(self, path, results, skip_latency):
+        try:
+            budgets = json.loads(Path(path).read_text())
+        except FileNotFoundError:
+            raise CommandError(f'No budgets file at {path} (create one with --write-budgets).')
+        failures = []
+        for name, result in results.items():
+            budget = budgets.get(name)
+            if budget is None:
+                failures.append(f'{name}: no budget')
+                continue
+            if result['max_queries'] > budget['max_queries']:
+                failures.append(f"{name}: {result['max_queries']} queries (budget {budget['max_queries']})")
+            if not skip_latency and result['p95_ms'] > budget['p95_ms']:
+                failures.append(f"{name}: p95 {result['p95_ms']:.1f}ms (budget {budget['p95_ms']}ms)")
+        if failures:
+            for failure in failures:
+                self.stderr.write(self.style.ERROR(failure))
+            raise CommandError(f'{len(failures)} budget(s) exceeded.')
+        self.stdout.write(self.style.SUCCESS('All paths within budget.'))
+
+    def write_budgets(self, path, results):
+        budgets = {
+            name: {
+                'max_queries': result['max_queries'],
+                # Generous: latency varies far more between machines than query counts
+                'p95_ms': max(50, int(result['p95_ms'] * 3) + 1),
+            }
+            for name, result in results.items()
+        }
+        Path(path).write_text(json.dumps(budgets, indent=2) + '\n')
+        self.stdout.write(f'Budgets written to {path}.')
@@ -0,0 +1,67 @@
+"""
+Backfill responsive image derivatives for existing item photos.
+
+Safe to interrupt and re-run: images whose derivatives already cover the
+configured widths are skipped unless --force is given.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from store.imaging import generate_derivatives, has_current_derivatives
+from store.models import ItemImage
+
+
+def _render_one(pk):
+    """Render derivatives for one image in a worker thread."""
+    try:
+        image = ItemImage.objects.get(pk=pk)
+        generate_derivatives(image)
+        # New srcsets change the pages showing this image
+        image.touch_item()
+        return pk, None
+    except Exception as e:
+        return pk, e
+    finally:
+        # Each worker thread has its own connection; don't leak it
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Render resized JPEG/WebP derivatives for item images that are missing them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Number of images to process in parallel (default: 4).',
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Re-render derivatives even for images that already have them.',
+        )
+
+    def handle(self, *args, **options):
+        pending = [
+            image.pk
+            for image in ItemImage.objects.only('pk', 'derivatives').iterator()
+            if options['force'] or not has_current_derivatives(image)
+        ]
+        if not pending:
+            self.stdout.write(self.style.SUCCESS('All item images already have derivatives.'))
+            return
+
+        self.stdout.write(f'Rendering derivatives for {len(pending)} image(s)...')
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            futures = [pool.submit(_render_one, pk) for pk in pending]
+            for future in as_completed(futures):
+                pk, error = future.result()
+                if error is None:
+                    done += 1
+                else:
+                    failed += 1
+                    self.stderr.write(f'  image {pk}: {error}')
+
+        style = self.style.SUCCESS if not failed else self.style.WARNING
+        self.stdout.write(style(f'Done: {done} rendered, {failed} failed.'))
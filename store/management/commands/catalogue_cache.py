@@ -0,0 +1,30 @@
+"""
+Inspect or reset the catalogue page cache.
+"""
+from django.core.management.base import BaseCommand
+
+from store.cache import bump_catalogue_version, cache_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Show catalogue page cache hit/miss counters, or invalidate cached pages.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--invalidate', action='store_true',
+            help='Bump the catalogue version so every cached page is rebuilt.',
+        )
+        parser.add_argument(
+            '--reset-stats', action='store_true',
+            help='Reset the hit/miss counters.',
+        )
+
+    def handle(self, *args, **options):
+        if options['invalidate']:
+            bump_catalogue_version()
+            self.stdout.write('Catalogue cache invalidated.')
+        if options['reset_stats']:
+            reset_stats()
+            self.stdout.write('Counters reset.')
+        for name, value in cache_stats().items():
+            self.stdout.write(f'{name.replace("_", " ").capitalize()}: {value}')
@@ -0,0 +1,24 @@
+"""
+Write the catalogue snapshots now, rather than waiting for a list page to refresh them.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from store.snapshots import read_manifest, refresh_snapshots, snapshot_dir, snapshots_enabled
+
+
+class Command(BaseCommand):
+    help = 'Refresh the precomputed catalogue snapshots the infinite scroll pages through.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Rebuild even if the catalogue looks unchanged since the last refresh.',
+        )
+
+    def handle(self, *args, **options):
+        if not snapshots_enabled():
+            raise CommandError('Catalogue snapshots are turned off (CATALOGUE_SNAPSHOTS).')
+        written = refresh_snapshots(force=options['force'])
+        self.stdout.write(f'{written} snapshot(s) written to {snapshot_dir()}.')
+        for key, name in sorted(read_manifest().get('files', {}).items()):
+            self.stdout.write(f"{key or '(all items)'}: {name}")
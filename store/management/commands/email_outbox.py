@@ -0,0 +1,26 @@
+"""
+Show email outbox metrics.
+"""
+import json
+
+from django.core.management.base import BaseCommand
+
+from store.mail import outbox_metrics
+
+
+class Command(BaseCommand):
+    help = 'Print email outbox metrics (queued, failed, sent in the last 24h, quota).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--json', action='store_true',
+            help='Print metrics as JSON for monitoring scripts.',
+        )
+
+    def handle(self, *args, **options):
+        metrics = outbox_metrics()
+        if options['json']:
+            self.stdout.write(json.dumps(metrics))
+            return
+        for name, value in metrics.items():
+            self.stdout.write(f'{name.replace("_", " ").capitalize()}: {value}')
@@ -0,0 +1,52 @@
+"""
+Export the browsing pages of the store as a static site.
+
+    python manage.py export_static site/ --dynamic-url https://sell-my-stuff.onrender.com
+
+Writes every item list page (per category and page), item detail page and
+How to buy, with hashed assets and the item photos, to the output
+directory. Run it again after changes: only affected pages are rendered.
+See store.export.
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.export import export_site
+
+
+class Command(BaseCommand):
+    help = 'Render the storefront into a directory that any static host can serve.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Directory to write the site to.')
+        parser.add_argument(
+            '--dynamic-url', default='',
+            help='Origin of the Django site, for forms and pages that are not exported '
+                 '(default: same origin as the static site).',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Processes rendering pages (default: one per CPU).',
+        )
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Render every page, not just the ones whose inputs changed.',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        counts = export_site(
+            options['output'],
+            workers=max(1, options['workers']),
+            full=options['full'],
+            dynamic_url=options['dynamic_url'],
+        )
+        self.stdout.write(
+            f"{counts['rendered']} pages rendered, {counts['unchanged']} unchanged, "
+            f"{counts['removed']} removed; {counts['static']} assets and {counts['media']} media files copied "
+            f"in {time.perf_counter() - started:.1f}s."
+        )
+        if counts['failed']:
+            raise CommandError(f"{counts['failed']} page(s) failed to render; see the log.")
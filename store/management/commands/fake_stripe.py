@@ -0,0 +1,61 @@
+"""
+Run the local Stripe stand-in (store.fake_stripe) until stopped.
+
+Start it, then run the web server and worker against it:
+
+    python manage.py fake_stripe --port 12111 --latency 300 --error-rate 0.1
+    STRIPE_SECRET_KEY=sk_test_fake STRIPE_API_BASE=http://127.0.0.1:12111 python manage.py run_worker
+"""
+import signal
+
+from django.core.management.base import BaseCommand
+
+from store.fake_stripe import FakeStripe, FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = 'Serve a local stand-in for the Stripe API calls the store makes, with latency and error injection.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on (default: 127.0.0.1).')
+        parser.add_argument('--port', type=int, default=12111, help='Port to listen on (default: 12111).')
+        parser.add_argument(
+            '--latency', type=float, default=0,
+            help='Milliseconds added to every call (default: 0).',
+        )
+        parser.add_argument(
+            '--jitter', type=float, default=0,
+            help='Random +/- milliseconds around --latency (default: 0).',
+        )
+        parser.add_argument(
+            '--error-rate', type=float, default=0,
+            help='Fraction of calls that fail with a 500 api_error (default: 0).',
+        )
+        parser.add_argument(
+            '--rate-limit-rate', type=float, default=0,
+            help='Fraction of calls that fail with a 429 rate limit error (default: 0).',
+        )
+        parser.add_argument('--seed', type=int, help='Random seed, for repeatable error patterns.')
+        parser.add_argument('--log-requests', action='store_true', help='Log every request.')
+
+    def handle(self, *args, **options):
+        fake = FakeStripe(
+            latency=options['latency'] / 1000,
+            jitter=options['jitter'] / 1000,
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            seed=options['seed'],
+        )
+        server = FakeStripeServer(fake, options['host'], options['port'], verbose=options['log_requests'])
+        self.stdout.write(f'Fake Stripe listening on {server.url}; set STRIPE_API_BASE={server.url}')
+        self.stdout.write('Press Ctrl+C to stop.')
+        # Stop the same way on SIGTERM, so the call counts are still printed
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            for name, count in sorted(fake.stats.items()):
+                self.stdout.write(f'{name}: {count}')
@@ -0,0 +1,117 @@
+"""
+Move existing item photos to content-hash names.
+
+Photos uploaded before content-addressed storage keep their upload-time
+names and can't be served as immutable. This renames each original and
+its derivatives to the SHA-256 of its bytes, which also merges duplicate
+uploads into one file. Safe to interrupt and re-run: files that already
+have content names are left alone.
+
+--prune additionally deletes files under items/ that no image references
+(e.g. left behind by bulk deletes in the admin).
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from store.cache import bump_catalogue_version
+from store.models import Item, ItemImage
+from store.storage import image_file_names, is_content_addressed
+
+MEDIA_DIRS = ('items', 'items/derivatives')
+
+
+def _rehash_file(storage, name):
+    if not name or is_content_addressed(name):
+        return name
+    with storage.open(name, 'rb') as f:
+        return storage.save(name, f)
+
+
+def _rehash_one(pk):
+    """Rename one image's files in a worker thread."""
+    try:
+        image = ItemImage.objects.get(pk=pk)
+        storage = image.image.storage
+        old_names = image_file_names(image.image.name, image.derivatives)
+        image_name = _rehash_file(storage, image.image.name)
+        derivatives = {
+            width: {
+                key: value if key == 'height' else _rehash_file(storage, value)
+                for key, value in entry.items()
+            }
+            for width, entry in (image.derivatives or {}).items()
+        }
+        ItemImage.objects.filter(pk=pk).update(image=image_name, derivatives=derivatives)
+        # Upload-time names were never shared between rows
+        for name in old_names - image_file_names(image_name, derivatives):
+            storage.delete(name)
+        return pk, image.item_id, None
+    except Exception as e:
+        return pk, None, e
+    finally:
+        # Each worker thread has its own connection; don't leak it
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Rename item photos to content-hash names, merging duplicates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Number of images to process in parallel (default: 4).',
+        )
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='Also delete photo files that no item image references.',
+        )
+
+    def handle(self, *args, **options):
+        pending = [
+            pk
+            for pk, name, derivatives in ItemImage.objects.values_list('pk', 'image', 'derivatives').iterator()
+            if not all(is_content_addressed(n) for n in image_file_names(name, derivatives))
+        ]
+        if pending:
+            self.stdout.write(f'Rehashing {len(pending)} image(s)...')
+            done = failed = 0
+            touched_items = set()
+            with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+                futures = [pool.submit(_rehash_one, pk) for pk in pending]
+                for future in as_completed(futures):
+                    pk, item_id, error = future.result()
+                    if error is None:
+                        done += 1
+                        touched_items.add(item_id)
+                    else:
+                        failed += 1
+                        self.stderr.write(f'  image {pk}: {error}')
+            # Image URLs changed: refresh HTTP validators and cached pages
+            Item.objects.filter(pk__in=touched_items).update(updated_at=timezone.now())
+            bump_catalogue_version()
+            style = self.style.SUCCESS if not failed else self.style.WARNING
+            self.stdout.write(style(f'Done: {done} rehashed, {failed} failed.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('All item images already have content names.'))
+
+        if options['prune']:
+            self._prune()
+
+    def _prune(self):
+        storage = ItemImage._meta.get_field('image').storage
+        referenced = set()
+        for name, derivatives in ItemImage.objects.values_list('image', 'derivatives').iterator():
+            referenced |= image_file_names(name, derivatives)
+        removed = 0
+        for directory in MEDIA_DIRS:
+            if not storage.exists(directory):
+                continue
+            for filename in storage.listdir(directory)[1]:
+                name = f'{directory}/{filename}'
+                if name not in referenced:
+                    storage.delete(name)
+                    removed += 1
+        self.stdout.write(self.style.SUCCESS(f'Pruned {removed} unreferenced file(s).'))
@@ -0,0 +1,144 @@
+"""
+Fire a burst of signed checkout.session.completed webhooks at a running
+site, to load-test sale handling offline.
+
+Events are built for items in this database and signed with
+STRIPE_WEBHOOK_SECRET (or --secret), then posted concurrently to the
+site's webhook URL. --duplicates redelivers each event, as Stripe does on
+timeouts. --sessions-per-item has several buyers check out the same item.
+--identify picks what a session carries for the item lookup:
+metadata, the payment link, or only a session id whose line items have
+to be fetched from Stripe. That last one needs the site to be running
+against the fake_stripe stand-in.
+
+The site only records events; run the worker to process them.
+"""
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from store.fake_stripe import session_id_for_price
+from store.models import Item
+from store.webhooks import signature_header
+
+
+class Command(BaseCommand):
+    help = 'Post a burst of signed checkout.session.completed webhooks to a running site.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='http://127.0.0.1:8000',
+            help='Base URL of the running site (default: http://127.0.0.1:8000).',
+        )
+        parser.add_argument('--secret', help='Webhook signing secret (default: STRIPE_WEBHOOK_SECRET).')
+        parser.add_argument(
+            '--items', type=int, default=50,
+            help='Number of live items with payment links to "sell" (default: 50).',
+        )
+        parser.add_argument(
+            '--sessions-per-item', type=int, default=1,
+            help='Separate checkouts per item, as if several buyers raced (default: 1).',
+        )
+        parser.add_argument(
+            '--duplicates', type=int, default=1,
+            help='Deliveries of each event (default: 1).',
+        )
+        parser.add_argument(
+            '--identify', choices=['metadata', 'payment-link', 'line-items'], default='payment-link',
+            help='How sessions identify their item (default: payment-link).',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=8,
+            help='Deliveries in flight at once (default: 8).',
+        )
+        parser.add_argument('--timeout', type=float, default=10, help='Seconds per request (default: 10).')
+
+    def handle(self, *args, **options):
+        secret = options['secret'] or settings.STRIPE_WEBHOOK_SECRET
+        if not secret:
+            raise CommandError('No signing secret: set STRIPE_WEBHOOK_SECRET or pass --secret.')
+        url = options['url'].rstrip('/') + reverse('store:stripe_webhook')
+
+        items = list(
+            Item.objects.filter(status=Item.STATUS_LIVE)
+            .exclude(stripe_payment_link_id='')
+            .order_by('pk')[:options['items']]
+        )
+        if not items:
+            raise CommandError('No live items with payment links to sell.')
+        payloads = [
+            self.event(item, options['identify'])
+            for item in items
+            for _ in range(max(1, options['sessions_per_item']))
+        ]
+        deliveries = [payload for payload in payloads for _ in range(max(1, options['duplicates']))]
+        self.stdout.write(
+            f'Sending {len(deliveries)} deliveries ({len(payloads)} events for {len(items)} items) to {url}'
+        )
+
+        def deliver(payload):
+            request = urllib.request.Request(url, data=payload.encode(), method='POST', headers={
+                'Content-Type': 'application/json',
+                'Stripe-Signature': signature_header(payload, secret),
+            })
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=options['timeout']) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except (urllib.error.URLError, OSError) as e:
+                status = type(getattr(e, 'reason', e)).__name__
+            return status, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, options['concurrency'])) as pool:
+            results = list(pool.map(deliver, deliveries))
+        elapsed = time.perf_counter() - started
+
+        statuses = Counter(status for status, _ in results)
+        latencies = sorted(seconds for _, seconds in results)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(', '.join(f'{status}: {count}' for status, count in sorted(statuses.items(), key=str)))
+        self.stdout.write(
+            f'p50 {statistics.median(latencies) * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms, '
+            f'{len(results) / elapsed:.1f} deliveries/s'
+        )
+        if set(statuses) != {200}:
+            raise CommandError('Some deliveries were not accepted.')
+        self.stdout.write(self.style.SUCCESS('All deliveries accepted; run the worker to process them.'))
+
+    def event(self, item, identify):
+        token = uuid.uuid4().hex[:12]
+        session = {
+            'id': f'cs_replay_{token}',
+            'object': 'checkout.session',
+            'metadata': {},
+            'customer_details': {
+                'name': f'Replay buyer {token}',
+                'email': f'buyer-{token}@example.com',
+                'phone': '',
+            },
+        }
+        if identify == 'metadata':
+            session['metadata'] = {'item_id': str(item.pk)}
+        elif identify == 'payment-link':
+            session['payment_link'] = item.stripe_payment_link_id
+        else:
+            session['id'] = session_id_for_price(item.stripe_price_id, token)
+        return json.dumps({
+            'id': f'evt_replay_{token}',
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'created': int(time.time()),
+            'data': {'object': session},
+        })
@@ -0,0 +1,52 @@
+"""
+Run the local background worker.
+
+Processes queued webhook events, outgoing email and Payment Link
+creation and deactivation (see store.worker.TASKS) until stopped. Deploy
+alongside the web service, which refreshes the catalogue snapshots itself.
+"""
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from store.worker import run_once
+
+
+class Command(BaseCommand):
+    help = 'Process queued background work (Stripe webhook events, outgoing email, Payment Links).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Process everything currently due, then exit.',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=2.0,
+            help='Seconds to sleep between polls when there is no work (default: 2).',
+        )
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        if not options['once']:
+            self.stdout.write('Worker started. Press Ctrl+C to stop.')
+
+        while self.running:
+            close_old_connections()
+            results = run_once()
+            busy = any(results.values())
+            if busy and options['verbosity'] > 1:
+                self.stdout.write(', '.join(f'{name}: {count}' for name, count in results.items()))
+            if options['once'] and not busy:
+                break
+            if not busy:
+                time.sleep(options['interval'])
+
+        self.stdout.write('Worker stopped.')
+
+    def _stop(self, signum, frame):
+        self.running = False
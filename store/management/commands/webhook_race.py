@@ -0,0 +1,91 @@
+"""
+Concurrency check for the SOLD transition.
+
+Creates a scratch item, fires N checkout.session.completed deliveries at
+it from parallel threads (released together by a barrier) and verifies
+that exactly one of them won the transition and sent the sale emails.
+Stripe calls are disabled, and the scratch item and any sale emails it
+queued are deleted afterwards, so it is safe to run against any database.
+
+Run it against PostgreSQL to reproduce production behaviour; SQLite
+serialises writers, which makes races less likely to surface.
+"""
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+
+from store.models import Item, OutboundEmail
+from store.webhooks import handle_checkout_session_completed
+
+
+class Command(BaseCommand):
+    help = 'Fire parallel checkout webhooks at one item and check exactly one wins.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--deliveries', type=int, default=16,
+            help='Number of concurrent deliveries (default: 16).',
+        )
+        parser.add_argument(
+            '--rounds', type=int, default=5,
+            help='Number of times to repeat the race (default: 5).',
+        )
+
+    def handle(self, *args, **options):
+        deliveries = max(2, options['deliveries'])
+        failures = []
+        with override_settings(
+            STRIPE_SECRET_KEY='',
+            EMAIL_HOST_USER='race',
+            EMAIL_HOST_PASSWORD='race',
+            ADMIN_EMAIL='admin@example.com',
+        ):
+            for round_number in range(1, options['rounds'] + 1):
+                winners, emails = self._race(deliveries)
+                line = f'Round {round_number}: {winners} winner(s), {emails} email(s) from {deliveries} deliveries'
+                # One winner queues one buyer email and one admin email
+                if winners == 1 and emails == 2:
+                    self.stdout.write(line)
+                else:
+                    failures.append(line)
+                    self.stderr.write(self.style.ERROR(line))
+
+        if failures:
+            raise CommandError(f'{len(failures)} round(s) violated the single-winner rule.')
+        self.stdout.write(self.style.SUCCESS('SOLD transition held under concurrency.'))
+
+    def _race(self, deliveries):
+        token = uuid.uuid4().hex[:12]
+        item = Item.objects.create(
+            title=f'Webhook race check {token}',
+            price_amount='1.00',
+            stripe_payment_link_id=f'plink_race_{token}',
+        )
+        # Sale email subjects end with the item title
+        queued_emails = OutboundEmail.objects.filter(subject__endswith=item.title)
+        barrier = threading.Barrier(deliveries)
+
+        def deliver(n):
+            session = {
+                'id': f'cs_race_{item.pk}_{n}',
+                'payment_link': item.stripe_payment_link_id,
+                'metadata': {},
+                'customer_details': {'name': 'Race', 'email': 'buyer@example.com'},
+            }
+            try:
+                barrier.wait()
+                return handle_checkout_session_completed(session)
+            finally:
+                connections.close_all()
+
+        try:
+            with ThreadPoolExecutor(max_workers=deliveries) as pool:
+                results = list(pool.map(deliver, range(deliveries)))
+            return sum(1 for won in results if won), queued_emails.count()
+        finally:
+            queued_emails.delete()
+            item.delete()
@@ -0,0 +1,224 @@
+"""
+Production media serving.
+
+Replaces django.views.static.serve, which reads whole files into the
+worker with no Range support and no caching headers. This view streams
+files in chunks (FileResponse lets the WSGI server use sendfile where it
+can), answers Range and conditional requests, and marks content-hashed
+paths as immutable so browsers and CDNs can keep them for a year.
+
+With MEDIA_SENDFILE_BACKEND set, Django only resolves and validates the
+path and the front proxy sends the bytes:
+
+- 'x-accel-redirect' (nginx): responds with X-Accel-Redirect pointing at
+  MEDIA_ACCEL_REDIRECT_PREFIX + path, which nginx maps to MEDIA_ROOT
+  through an internal location.
+- 'x-sendfile' (Apache mod_xsendfile, lighttpd): responds with the
+  absolute file path in X-Sendfile.
+
+A file with precompressed siblings (name.br, name.gz, as written for the
+catalogue snapshots) is served from the best one the client accepts,
+with Content-Encoding set.
+"""
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_etags
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# A run of 16+ hex characters in the file name is taken to be a content
+# hash: the bytes behind such a URL never change
+HASHED_NAME_RE = re.compile(r'[0-9a-f]{16,}')
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Precompressed sibling suffixes, best first
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+
+def is_immutable(path):
+    """True if ``path`` names content-addressed (never-changing) content."""
+    return bool(HASHED_NAME_RE.search(os.path.basename(path)))
+
+
+def _etag(st):
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _accepted_encodings(request):
+    """Content codings in the request's Accept-Encoding, minus any refused with q=0."""
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.partition(';')
+        quality = params.strip().removeprefix('q=')
+        try:
+            if params and float(quality) == 0:
+                continue
+        except ValueError:
+            pass
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _precompressed_variant(request, fullpath):
+    """
+    Return (variant, has_variants): variant is (encoding, suffix, stat) of
+    the best precompressed sibling of ``fullpath`` the client accepts, or
+    None; has_variants says whether there are any siblings, in which case
+    the response varies on Accept-Encoding.
+    """
+    accepted = None
+    has_variants = False
+    for encoding, suffix in PRECOMPRESSED:
+        try:
+            st = os.stat(fullpath + suffix)
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        has_variants = True
+        if accepted is None:
+            accepted = _accepted_encodings(request)
+        if encoding in accepted:
+            return (encoding, suffix, st), True
+    return None, has_variants
+
+
+def _parse_range(header, size):
+    """
+    Return (start, end) inclusive for a single-range header, None to
+    serve the whole file, or False if the range can't be satisfied.
+    Multi-range requests, and ranges whose last byte comes before their
+    first (invalid, so ignored per RFC 9110), are served in full.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return False
+    end = min(int(last), size - 1) if last else size - 1
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _set_caching_headers(response, path, etag, mtime):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if is_immutable(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+
+
+def serve_media(request, path):
+    """Serve a file from MEDIA_ROOT."""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404('File not found')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('File not found')
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+
+    variant, has_variants = _precompressed_variant(request, fullpath)
+    if variant:
+        encoding, suffix, st = variant
+        fullpath += suffix
+        path += suffix
+
+    etag = _etag(st)
+    mtime = int(st.st_mtime)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=mtime)
+    if not_modified is not None:
+        _set_caching_headers(not_modified, path, etag, mtime)
+        if has_variants:
+            patch_vary_headers(not_modified, ['Accept-Encoding'])
+        return not_modified
+
+    backend = settings.MEDIA_SENDFILE_BACKEND
+    if backend:
+        response = HttpResponse(content_type=content_type)
+        if backend == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + path.lstrip('/')
+        else:
+            response['X-Sendfile'] = fullpath
+        if encoding:
+            response['Content-Encoding'] = encoding
+        _set_caching_headers(response, path, etag, mtime)
+        if has_variants:
+            patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header:
+        # If-Range: only honour the range if the client's copy is current
+        if_range = request.headers.get('If-Range')
+        if not if_range or etag in parse_etags(if_range):
+            byte_range = _parse_range(range_header, st.st_size)
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{st.st_size}'
+        return response
+
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        body = _read_range(fullpath, start, length) if request.method == 'GET' else iter(())
+        response = StreamingHttpResponse(body, status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{st.st_size}'
+        response['Content-Length'] = str(length)
+    elif request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = str(st.st_size)
+    else:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+        response.block_size = CHUNK_SIZE
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    _set_caching_headers(response, path, etag, mtime)
+    if has_variants:
+        patch_vary_headers(response, ['Accept-Encoding'])
+    return response
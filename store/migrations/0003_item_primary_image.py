@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_primary_image(apps, schema_editor):
+    """Point every existing item at its primary (or first) image."""
+    Item = apps.get_model('store', 'Item')
+    ItemImage = apps.get_model('store', 'ItemImage')
+    for item in Item.objects.all().only('pk'):
+        images = ItemImage.objects.filter(item_id=item.pk)
+        primary = images.filter(is_primary=True).order_by('sort_order', 'created_at').first()
+        if primary is None:
+            primary = images.order_by('sort_order', 'created_at').first()
+        if primary is not None:
+            Item.objects.filter(pk=item.pk).update(primary_image=primary)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_category_alter_item_currency_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='primary_image',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='store.itemimage'),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='description',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(backfill_primary_image, migrations.RunPython.noop),
+    ]
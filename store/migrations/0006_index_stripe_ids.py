@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_webhookevent'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='stripe_payment_link_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='item',
+            name='stripe_price_id',
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:57
+
+import store.storage
+import store.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_index_item_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='itemimage',
+            name='image',
+            field=models.ImageField(db_index=True, storage=store.storage.item_image_storage, upload_to='items/', validators=[store.validators.validate_image_file_type, store.validators.validate_image_file_size]),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Full-text search index for items, see store.search
+
+from django.db import migrations
+
+PG_VECTOR_SQL = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE store_item ADD COLUMN search_vector tsvector")
+        schema_editor.execute(f"UPDATE store_item SET search_vector = {PG_VECTOR_SQL}")
+        schema_editor.execute(
+            "CREATE INDEX store_item_search_vector_gin ON store_item USING GIN (search_vector)"
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE store_item_fts USING fts5("
+            "title, description, tokenize = 'porter unicode61')"
+        )
+        schema_editor.execute(
+            "INSERT INTO store_item_fts (rowid, title, description) "
+            "SELECT id, title, coalesce(description, '') FROM store_item"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS store_item_search_vector_gin")
+        schema_editor.execute("ALTER TABLE store_item DROP COLUMN IF EXISTS search_vector")
+    elif vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS store_item_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_itemimage_content_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
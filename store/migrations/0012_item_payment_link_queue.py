@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:01
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def mark_existing_links_ready(apps, schema_editor):
+    """Items that already have a Payment Link don't need the worker."""
+    Item = apps.get_model('store', 'Item')
+    Item.objects.exclude(stripe_payment_link_url='').update(link_status='READY')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_item_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='link_attempts',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='link_error',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='link_locked_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='link_next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='link_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('CREATING', 'Creating'), ('READY', 'Ready'), ('FAILED', 'Failed')], default='PENDING', editable=False, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['link_status', 'link_next_attempt_at'], name='store_item_link_st_89db0d_idx'),
+        ),
+        migrations.RunPython(mark_existing_links_ready, migrations.RunPython.noop),
+    ]
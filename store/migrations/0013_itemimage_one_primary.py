@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:10
+
+from django.db import migrations, models
+
+
+def unmark_extra_primaries(apps, schema_editor):
+    """
+    Leave at most one primary image per item before the constraint is
+    added: the one Item.primary_image points at if it is marked, otherwise
+    the first by sort order.
+    """
+    Item = apps.get_model('store', 'Item')
+    ItemImage = apps.get_model('store', 'ItemImage')
+    duplicated = (
+        ItemImage.objects.filter(is_primary=True)
+        .values('item')
+        .annotate(count=models.Count('pk'))
+        .filter(count__gt=1)
+        .values_list('item', flat=True)
+    )
+    for item in Item.objects.filter(pk__in=list(duplicated)):
+        primaries = ItemImage.objects.filter(item=item, is_primary=True)
+        keep = primaries.filter(pk=item.primary_image_id).first() \
+            or primaries.order_by('sort_order', 'created_at', 'pk').first()
+        primaries.exclude(pk=keep.pk).update(is_primary=False)
+        if item.primary_image_id != keep.pk:
+            Item.objects.filter(pk=item.pk).update(primary_image=keep)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_item_payment_link_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(unmark_extra_primaries, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='itemimage',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_primary', True)), fields=('item',), name='store_itemimage_one_primary'),
+        ),
+    ]
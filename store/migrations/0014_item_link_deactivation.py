@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0013_itemimage_one_primary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='link_status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('CREATING', 'Creating'), ('READY', 'Ready'), ('FAILED', 'Failed'), ('DEACTIVATING', 'Deactivating'), ('DEACTIVATED', 'Deactivated')], default='PENDING', editable=False, max_length=20),
+        ),
+    ]
@@ -1,8 +1,20 @@
-from django.db import models
+from django.core.files.base import ContentFile
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.core.validators import MinValueValidator
-from django.utils.text import slugify
 from decimal import Decimal
+import logging
+import os
+from functools import partial
 from .validators import validate_image_file_type, validate_image_file_size
+from . import search
+from .cache import bump_catalogue_version
+from .slugs import save_with_unique_slug
+from .storage import image_file_names, item_image_storage, release_files
+
+logger = logging.getLogger(__name__)
 
 
 class Category(models.Model):
@@ -23,16 +35,15 @@ class Category(models.Model):
         ]
     
     def save(self, *args, **kwargs):
-        """Auto-generate slug from name if not provided."""
-        if not self.slug:
-            self.slug = slugify(self.name)
-            # Ensure uniqueness
-            original_slug = self.slug
-            counter = 1
-            while Category.objects.filter(slug=self.slug).exclude(pk=self.pk).exists():
-                self.slug = f"{original_slug}-{counter}"
-                counter += 1
-        super().save(*args, **kwargs)
+        """Auto-generate a unique slug from name if not provided."""
+        save_with_unique_slug(self, self.name, partial(super().save, *args, **kwargs))
+        bump_catalogue_version()
+    
+    def delete(self, *args, **kwargs):
+        """Delete the category and invalidate cached catalogue pages."""
+        result = super().delete(*args, **kwargs)
+        bump_catalogue_version()
+        return result
     
     def __str__(self):
         return self.name
@@ -50,6 +61,22 @@ class Item(models.Model):
         (STATUS_SOLD, 'Sold'),
     ]
     
+    # Payment link lifecycle; links are created by the background worker
+    LINK_PENDING = 'PENDING'
+    LINK_CREATING = 'CREATING'
+    LINK_READY = 'READY'
+    LINK_FAILED = 'FAILED'
+    LINK_DEACTIVATING = 'DEACTIVATING'
+    LINK_DEACTIVATED = 'DEACTIVATED'
+    LINK_STATUS_CHOICES = [
+        (LINK_PENDING, 'Pending'),
+        (LINK_CREATING, 'Creating'),
+        (LINK_READY, 'Ready'),
+        (LINK_FAILED, 'Failed'),
+        (LINK_DEACTIVATING, 'Deactivating'),
+        (LINK_DEACTIVATED, 'Deactivated'),
+    ]
+    
     slug = models.SlugField(max_length=200, unique=True, blank=True)
     title = models.CharField(max_length=200)
     description = models.TextField(blank=True, default='')
@@ -73,14 +100,41 @@ class Item(models.Model):
     )
     
     # Stripe Payment Link fields
-    stripe_payment_link_id = models.CharField(max_length=255, blank=True)
+    # Payment link and price ids are indexed for webhook lookups
+    stripe_payment_link_id = models.CharField(max_length=255, blank=True, db_index=True)
     stripe_payment_link_url = models.URLField(blank=True)
     stripe_product_id = models.CharField(max_length=255, blank=True)
-    stripe_price_id = models.CharField(max_length=255, blank=True)
+    stripe_price_id = models.CharField(max_length=255, blank=True, db_index=True)
+    
+    # Payment link creation queue, drained by store.payment_links
+    link_status = models.CharField(
+        max_length=20,
+        choices=LINK_STATUS_CHOICES,
+        default=LINK_PENDING,
+        editable=False,
+    )
+    link_attempts = models.PositiveIntegerField(default=0, editable=False)
+    link_next_attempt_at = models.DateTimeField(default=timezone.now, editable=False)
+    link_locked_at = models.DateTimeField(null=True, blank=True, editable=False)
+    link_error = models.TextField(blank=True, editable=False)
+    
+    # Denormalized pointer to the image shown on catalogue cards.
+    # Maintained by ItemImage.save()/delete() so list pages can
+    # select_related() it instead of querying images per item.
+    primary_image = models.ForeignKey(
+        'ItemImage',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='+'
+    )
     
     # Timestamps
+    # updated_at also moves when the item's images change, so it can be
+    # used as an HTTP validator for pages showing the item
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     sold_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
@@ -89,6 +143,10 @@ class Item(models.Model):
             models.Index(fields=['status', '-created_at']),
             models.Index(fields=['slug']),
             models.Index(fields=['category', 'status']),
+            # Catalogue cursor pagination (store.pagination)
+            models.Index(fields=['-created_at', '-id']),
+            models.Index(fields=['category', '-created_at', '-id']),
+            models.Index(fields=['link_status', 'link_next_attempt_at']),
         ]
     
     def __str__(self):
@@ -100,31 +158,118 @@ class Item(models.Model):
         return reverse('store:item_detail', kwargs={'pk': self.pk})
     
     def save(self, *args, **kwargs):
-        """Auto-generate slug from title if not provided."""
-        if not self.slug:
-            self.slug = slugify(self.title)
-            # Ensure uniqueness
-            original_slug = self.slug
-            counter = 1
-            while Item.objects.filter(slug=self.slug).exclude(pk=self.pk).exists():
-                self.slug = f"{original_slug}-{counter}"
-                counter += 1
-        super().save(*args, **kwargs)
+        """Auto-generate a unique slug from title if not provided."""
+        save_with_unique_slug(self, self.title, partial(super().save, *args, **kwargs))
+        search.index_item(self)
+        bump_catalogue_version()
+    
+    def delete(self, *args, **kwargs):
+        """
+        Delete the item, dropping it from the search index, invalidating
+        cached catalogue pages and releasing photo files no other item
+        shares.
+        """
+        pk = self.pk
+        files = list(self.images.values_list('image', 'derivatives'))
+        result = super().delete(*args, **kwargs)
+        search.unindex_item(pk)
+        storage = ItemImage._meta.get_field('image').storage
+        for image_name, derivatives in files:
+            release_files(image_name, image_file_names(image_name, derivatives), storage)
+        bump_catalogue_version()
+        return result
+    
+    @property
+    def has_payment_link(self):
+        """True once the background worker has created this item's Payment Link."""
+        return self.link_status == self.LINK_READY and bool(self.stripe_payment_link_url)
+    
+    def mark_sold(self):
+        """
+        Atomically transition this item to SOLD.
+        
+        Runs a single conditional UPDATE, so when several webhook
+        deliveries race for the same item exactly one of them wins.
+        Returns True for the winner (which should run the sale side
+        effects) and False if the item was already sold.
+        
+        The same UPDATE queues the item's Payment Link for deactivation
+        (link_status DEACTIVATING), which the worker carries out with
+        retries (store.payment_links), so the sale commits without waiting
+        on Stripe.
+        """
+        now = timezone.now()
+        has_link = ~Q(stripe_payment_link_id='')
+        
+        def if_has_link(field, value):
+            # Rows without a link (one may be being created right now,
+            # see store.payment_links._record_link) keep their link state
+            return Case(
+                When(has_link, then=Value(value)),
+                default=F(field),
+                output_field=self._meta.get_field(field),
+            )
+        
+        won = Item.objects.filter(pk=self.pk).exclude(status=self.STATUS_SOLD).update(
+            status=self.STATUS_SOLD,
+            sold_at=Coalesce('sold_at', Value(now)),
+            updated_at=now,
+            link_status=if_has_link('link_status', self.LINK_DEACTIVATING),
+            link_attempts=if_has_link('link_attempts', 0),
+            link_next_attempt_at=if_has_link('link_next_attempt_at', now),
+            link_locked_at=if_has_link('link_locked_at', None),
+        ) == 1
+        if won:
+            bump_catalogue_version()
+        self.refresh_from_db(fields=[
+            'status', 'sold_at', 'updated_at', 'link_status', 'link_attempts', 'link_next_attempt_at',
+            'link_locked_at',
+        ])
+        return won
     
     @property
     def is_live(self):
         """Check if item is live and available for purchase."""
         return self.status == self.STATUS_LIVE
     
-    @property
-    def primary_image(self):
-        """Get the primary image, or first image by sort_order."""
-        # First try to find explicitly marked primary image
+    def refresh_primary_image(self):
+        """
+        Recompute the primary image pointer from the item's images.
+        
+        Uses the explicitly marked primary image, falling back to the
+        lowest sort_order. Written with update() so the item's slug and
+        save() side effects are left alone; updated_at is still moved on.
+        """
         primary = self.images.filter(is_primary=True).first()
-        if primary:
-            return primary
-        # Fall back to lowest sort_order
-        return self.images.order_by('sort_order', 'created_at').first()
+        if primary is None:
+            primary = self.images.order_by('sort_order', 'created_at').first()
+        self._point_to_primary(primary)
+        return primary
+    
+    def _point_to_primary(self, image):
+        now = timezone.now()
+        Item.objects.filter(pk=self.pk).update(primary_image=image, updated_at=now)
+        self.primary_image = image
+        self.updated_at = now
+    
+    def _release_primary(self, keep_pk=None):
+        """
+        Lock this item's row and unmark its primary image, unless it is
+        ``keep_pk``. Call inside a transaction, before marking another
+        image primary, so the one-primary constraint holds at every step
+        and concurrent changes to the gallery queue up behind each other.
+        """
+        list(Item.objects.select_for_update().filter(pk=self.pk).order_by().values_list('pk', flat=True))
+        self.images.filter(is_primary=True).exclude(pk=keep_pk).update(is_primary=False)
+    
+    def set_primary_image(self, image):
+        """Atomically make one of this item's saved images its only primary image."""
+        with transaction.atomic():
+            self._release_primary(keep_pk=image.pk)
+            ItemImage.objects.filter(pk=image.pk, item=self).update(is_primary=True)
+            self._point_to_primary(image)
+        image.is_primary = True
+        bump_catalogue_version()
 
 
 class ItemImage(models.Model):
@@ -139,10 +284,15 @@ class ItemImage(models.Model):
     )
     image = models.ImageField(
         upload_to='items/',
+        # Stored under a content hash, so identical uploads share one file
+        storage=item_image_storage,
+        db_index=True,
         validators=[validate_image_file_type, validate_image_file_size]
     )
     sort_order = models.PositiveIntegerField(default=0)
     is_primary = models.BooleanField(default=False)
+    # Resized JPEG/WebP copies keyed by width, see store.imaging
+    derivatives = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -150,16 +300,212 @@ class ItemImage(models.Model):
         indexes = [
             models.Index(fields=['item', 'sort_order']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['item'],
+                condition=models.Q(is_primary=True),
+                name='store_itemimage_one_primary',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.item.title} - Image {self.sort_order}"
     
     def save(self, *args, **kwargs):
-        """Ensure only one primary image per item."""
-        super().save(*args, **kwargs)
-        # If this is marked as primary, unmark others
+        """
+        Keep a single primary image per item (unmarking the previous one
+        first, see Item.set_primary_image) and Item.primary_image current,
+        and normalize new uploads and render their derivatives.
+        """
+        new_upload = bool(self.image) and not self.image._committed
+        if new_upload:
+            self.normalize_upload()
+        replaced = None
+        if new_upload and self.pk:
+            replaced = ItemImage.objects.filter(pk=self.pk).values_list('image', 'derivatives').first()
+            # The old derivatives belong to the old file
+            self.derivatives = {}
+        if self.is_primary:
+            # Same steps as Item.set_primary_image, with this row's save
+            # in the middle
+            with transaction.atomic():
+                self.item._release_primary(keep_pk=self.pk)
+                super().save(*args, **kwargs)
+                self.item._point_to_primary(self)
+        else:
+            super().save(*args, **kwargs)
+        if replaced and replaced[0] != self.image.name:
+            release_files(replaced[0], image_file_names(*replaced), self.image.storage, self.pk)
+        if new_upload or not self.derivatives:
+            self.refresh_derivatives()
         if self.is_primary:
-            ItemImage.objects.filter(
-                item=self.item,
-                is_primary=True
-            ).exclude(pk=self.pk).update(is_primary=False)
+            bump_catalogue_version()
+        else:
+            # Only recompute when this image was (or could become) the pointer
+            current = Item.objects.filter(pk=self.item_id).values_list(
+                'primary_image_id', flat=True
+            ).first()
+            if current is None or current == self.pk:
+                self.item.refresh_primary_image()
+                bump_catalogue_version()
+            else:
+                self.touch_item()
+    
+    def normalize_upload(self):
+        """
+        Replace a new, unsaved upload with its normalized version
+        (rotated, metadata stripped, resized; see store.imaging).
+        
+        If Pillow can't process the file it is kept as uploaded.
+        """
+        from .imaging import normalization_options, normalize_image
+        try:
+            self.image.seek(0)
+            content, ext = normalize_image(self.image.read(), **normalization_options())
+        except Exception:
+            logger.exception("Could not normalize upload %s", self.image.name)
+            return
+        stem = os.path.splitext(os.path.basename(self.image.name))[0] or 'photo'
+        self.image = ContentFile(content, name=f"{stem}.{ext}")
+    
+    def touch_item(self):
+        """
+        Record that the item's gallery changed: move the item's updated_at
+        (used as an HTTP validator) and invalidate cached catalogue pages.
+        """
+        Item.objects.filter(pk=self.item_id).update(updated_at=timezone.now())
+        bump_catalogue_version()
+    
+    def refresh_derivatives(self):
+        """
+        Render derivatives for this image.
+        
+        Failures are logged rather than raised so a bad file never blocks
+        saving; the build_derivatives command can retry later.
+        """
+        from .imaging import generate_derivatives, has_current_derivatives
+        # An identical photo that is already stored has the same derivatives
+        twin = ItemImage.objects.filter(image=self.image.name).exclude(pk=self.pk).only('derivatives').first()
+        if twin is not None and has_current_derivatives(twin):
+            ItemImage.objects.filter(pk=self.pk).update(derivatives=twin.derivatives)
+            self.derivatives = twin.derivatives
+            return
+        try:
+            generate_derivatives(self)
+        except Exception:
+            logger.exception("Could not render derivatives for item image %s", self.pk)
+    
+    @property
+    def srcset(self):
+        """JPEG srcset for this image's derivatives."""
+        from .imaging import build_srcset
+        return build_srcset(self, 'jpeg')
+    
+    @property
+    def webp_srcset(self):
+        """WebP srcset for this image's derivatives."""
+        from .imaging import build_srcset
+        return build_srcset(self, 'webp')
+    
+    def delete(self, *args, **kwargs):
+        """
+        Delete the image, release its files unless another image shares
+        them and move the item's primary pointer if needed.
+        """
+        item = self.item
+        image_name = self.image.name
+        files = image_file_names(image_name, self.derivatives)
+        result = super().delete(*args, **kwargs)
+        release_files(image_name, files, self.image.storage)
+        item.refresh_primary_image()
+        bump_catalogue_version()
+        return result
+
+
+class WebhookEvent(models.Model):
+    """
+    A verified Stripe webhook event in the processing inbox.
+    
+    The webhook view only records events here and returns 200 straight
+    away; the run_worker command processes them with retries.
+    """
+    STATUS_PENDING = 'PENDING'
+    STATUS_PROCESSING = 'PROCESSING'
+    STATUS_DONE = 'DONE'
+    STATUS_FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    stripe_event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} ({self.stripe_event_id})"
+
+
+class OutboundEmail(models.Model):
+    """
+    An email waiting in (or sent from) the outbox.
+    
+    Sale handling only queues messages here; the run_worker command sends
+    them in batches over a single SMTP connection, with retries and the
+    daily quota applied (see store.mail).
+    """
+    STATUS_PENDING = 'PENDING'
+    STATUS_SENDING = 'SENDING'
+    STATUS_SENT = 'SENT'
+    STATUS_FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField(default=list)
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+            models.Index(fields=['status', 'sent_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)}"
@@ -0,0 +1,182 @@
+"""
+Keyset (cursor) pagination for the catalogue.
+
+Offset pagination runs a COUNT(*) on every page and makes the database
+skip over every earlier row, so deep pages get slower as the catalogue
+grows. Cursor pages instead continue from the last (created_at, id) seen,
+which an index answers directly whatever the depth.
+
+Search results are ordered by relevance rather than by date, so they use
+offset cursors instead (paginate_by_offset). Result sets are small enough
+there for the offset to be cheap, and clients still just pass back
+next_cursor.
+
+Cursors are opaque URL-safe tokens; clients should pass back the
+next_cursor they were given and not build their own.
+
+The admin changelists keep Django's numbered pages but use
+EstimatedCountPaginator, which takes the row count of large unfiltered
+tables from the database's statistics instead of a COUNT(*).
+"""
+import base64
+import binascii
+import json
+
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+def _encode(data):
+    raw = json.dumps(data, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode(token):
+    padded = token + '=' * (-len(token) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+
+def encode_cursor(item):
+    """Build the cursor that continues after ``item``."""
+    return _encode({'t': item.created_at.isoformat(), 'id': item.pk})
+
+
+def decode_cursor(token):
+    """
+    Return (created_at, id) from a cursor, or None if it is missing or
+    malformed (callers then start from the first page).
+    """
+    if not token:
+        return None
+    try:
+        data = _decode(token)
+        created_at = parse_datetime(data['t'])
+        pk = int(data['id'])
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeDecodeError):
+        return None
+    if created_at is None:
+        return None
+    return created_at, pk
+
+
+class CursorPage:
+    """
+    One page of cursor-paginated results.
+
+    Offers the subset of Django's Page interface the templates use, plus
+    next_cursor.
+    """
+
+    def __init__(self, object_list, next_cursor, cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def paginate_by_cursor(queryset, token, per_page):
+    """
+    Return a CursorPage of ``queryset`` ordered newest first.
+
+    Fetches one extra row to learn whether another page exists, so no
+    COUNT query is needed.
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    position = decode_cursor(token)
+    if position is not None:
+        created_at, pk = position
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+    rows = list(queryset[:per_page + 1])
+    next_cursor = encode_cursor(rows[per_page - 1]) if len(rows) > per_page else None
+    return CursorPage(rows[:per_page], next_cursor, cursor=token if position else None)
+
+
+def decode_offset_cursor(token):
+    """Return the offset from an offset cursor, or 0 if missing or malformed."""
+    if not token:
+        return 0
+    try:
+        offset = int(_decode(token)['o'])
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeDecodeError):
+        return 0
+    return max(0, offset)
+
+
+def paginate_by_offset(queryset, token, per_page):
+    """
+    Return a CursorPage of an already-ordered ``queryset`` (e.g. search
+    results ranked by relevance), continuing from an offset cursor.
+    """
+    offset = decode_offset_cursor(token)
+    rows = list(queryset[offset:offset + per_page + 1])
+    next_cursor = _encode({'o': offset + per_page}) if len(rows) > per_page else None
+    return CursorPage(rows[:per_page], next_cursor, cursor=token if offset else None)
+
+
+def estimated_row_count(model, using='default'):
+    """
+    The database's estimate of the number of rows in ``model``'s table,
+    or None if it has none (another backend, or statistics not gathered).
+
+    PostgreSQL keeps it in pg_class (updated by VACUUM and ANALYZE);
+    SQLite in sqlite_stat1 once ANALYZE has been run.
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+                row = cursor.fetchone()
+                # -1 means never analyzed
+                return row[0] if row and row[0] >= 0 else None
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+                row = cursor.fetchone()
+                # "<rows> <rows per key> ...", the same leading count for every index
+                return int(row[0].split()[0]) if row else None
+    except DatabaseError:
+        # No sqlite_stat1 table yet
+        return None
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists on tables that can grow large.
+
+    An unfiltered queryset over a table the database estimates at
+    ``threshold`` rows or more is counted from that estimate, so listing
+    tens of thousands of rows doesn't cost a full scan per page. The last
+    page number may then be slightly off, which the admin tolerates.
+    Filtered and searched querysets, and small tables, are counted exactly.
+    """
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.threshold:
+                return estimate
+        return super().count
@@ -0,0 +1,288 @@
+"""
+Background creation of Stripe Payment Links.
+
+New items are saved with link_status PENDING and the upload returns
+straight away; the run_worker command then creates the Stripe Price and
+Payment Link here, retrying with backoff if Stripe is slow or down. The
+item page only shows "Buy Now" once the link is READY.
+
+When an item sells its link is queued for deactivation (link_status
+DEACTIVATING, set by Item.mark_sold) and deactivated here the same way,
+so neither a sale nor an admin request waits on Stripe.
+
+Admin bulk actions for links (create, deactivate, mark sold, relist) live
+here too. They only move items into these queues; the worker makes the
+Stripe calls.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cache import bump_catalogue_version
+from .models import Item
+from .retry import next_attempt_at
+from .stripe_service import create_payment_link_for_item, deactivate_payment_link, fan_out
+
+logger = logging.getLogger(__name__)
+
+# A claim older than this is assumed to belong to a crashed worker
+CREATING_TIMEOUT = timedelta(minutes=10)
+
+
+def _due(now):
+    return (
+        Item.objects.filter(
+            status=Item.STATUS_LIVE,
+            link_status=Item.LINK_PENDING,
+            link_next_attempt_at__lte=now,
+        )
+        | Item.objects.filter(
+            status=Item.STATUS_LIVE,
+            link_status=Item.LINK_CREATING,
+            link_locked_at__lt=now - CREATING_TIMEOUT,
+        )
+    )
+
+
+def claim_item(item):
+    """
+    Atomically claim an item for link creation, counting the attempt.
+
+    Returns False if another worker got there first.
+    """
+    now = timezone.now()
+    claimed = _due(now).filter(pk=item.pk).update(
+        link_status=Item.LINK_CREATING,
+        link_locked_at=now,
+        link_attempts=F('link_attempts') + 1,
+    ) == 1
+    if claimed:
+        item.link_attempts += 1
+    return claimed
+
+
+def process_pending_links(limit=10):
+    """
+    Create Payment Links for live items that are waiting for one.
+
+    Failures are retried with exponential backoff until
+    PAYMENT_LINK_MAX_ATTEMPTS is reached, then left as FAILED (they can be
+    retried from the admin). Returns the number of items processed.
+    """
+    if not settings.STRIPE_SECRET_KEY:
+        # Nothing can succeed; don't burn through the attempts
+        return 0
+    due = list(_due(timezone.now()).order_by('link_next_attempt_at')[:limit])
+    return len(create_links(due))
+
+
+def _due_deactivations(now):
+    return Item.objects.filter(
+        link_status=Item.LINK_DEACTIVATING,
+        link_next_attempt_at__lte=now,
+    ).filter(Q(link_locked_at__isnull=True) | Q(link_locked_at__lt=now - CREATING_TIMEOUT))
+
+
+def claim_deactivation(item):
+    """Atomically claim an item's link for deactivation; False if already claimed."""
+    now = timezone.now()
+    claimed = _due_deactivations(now).filter(pk=item.pk).update(
+        link_locked_at=now,
+        link_attempts=F('link_attempts') + 1,
+    ) == 1
+    if claimed:
+        item.link_attempts += 1
+    return claimed
+
+
+def process_pending_deactivations(limit=10):
+    """
+    Deactivate the Payment Links queued by sales (and the admin).
+
+    Failures are retried with backoff until PAYMENT_LINK_MAX_ATTEMPTS,
+    then left as FAILED with the error. Returns the number processed.
+    """
+    if not settings.STRIPE_SECRET_KEY:
+        return 0
+    max_attempts = getattr(settings, 'PAYMENT_LINK_MAX_ATTEMPTS', 8)
+    due = list(_due_deactivations(timezone.now()).order_by('link_next_attempt_at')[:limit])
+    claimed = [item for item in due if claim_deactivation(item)]
+    for item, _, error in fan_out(_deactivate, claimed):
+        if error is None:
+            update = {'link_status': Item.LINK_DEACTIVATED, 'link_error': ''}
+        else:
+            logger.error(
+                "Payment link deactivation failed for item %s (attempt %s)", item.pk, item.link_attempts,
+                exc_info=error,
+            )
+            update = {'link_error': f"{type(error).__name__}: {error}"}
+            if item.link_attempts >= max_attempts:
+                update['link_status'] = Item.LINK_FAILED
+            else:
+                update['link_next_attempt_at'] = next_attempt_at(item.link_attempts)
+        Item.objects.filter(pk=item.pk, link_status=Item.LINK_DEACTIVATING).update(
+            link_locked_at=None, **update
+        )
+    return len(claimed)
+
+
+def create_links(items, workers=None):
+    """
+    Claim ``items`` and create their Payment Links, several at a time.
+
+    Stripe is called from a thread pool (see fan_out); claims and results
+    are written from this thread. Items another worker has claimed are
+    left out. Returns [(item, error)] with error None for each success.
+    """
+    max_attempts = getattr(settings, 'PAYMENT_LINK_MAX_ATTEMPTS', 8)
+    claimed = [item for item in items if claim_item(item)]
+    results = []
+    for item, created, error in fan_out(create_payment_link_for_item, claimed, workers):
+        if error is None:
+            _record_link(item, *created)
+        else:
+            logger.error(
+                "Payment link creation failed for item %s (attempt %s)", item.pk, item.link_attempts,
+                exc_info=error,
+            )
+            update = {'link_error': f"{type(error).__name__}: {error}", 'link_locked_at': None}
+            if item.link_attempts >= max_attempts:
+                update['link_status'] = Item.LINK_FAILED
+            else:
+                update['link_status'] = Item.LINK_PENDING
+                update['link_next_attempt_at'] = next_attempt_at(item.link_attempts)
+            Item.objects.filter(pk=item.pk).update(**update)
+        results.append((item, error))
+    return results
+
+
+def _record_link(item, payment_link_id, payment_link_url, product_id, price_id):
+    # update() rather than save(): the item may have been edited while
+    # Stripe was being called
+    now = timezone.now()
+    link = {
+        'stripe_payment_link_id': payment_link_id,
+        'stripe_product_id': product_id,
+        'stripe_price_id': price_id,
+        'link_error': '',
+        'link_locked_at': None,
+    }
+    recorded = Item.objects.filter(pk=item.pk, status=Item.STATUS_LIVE).update(
+        stripe_payment_link_url=payment_link_url,
+        link_status=Item.LINK_READY,
+        updated_at=now,
+        **link,
+    )
+    if recorded:
+        bump_catalogue_version()
+        return
+    # Sold (or taken down) while Stripe was creating the link: it must
+    # not stay active, so hand it straight to the deactivation queue
+    queued = Item.objects.filter(pk=item.pk).update(
+        link_status=Item.LINK_DEACTIVATING,
+        link_attempts=0,
+        link_next_attempt_at=now,
+        **link,
+    )
+    if not queued:
+        logger.warning(
+            "Item %s was deleted while its payment link %s was created; deactivate it in Stripe",
+            item.pk, payment_link_id,
+        )
+
+
+def requeue(queryset):
+    """
+    Queue the live items in ``queryset`` that have no link (including
+    FAILED and deactivated ones) for link creation. Returns the count.
+
+    Items whose old link is still being deactivated are left alone, so
+    the new link can't replace it before Stripe has turned it off.
+    """
+    return queryset.filter(status=Item.STATUS_LIVE).exclude(
+        link_status__in=[Item.LINK_READY, Item.LINK_DEACTIVATING]
+    ).update(
+        link_status=Item.LINK_PENDING,
+        link_attempts=0,
+        link_next_attempt_at=timezone.now(),
+        link_locked_at=None,
+    )
+
+
+def deactivate_links(queryset):
+    """
+    Queue the Payment Links of the items in ``queryset`` for deactivation.
+
+    The link URL is cleared at once so live items stop offering it; once
+    the worker has deactivated it they are left DEACTIVATED, without a
+    link until requeued. The link id is kept for webhook lookups.
+    Returns the number queued.
+    """
+    now = timezone.now()
+    queued = queryset.exclude(stripe_payment_link_id='').exclude(
+        link_status__in=[Item.LINK_DEACTIVATING, Item.LINK_DEACTIVATED]
+    ).update(
+        stripe_payment_link_url='',
+        link_status=Item.LINK_DEACTIVATING,
+        link_attempts=0,
+        link_next_attempt_at=now,
+        link_locked_at=None,
+        link_error='',
+        updated_at=now,
+    )
+    if queued:
+        bump_catalogue_version()
+    return queued
+
+
+def _deactivate(item):
+    if not deactivate_payment_link(item.stripe_payment_link_id):
+        raise RuntimeError('Stripe did not deactivate the link (see the log)')
+
+
+def mark_sold(queryset):
+    """
+    Mark the items in ``queryset`` SOLD, as a sale would (no sale emails
+    are sent); their Payment Links are deactivated by the worker.
+
+    Returns the number this call sold.
+    """
+    return sum(1 for item in queryset.exclude(status=Item.STATUS_SOLD) if item.mark_sold())
+
+
+def relist(queryset):
+    """
+    Put the sold items in ``queryset`` back on sale, queued for a new link.
+
+    Items whose old link may still be active are skipped: those the
+    worker hasn't deactivated yet, and those whose deactivation FAILED,
+    which are queued for deactivation again. Returns (number relisted,
+    number requeued for deactivation).
+    """
+    now = timezone.now()
+    sold = queryset.filter(status=Item.STATUS_SOLD)
+    retried = sold.filter(link_status=Item.LINK_FAILED).exclude(stripe_payment_link_id='').update(
+        link_status=Item.LINK_DEACTIVATING,
+        link_attempts=0,
+        link_next_attempt_at=now,
+        link_locked_at=None,
+        link_error='',
+    )
+    relisted = sold.exclude(link_status=Item.LINK_DEACTIVATING).update(
+        status=Item.STATUS_LIVE,
+        sold_at=None,
+        stripe_payment_link_url='',
+        link_status=Item.LINK_PENDING,
+        link_attempts=0,
+        link_next_attempt_at=now,
+        link_locked_at=None,
+        link_error='',
+        # A new updated_at gives the new link new idempotency keys
+        updated_at=now,
+    )
+    if relisted:
+        bump_catalogue_version()
+    return relisted, retried
@@ -0,0 +1,186 @@
+"""
+Per-request performance instrumentation.
+
+With PERFORMANCE_INSTRUMENTATION on, PerformanceMiddleware records for
+each request the number of SQL queries and the time spent in them (via
+connection.execute_wrapper), template rendering time, and time spent
+calling Stripe and SMTP. It reports them in a Server-Timing header, which
+browser dev tools show next to the request, and as one JSON log line on
+the ``store.performance`` logger. Statements slower than
+PERFORMANCE_SLOW_QUERY_MS are logged with their EXPLAIN plan.
+
+Turned off, the middleware removes itself at startup (MiddlewareNotUsed)
+and the Stripe/SMTP hooks reduce to one context variable lookup.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('store_request_timings', default=None)
+
+
+class RequestTimings:
+    """Totals for one request. Stripe calls may add to it from pool threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.db = 0.0
+        self.durations = {}
+        self.counts = {}
+        self.active = set()
+        self.explaining = False
+
+    def add(self, kind, seconds):
+        with self.lock:
+            self.durations[kind] = self.durations.get(kind, 0.0) + seconds
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+
+def record(kind, seconds):
+    """Add an external call (e.g. 'stripe') to the current request's totals, if any."""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(kind, seconds)
+
+
+@contextmanager
+def timed(kind):
+    """
+    Time a block towards the current request's ``kind`` total. Nested
+    blocks of the same kind (a template rendering another) count once.
+    """
+    timings = _current.get()
+    if timings is None or kind in timings.active:
+        yield
+        return
+    timings.active.add(kind)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.active.discard(kind)
+        timings.add(kind, time.perf_counter() - started)
+
+
+def _instrument_templates():
+    """Time every render of a Django template (once per process)."""
+    from django.template.backends.django import Template
+
+    if getattr(Template.render, 'timed', False):
+        return
+    original = Template.render
+
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return original(self, context, request)
+
+    render.timed = True
+    Template.render = render
+
+
+class QueryTimer:
+    """execute_wrapper that counts and times queries, explaining slow ones."""
+
+    def __init__(self, timings, slow_seconds):
+        self.timings = timings
+        self.slow_seconds = slow_seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        timings = self.timings
+        if timings.explaining:
+            # The EXPLAIN issued below; not part of the request's work
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            result = execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with timings.lock:
+                timings.queries += 1
+                timings.db += elapsed
+        if elapsed >= self.slow_seconds:
+            self.log_slow_query(context['connection'], sql, params, many, elapsed)
+        return result
+
+    def log_slow_query(self, connection, sql, params, many, elapsed):
+        plan = ''
+        # Only reads are explained: EXPLAIN never runs them, but keep
+        # well away from writes
+        if not many and sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            plan = self.explain(connection, sql, params)
+        logger.warning("Slow query (%.1fms): %s%s", elapsed * 1000, sql, f"\n{plan}" if plan else '')
+
+    def explain(self, connection, sql, params):
+        self.timings.explaining = True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+                return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+        except DatabaseError as e:
+            return f"(EXPLAIN failed: {e})"
+        finally:
+            self.timings.explaining = False
+
+
+class PerformanceMiddleware:
+    """Report where each request's time went (see module docstring)."""
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERFORMANCE_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, 'PERFORMANCE_SLOW_QUERY_MS', 100) / 1000
+        _instrument_templates()
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                timer = QueryTimer(timings, self.slow_seconds)
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timer))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - started
+        response['Server-Timing'] = self.server_timing(timings, total)
+        self.log(request, response, timings, total)
+        return response
+
+    def server_timing(self, timings, total):
+        metrics = [f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries"']
+        for kind in sorted(timings.durations):
+            calls = timings.counts[kind]
+            desc = '' if kind == 'template' else f';desc="{calls} call{"s" if calls != 1 else ""}"'
+            metrics.append(f'{kind};dur={timings.durations[kind] * 1000:.1f}{desc}')
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def log(self, request, response, timings, total):
+        match = getattr(request, 'resolver_match', None)
+        entry = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_queries': timings.queries,
+            'db_ms': round(timings.db * 1000, 1),
+        }
+        for kind, seconds in sorted(timings.durations.items()):
+            entry[f'{kind}_ms'] = round(seconds * 1000, 1)
+            if kind != 'template':
+                entry[f'{kind}_calls'] = timings.counts[kind]
+        logger.info(json.dumps(entry))
@@ -0,0 +1,24 @@
+"""
+Retry helpers shared by the background worker queues.
+"""
+import random
+from datetime import timedelta
+
+from django.utils import timezone
+
+
+def backoff_delay(attempts, base=5, cap=3600):
+    """
+    Seconds to wait before the next attempt.
+
+    Exponential backoff (base * 2**(attempts - 1), capped at ``cap``) with
+    jitter over the upper half of that window, so retries from a burst of
+    failures spread out instead of landing together.
+    """
+    ceiling = min(cap, base * (2 ** max(0, attempts - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def next_attempt_at(attempts, base=5, cap=3600):
+    """Datetime of the next attempt after ``attempts`` failures."""
+    return timezone.now() + timedelta(seconds=backoff_delay(attempts, base, cap))
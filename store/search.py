@@ -0,0 +1,103 @@
+"""
+Full-text search over item titles and descriptions.
+
+The index lives next to the items table and depends on the database:
+
+- PostgreSQL: a ``search_vector`` tsvector column on store_item with a
+  GIN index (title weighted above description).
+- SQLite: an FTS5 virtual table, ``store_item_fts``, keyed by item id.
+
+Both are created by migration 0011 and kept current by Item.save()
+calling index_item(). Other databases fall back to unindexed
+title/description matching.
+
+Queries match every word, each as a prefix, so partial words typed into
+the search box still find results.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+MAX_TERMS = 8
+
+# Title matches count for more than description matches
+PG_VECTOR_SQL = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
+def search_terms(query):
+    """Split a shopper's query into plain words (no search syntax survives)."""
+    return WORD_RE.findall(query or '')[:MAX_TERMS]
+
+
+def index_item(item):
+    """Write one item's title and description into the search index."""
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == 'postgresql':
+            cursor.execute(
+                f"UPDATE store_item SET search_vector = {PG_VECTOR_SQL} WHERE id = %s",
+                [item.pk],
+            )
+        elif vendor == 'sqlite':
+            with transaction.atomic():
+                cursor.execute("DELETE FROM store_item_fts WHERE rowid = %s", [item.pk])
+                cursor.execute(
+                    "INSERT INTO store_item_fts (rowid, title, description) VALUES (%s, %s, %s)",
+                    [item.pk, item.title, item.description or ''],
+                )
+
+
+def unindex_item(pk):
+    """Drop a deleted item from the search index."""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM store_item_fts WHERE rowid = %s", [pk])
+
+
+def search_items(queryset, query):
+    """
+    Filter an Item queryset to matches for ``query``, best first.
+
+    Adds a ``search_rank`` annotation. Existing filters (such as a
+    category) are kept. A query with no words returns no items.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+
+    vendor = connection.vendor
+    if vendor == 'postgresql':
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        queryset = queryset.filter(
+            RawSQL("store_item.search_vector @@ to_tsquery('english', %s)", [tsquery], output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(
+                "ts_rank(store_item.search_vector, to_tsquery('english', %s))",
+                [tsquery], output_field=FloatField(),
+            )
+        )
+    elif vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        queryset = queryset.filter(
+            id__in=RawSQL("SELECT rowid FROM store_item_fts WHERE store_item_fts MATCH %s", [match])
+        ).annotate(
+            # bm25() is lower for better matches; negate so higher ranks first.
+            # Title weighted 10x description.
+            search_rank=RawSQL(
+                "(SELECT -bm25(store_item_fts, 10.0, 1.0) FROM store_item_fts "
+                "WHERE store_item_fts MATCH %s AND rowid = store_item.id)",
+                [match], output_field=FloatField(),
+            )
+        )
+    else:
+        for term in terms:
+            queryset = queryset.filter(Q(title__icontains=term) | Q(description__icontains=term))
+        queryset = queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    return queryset.order_by('-search_rank', '-created_at', '-id')
@@ -0,0 +1,87 @@
+"""
+Unique slug allocation for Item and Category.
+
+The next slug in the sequence ("chair", "chair-1", "chair-2", ...) is
+found with a single query for the highest existing suffix, rather than
+testing each candidate in turn, so saving the hundredth "Chair" costs the
+same as the first. Two saves racing for the same slug are settled by the unique
+constraint: the loser's insert fails inside a savepoint and it allocates
+again.
+"""
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Length
+from django.utils.text import slugify
+
+# Saves racing for the same title rarely collide more than once
+MAX_ATTEMPTS = 5
+
+
+def next_free_slug(model, value, exclude_pk=None, field_name='slug'):
+    """
+    Return an unused slug for ``model`` made from ``value``.
+
+    The base slug is used if neither it nor any suffixed form of it is
+    taken, otherwise the base followed by one more than the highest
+    numeric suffix already taken. A freed base slug is not reused once
+    suffixed ones exist: finding that out would take a second query. The
+    result is trimmed to fit the field.
+    """
+    max_length = model._meta.get_field(field_name).max_length
+    base = slugify(value)[:max_length].strip('-') or model._meta.model_name
+    while True:
+        suffix = _next_suffix(model, base, exclude_pk, field_name)
+        if suffix is None:
+            return base
+        slug = f"{base}-{suffix}"
+        if len(slug) <= max_length:
+            return slug
+        # Make room for the suffix; the shorter base has its own suffixes
+        base = base[:max_length - len(str(suffix)) - 1].strip('-') or model._meta.model_name
+
+
+def _next_suffix(model, base, exclude_pk, field_name):
+    """None if neither ``base`` nor any ``base-N`` is taken, else the suffix to append."""
+    suffixed = {
+        f'{field_name}__startswith': f'{base}-',
+        f'{field_name}__regex': rf'^{re.escape(base)}-[1-9][0-9]*$',
+    }
+    queryset = model._default_manager.filter(Q(**{field_name: base}) | Q(**suffixed))
+    if exclude_pk is not None:
+        queryset = queryset.exclude(pk=exclude_pk)
+    # Longest first, then descending, puts the highest number on top
+    # ("chair-10" before "chair-9")
+    highest = queryset.order_by(Length(field_name).desc(), f'-{field_name}') \
+        .values_list(field_name, flat=True).first()
+    if highest is None:
+        return None
+    if highest == base:
+        return 1
+    return int(highest[len(base) + 1:]) + 1
+
+
+def save_with_unique_slug(instance, value, save, field_name='slug'):
+    """
+    Call ``save()``, first giving ``instance`` a slug made from ``value``
+    if it has none.
+
+    The save runs in a savepoint; if it fails because another save took
+    the slug in the meantime, a new slug is allocated and the save tried
+    again. Any other IntegrityError is raised as usual.
+    """
+    if getattr(instance, field_name):
+        return save()
+
+    model = type(instance)
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        slug = next_free_slug(model, value, instance.pk, field_name)
+        setattr(instance, field_name, slug)
+        try:
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            taken = model._default_manager.filter(**{field_name: slug}).exclude(pk=instance.pk).exists()
+            if not taken or attempt == MAX_ATTEMPTS:
+                raise
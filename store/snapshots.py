@@ -0,0 +1,307 @@
+"""
+Precomputed catalogue snapshots.
+
+The infinite scroll used to fetch every further page of cards as JSON
+from ItemListView, running the same ORM queries for every visitor. The
+catalogue changes a few times a day, so the background worker instead
+writes one JSON file per category (plus one for all items) holding every
+card in list order, and the page hands the browser its URL. Scrolling
+then pages through the file client-side without touching Django's
+database.
+
+Files live in MEDIA_ROOT/<CATALOGUE_SNAPSHOT_DIR> and are named by a hash
+of their content, so store.media serves them as immutable, gzip (and
+brotli, if the `brotli` package is installed) precompressed. Each is
+written to a temporary file and renamed into place, and manifest.json
+maps each category to its current file.
+
+Snapshots are built by the web service, because it is the process that
+serves MEDIA_ROOT (on Render the worker has a disk of its own). The
+manifest records the catalogue version it was built for; a list page
+that finds it behind the current version (store.cache) falls back to
+fetching pages from the server and refreshes the snapshots in a
+background thread. That needs the version shared between processes, so
+CATALOGUE_SNAPSHOTS defaults to on only when the page cache is.
+
+A refresh first compares a cheap stamp of the item table and category
+slugs, so version bumps that don't change any card (a new payment link,
+a category description) only re-stamp the manifest. Only snapshots
+whose content changed are rewritten; superseded files are kept for a
+day for pages still holding their URLs.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Max
+from django.urls import reverse
+from django.utils import timezone
+
+from .cache import catalogue_version
+from .imaging import build_srcset, derivative_url
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip alone is fine
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+ALL_ITEMS = ''
+FINGERPRINT_LENGTH = 20
+
+# Superseded files stay this long for pages (and cached pages) that still
+# point at them
+RETENTION_SECONDS = 24 * 60 * 60
+
+# After a failed background refresh, list pages wait this long before
+# starting another
+REFRESH_RETRY_SECONDS = 60
+
+_manifest_cache = {'mtime_ns': None, 'manifest': {}}
+_refresh_lock = threading.Lock()
+_refresh_state = {'failed_at': None}
+
+
+def snapshots_enabled():
+    return getattr(settings, 'CATALOGUE_SNAPSHOTS', True)
+
+
+def snapshot_dir():
+    return Path(settings.MEDIA_ROOT) / getattr(settings, 'CATALOGUE_SNAPSHOT_DIR', 'catalogue')
+
+
+def item_card(item):
+    """The card data the item list shows for one item (JSON-serializable)."""
+    from .models import Item
+
+    primary_image_url = ''
+    primary_image_srcset = ''
+    primary_image_webp_srcset = ''
+    if item.primary_image_id:
+        primary_image_url = derivative_url(item.primary_image, 640)
+        primary_image_srcset = build_srcset(item.primary_image, 'jpeg')
+        primary_image_webp_srcset = build_srcset(item.primary_image, 'webp')
+
+    return {
+        'id': item.id,
+        'title': item.title,
+        'price_amount': str(item.price_amount),
+        'currency': item.currency,
+        'status': item.status,
+        'primary_image_url': primary_image_url,
+        'primary_image_srcset': primary_image_srcset,
+        'primary_image_webp_srcset': primary_image_webp_srcset,
+        'detail_url': reverse('store:item_detail', kwargs={'pk': item.pk}),
+        'is_sold': item.status == Item.STATUS_SOLD,
+    }
+
+
+def _file_prefix(key):
+    return 'all' if key == ALL_ITEMS else f'category-{key}'
+
+
+def build_snapshots():
+    """
+    Return {category slug (ALL_ITEMS for everything): JSON bytes}.
+
+    One query for the items; cards are grouped in the list view's order
+    (newest first).
+    """
+    from .models import Category, Item
+
+    cards = {ALL_ITEMS: []}
+    cards.update((slug, []) for slug in Category.objects.values_list('slug', flat=True))
+    items = (
+        Item.objects.select_related('category', 'primary_image')
+        .order_by('-created_at', '-id')
+    )
+    for item in items.iterator(chunk_size=500):
+        card = item_card(item)
+        cards[ALL_ITEMS].append(card)
+        if item.category_id:
+            cards.setdefault(item.category.slug, []).append(card)
+
+    return {
+        key: json.dumps(
+            {'category': key, 'items': category_cards},
+            separators=(',', ':'),
+            ensure_ascii=False,
+        ).encode()
+        for key, category_cards in cards.items()
+    }
+
+
+def write_atomic(path, data):
+    """Write ``data`` to ``path`` via a temporary file and rename."""
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _write_snapshot(directory, key, data):
+    """Write one snapshot and its precompressed variants; return its file name."""
+    fingerprint = hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]
+    name = f'{_file_prefix(key)}-{fingerprint}.json'
+    path = directory / name
+    if not path.exists():
+        # Compressed variants first: the plain file's presence marks the set complete
+        write_atomic(directory / f'{name}.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            write_atomic(directory / f'{name}.br', brotli.compress(data))
+        write_atomic(path, data)
+    return name
+
+
+def read_manifest():
+    """The current manifest, re-read only when the file changes."""
+    path = snapshot_dir() / MANIFEST_NAME
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except OSError:
+        return {}
+    if mtime_ns != _manifest_cache['mtime_ns']:
+        try:
+            manifest = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return {}
+        _manifest_cache.update(mtime_ns=mtime_ns, manifest=manifest)
+    return _manifest_cache['manifest']
+
+
+def snapshot_url(category_slug=ALL_ITEMS):
+    """URL of the snapshot for a category (or all items), or None if there isn't one yet."""
+    if not snapshots_enabled():
+        return None
+    name = read_manifest().get('files', {}).get(category_slug)
+    if not name:
+        return None
+    directory = getattr(settings, 'CATALOGUE_SNAPSHOT_DIR', 'catalogue')
+    return f"{settings.MEDIA_URL}{directory}/{name}"
+
+
+def snapshots_current():
+    """
+    True if the snapshots were built for the current catalogue version.
+
+    With no cache to hold the version (the dummy backend the export and
+    the benchmark render with), the files are taken as they are.
+    """
+    if not snapshots_enabled():
+        return False
+    version = catalogue_version()
+    return version is None or read_manifest().get('version') == version
+
+
+def _stamp():
+    """Cheap summary of the catalogue: unchanged means the snapshots are current."""
+    from .models import Category, Item
+
+    stats = Item.objects.aggregate(last=Max('updated_at'), count=Count('id'))
+    last = stats['last'].isoformat() if stats['last'] else None
+    slugs = sorted(Category.objects.values_list('slug', flat=True))
+    return [last, stats['count'], slugs]
+
+
+def _prune(directory, keep):
+    cutoff = time.time() - RETENTION_SECONDS
+    for path in directory.iterdir():
+        name = path.name
+        if name == MANIFEST_NAME or name.split('.json')[0] + '.json' in keep:
+            continue
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _write_manifest(directory, version, stamp, files):
+    write_atomic(directory / MANIFEST_NAME, json.dumps({
+        'version': version,
+        'stamp': stamp,
+        'generated_at': timezone.now().isoformat(),
+        'files': files,
+    }, indent=2).encode())
+
+
+def refresh_snapshots(force=False):
+    """
+    Rewrite the snapshots whose content changed; return how many were written.
+
+    The manifest is stamped with the catalogue version read before
+    anything else, so a change committed during the refresh leaves it
+    behind and the next list page refreshes again. Without ``force``,
+    only the manifest's version is updated if the stamp shows no change.
+    """
+    if not snapshots_enabled():
+        return 0
+    directory = snapshot_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest()
+    version = catalogue_version()
+    stamp = _stamp()
+    old_files = manifest.get('files', {})
+    if not force and manifest.get('stamp') == stamp:
+        if manifest.get('version') != version:
+            _write_manifest(directory, version, stamp, old_files)
+        return 0
+
+    files = {}
+    written = 0
+    for key, data in build_snapshots().items():
+        files[key] = _write_snapshot(directory, key, data)
+        if files[key] != old_files.get(key):
+            written += 1
+
+    _write_manifest(directory, version, stamp, files)
+    _prune(directory, set(files.values()))
+    if written:
+        logger.info("Wrote %d catalogue snapshot(s)", written)
+    return written
+
+
+def _refresh_in_thread():
+    try:
+        refresh_snapshots()
+    except Exception:
+        _refresh_state['failed_at'] = time.monotonic()
+        logger.exception("Catalogue snapshot refresh failed")
+    finally:
+        connection.close()
+        _refresh_lock.release()
+
+
+def refresh_in_background():
+    """
+    Start refreshing the snapshots in a background thread, unless this
+    process is already doing so or failed to within REFRESH_RETRY_SECONDS.
+    """
+    failed_at = _refresh_state['failed_at']
+    if failed_at is not None and time.monotonic() - failed_at < REFRESH_RETRY_SECONDS:
+        return
+    if not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        threading.Thread(target=_refresh_in_thread, name='catalogue-snapshots', daemon=True).start()
+    except BaseException:
+        _refresh_lock.release()
+        raise
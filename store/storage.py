@@ -0,0 +1,108 @@
+"""
+Content-addressed storage for item photos.
+
+Files are named by the SHA-256 of their bytes (items/<digest>.jpg), so:
+
+- uploading the same photo twice stores it once;
+- a URL always points at the same bytes, so media can be served with
+  `Cache-Control: immutable` (see store.media).
+
+Because several ItemImage rows can share one file, files are only deleted
+once no row references them any more (see release_files). Existing files
+with upload-time names are moved over with `python manage.py rehash_media`.
+"""
+import hashlib
+import os
+import re
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+CONTENT_NAME_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def content_digest(content):
+    """SHA-256 hex digest of a Django File, read in chunks."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_content_addressed(name):
+    """True if ``name`` is already a content-hash name."""
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return bool(CONTENT_NAME_RE.match(stem))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names files after their content.
+
+    The directory comes from the requested name (i.e. upload_to) and the
+    extension from the original file name; the rest of the requested
+    name is discarded. Saving content that is already stored returns the
+    existing name without writing anything.
+    """
+
+    def content_name(self, name, content):
+        directory = os.path.dirname(name)
+        ext = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, content_digest(content) + ext).replace('\\', '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        # Two identical uploads racing past exists() end up as two copies
+        # (the loser gets a suffixed name); harmless, just not deduplicated
+        return super().save(name, content, max_length=max_length)
+
+
+def item_image_storage():
+    """Storage for ItemImage.image (a callable so migrations stay stable)."""
+    return ContentAddressedStorage()
+
+
+def image_file_names(image_name, derivatives):
+    """Every storage name used by one ItemImage: the original and its derivatives."""
+    names = {image_name} if image_name else set()
+    for entry in (derivatives or {}).values():
+        names.update(value for key, value in entry.items() if key != 'height' and value)
+    return names
+
+
+def release_files(image_name, names, storage, exclude_pk=None):
+    """
+    Delete files from ``names`` (the original ``image_name`` and/or its
+    derivatives) that no ItemImage other than ``exclude_pk`` still uses.
+
+    Derivatives are rendered deterministically from the original, so only
+    rows sharing an original can share files. Deletion waits for the
+    transaction to commit so a rollback never leaves rows pointing at
+    missing files.
+    """
+    from .models import ItemImage
+
+    names = {name for name in names if name}
+    if not names:
+        return
+    sharing = ItemImage.objects.filter(image=image_name)
+    if exclude_pk is not None:
+        sharing = sharing.exclude(pk=exclude_pk)
+    in_use = set()
+    for shared_name, derivatives in sharing.values_list('image', 'derivatives'):
+        in_use |= image_file_names(shared_name, derivatives)
+    orphaned = names - in_use
+
+    def delete():
+        for name in orphaned:
+            storage.delete(name)
+
+    if orphaned:
+        transaction.on_commit(delete)
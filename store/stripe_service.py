@@ -1,99 +1,322 @@
 """
 Stripe service for creating Payment Links.
+
+All API calls go through StripeGateway, which keeps one StripeClient
+(with pooled HTTP connections and explicit timeouts) per process,
+retries transient failures with jittered backoff, sends idempotency keys
+so a retried create never makes duplicates, and records how long each
+call took. Calls are rate limited per process, and fan_out() runs a batch
+of calls across a bounded thread pool.
 """
+import contextvars
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import stripe
 from django.conf import settings
-from decimal import Decimal
 
+from . import performance
+from .retry import backoff_delay
 
-def create_payment_link_for_item(item):
+logger = logging.getLogger(__name__)
+
+# Network failures, rate limits and Stripe-side 5xx are worth retrying;
+# card, validation and auth errors are not
+RETRYABLE_ERRORS = (stripe.error.APIConnectionError, stripe.error.RateLimitError, stripe.error.APIError)
+
+_latency_lock = threading.Lock()
+_latency = defaultdict(lambda: {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+
+
+def record_latency(operation, seconds, ok=True):
+    """Add one Stripe call to the in-process latency totals."""
+    ms = seconds * 1000
+    with _latency_lock:
+        stats = _latency[operation]
+        stats['calls'] += 1
+        stats['errors'] += 0 if ok else 1
+        stats['total_ms'] += ms
+        stats['max_ms'] = max(stats['max_ms'], ms)
+    performance.record('stripe', seconds)
+    logger.debug("Stripe %s took %.0fms%s", operation, ms, '' if ok else ' (failed)')
+
+
+def latency_stats():
+    """Per-operation call counts and timings (ms) since the process started."""
+    with _latency_lock:
+        return {
+            operation: {
+                **stats,
+                'avg_ms': round(stats['total_ms'] / stats['calls'], 1) if stats['calls'] else 0.0,
+                'total_ms': round(stats['total_ms'], 1),
+                'max_ms': round(stats['max_ms'], 1),
+            }
+            for operation, stats in _latency.items()
+        }
+
+
+def idempotency_key(operation, item, params):
     """
-    Create a Stripe Product, Price, and Payment Link for an item.
-    
-    The Payment Link will be deactivated after the first successful payment
-    via webhook to enforce single-payment limit.
-    
-    Returns tuple of (payment_link_id, payment_link_url, product_id, price_id)
+    Idempotency key for a create call.
+
+    Derived from the item (including its last save) and the exact
+    request, so retrying the same request, even from another process,
+    returns the original object, while a changed or relisted item gets a
+    new key.
     """
-    if not settings.STRIPE_SECRET_KEY:
-        raise ValueError("STRIPE_SECRET_KEY not configured")
+    material = json.dumps([params, item.updated_at], sort_keys=True, default=str)
+    digest = hashlib.sha256(material.encode()).hexdigest()[:16]
+    return f"item-{item.id}-{operation}-{digest}"
 
-    # Set API key at call time (avoids stale settings in long-running processes)
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-    
-    # Create Product with metadata containing item_id
-    # Include item ID in name for easy identification in Stripe Dashboard
-    product = stripe.Product.create(
-        name=f"#{item.id} - {item.title}",
-        description=item.description[:500] if item.description else f"Item #{item.id}",
-        metadata={
-            'item_id': str(item.id),
-            'item_title': item.title,
-        }
-    )
-    
-    # Create Price (one-time payment, not recurring)
-    # Convert Decimal to integer cents
-    amount_cents = int(item.price_amount * 100)
-    
-    price = stripe.Price.create(
-        product=product.id,
-        unit_amount=amount_cents,
-        currency=item.currency.lower(),
-    )
-    
-    # Create Payment Link
-    # Collect customer name, email, and phone number for pickup coordination
-    # Include item_id in metadata for webhook access
-    # Note: Payment Links don't have a direct "max_payments" parameter.
-    # We enforce single payment by deactivating the link after first sale via webhook.
-    payment_link = stripe.PaymentLink.create(
-        line_items=[
-            {
-                'price': price.id,
-                'quantity': 1,
-            }
-        ],
-        metadata={
-            'item_id': str(item.id),
-            'item_title': item.title,
-            'django_item_id': str(item.id),  # Easy to spot in dashboard
-        },
-        # Collect phone number (for pickup coordination)
-        phone_number_collection={
-            'enabled': True,
-        },
-        # Collect customer details (name and email)
-        custom_fields=[
-            {
-                'key': 'buyer_name',
-                'label': {'type': 'custom', 'custom': 'Full Name'},
-                'type': 'text',
-            },
-        ],
-        # Add invoice creation for better tracking in Stripe Dashboard
-        invoice_creation={
-            'enabled': True,
-            'invoice_data': {
-                'description': f"Item #{item.id} - {item.title}",
+
+class RateLimiter:
+    """
+    Token bucket shared by every thread of the process: allows ``rate``
+    calls per second on average, with bursts of up to ``rate`` calls.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a call may be made."""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class StripeGateway:
+    """Wrapper around one StripeClient with retries, rate limiting and latency recording."""
+
+    def __init__(self, api_key, api_base='', timeout=(5, 20), max_retries=3, max_rate=0):
+        kwargs = {}
+        if api_base:
+            kwargs['base_addresses'] = {'api': api_base}
+        client = stripe.StripeClient(
+            api_key,
+            http_client=stripe.RequestsClient(timeout=timeout),
+            # Retries are done here so they can be timed and logged
+            max_network_retries=0,
+            **kwargs,
+        )
+        # stripe>=12 groups the v1 API under client.v1
+        self.api = getattr(client, 'v1', client)
+        self.max_retries = max_retries
+        self.limiter = RateLimiter(max_rate)
+
+    def call(self, operation, method, *args, **kwargs):
+        """
+        Run one API call, retrying transient errors with jittered backoff.
+
+        Raises the last StripeError if every attempt fails.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                result = method(*args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                record_latency(operation, time.monotonic() - started, ok=False)
+                if attempt > self.max_retries:
+                    raise
+                delay = backoff_delay(attempt, base=0.5, cap=8)
+                logger.warning(
+                    "Stripe %s failed (attempt %s), retrying in %.1fs: %s",
+                    operation, attempt, delay, e,
+                )
+                time.sleep(delay)
+            except stripe.error.StripeError:
+                record_latency(operation, time.monotonic() - started, ok=False)
+                raise
+            else:
+                record_latency(operation, time.monotonic() - started)
+                return result
+
+    def create_price(self, item):
+        """Create a one-time Price with its Product inline (one round-trip)."""
+        params = {
+            # Convert Decimal to integer cents
+            'unit_amount': int(item.price_amount * 100),
+            'currency': item.currency.lower(),
+            # Include item ID in name for easy identification in Stripe Dashboard
+            'product_data': {
+                'name': f"#{item.id} - {item.title}",
                 'metadata': {
                     'item_id': str(item.id),
+                    'item_title': item.title,
+                },
+            },
+        }
+        return self.call(
+            'prices.create', self.api.prices.create,
+            params=params,
+            options={'idempotency_key': idempotency_key('price', item, params)},
+        )
+
+    def create_payment_link(self, item, price_id):
+        """Create the single-item Payment Link for a price."""
+        # Collect customer name, email, and phone number for pickup coordination
+        # Include item_id in metadata for webhook access
+        # Note: Payment Links don't have a direct "max_payments" parameter.
+        # We enforce single payment by deactivating the link after first sale via webhook.
+        params = {
+            'line_items': [
+                {
+                    'price': price_id,
+                    'quantity': 1,
+                }
+            ],
+            'metadata': {
+                'item_id': str(item.id),
+                'item_title': item.title,
+                'django_item_id': str(item.id),  # Easy to spot in dashboard
+            },
+            # Collect phone number (for pickup coordination)
+            'phone_number_collection': {
+                'enabled': True,
+            },
+            # Collect customer details (name and email)
+            'custom_fields': [
+                {
+                    'key': 'buyer_name',
+                    'label': {'type': 'custom', 'custom': 'Full Name'},
+                    'type': 'text',
+                },
+            ],
+            # Add invoice creation for better tracking in Stripe Dashboard
+            'invoice_creation': {
+                'enabled': True,
+                'invoice_data': {
+                    'description': f"Item #{item.id} - {item.title}",
+                    'metadata': {
+                        'item_id': str(item.id),
+                    },
                 },
             },
-        },
-        # Enable Stripe automatic email receipts
-        after_completion={
-            'type': 'hosted_confirmation',
-            'hosted_confirmation': {
-                'custom_message': 'Thanks for your purchase! Please text Julia on 021 649 477 to arrange pickup.',
+            # Enable Stripe automatic email receipts
+            'after_completion': {
+                'type': 'hosted_confirmation',
+                'hosted_confirmation': {
+                    'custom_message': 'Thanks for your purchase! Please text Julia on 021 649 477 to arrange pickup.',
+                },
             },
-        },
+        }
+        return self.call(
+            'payment_links.create', self.api.payment_links.create,
+            params=params,
+            options={'idempotency_key': idempotency_key('payment-link', item, params)},
+        )
+
+    def deactivate_payment_link(self, payment_link_id):
+        return self.call(
+            'payment_links.update', self.api.payment_links.update,
+            payment_link_id, params={'active': False},
+        )
+
+    def list_line_items(self, session_id, limit=1):
+        return self.call(
+            'checkout.sessions.line_items.list', self.api.checkout.sessions.line_items.list,
+            session_id, params={'limit': limit},
+        )
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """
+    The process-wide StripeGateway, rebuilt if the Stripe settings change.
+
+    Raises ValueError if STRIPE_SECRET_KEY is not configured.
+    """
+    global _gateway
+    if not settings.STRIPE_SECRET_KEY:
+        raise ValueError("STRIPE_SECRET_KEY not configured")
+    config = (
+        settings.STRIPE_SECRET_KEY,
+        settings.STRIPE_API_BASE,
+        (settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+        settings.STRIPE_MAX_RETRIES,
+        settings.STRIPE_MAX_REQUESTS_PER_SECOND,
+    )
+    with _gateway_lock:
+        if _gateway is None or _gateway[0] != config:
+            _gateway = (config, StripeGateway(*config))
+        return _gateway[1]
+
+
+def fan_out(function, items, workers=None):
+    """
+    Call ``function(item)`` for each item across a bounded thread pool.
+
+    Yields (item, result, error) as calls finish, with error None on
+    success or the exception raised. ``function`` must only talk to
+    Stripe: database reads and writes belong in the calling thread, which
+    consumes the results. The gateway's rate limit applies across threads.
+    """
+    items = list(items)
+    workers = min(workers or settings.STRIPE_BULK_WORKERS, len(items))
+    if workers <= 1:
+        for item in items:
+            try:
+                yield item, function(item), None
+            except Exception as e:
+                yield item, None, e
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stripe') as pool:
+        # Each call gets a copy of this thread's context, so its time still
+        # counts towards the current request (see store.performance)
+        futures = {pool.submit(contextvars.copy_context().run, function, item): item for item in items}
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
+
+
+def create_payment_link_for_item(item):
+    """
+    Create a Stripe Product, Price, and Payment Link for an item.
+
+    The Product is created inline with the Price, so this takes two API
+    round-trips. The Payment Link will be deactivated after the first
+    successful payment via webhook to enforce single-payment limit.
+
+    Returns tuple of (payment_link_id, payment_link_url, product_id, price_id)
+    """
+    gateway = get_gateway()
+    started = time.monotonic()
+    price = gateway.create_price(item)
+    priced = time.monotonic()
+    payment_link = gateway.create_payment_link(item, price.id)
+    finished = time.monotonic()
+    logger.info(
+        "Created payment link for item %s in %.0fms (price %.0fms, payment link %.0fms)",
+        item.id, (finished - started) * 1000, (priced - started) * 1000, (finished - priced) * 1000,
     )
-    
+
     return (
         payment_link.id,
         payment_link.url,
-        product.id,
+        price.product,
         price.id,
     )
 
@@ -102,16 +325,17 @@ def deactivate_payment_link(payment_link_id):
     """
     Deactivate a Payment Link to prevent further payments.
     Called after an item is sold via webhook.
+
+    Returns True if the link was deactivated. Failures are logged rather
+    than raised: the item is already marked as SOLD, which is the source
+    of truth.
     """
     if not settings.STRIPE_SECRET_KEY:
-        return
-    
+        return False
+
     try:
-        stripe.PaymentLink.modify(
-            payment_link_id,
-            active=False
-        )
+        get_gateway().deactivate_payment_link(payment_link_id)
     except stripe.error.StripeError:
-        # If deactivation fails, log but don't raise
-        # The item is already marked as SOLD, which is the source of truth
-        pass
+        logger.exception("Could not deactivate payment link %s", payment_link_id)
+        return False
+    return True
@@ -0,0 +1,67 @@
+"""
+Template tags for responsive item images.
+
+Usage:
+    {% load store_images %}
+    {% responsive_image item.primary_image alt=item.title sizes="card" class="item-image" %}
+"""
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from ..imaging import build_srcset, derivative_url
+
+register = template.Library()
+
+# Named sizes presets matching the breakpoints in static/css/style.css
+SIZES = {
+    'card': '(min-width: 1024px) 25vw, (min-width: 768px) 33vw, (min-width: 480px) 50vw, 100vw',
+    'detail': '(min-width: 768px) 50vw, 100vw',
+    'thumbnail': '100px',
+}
+
+
+@register.simple_tag
+def responsive_image(image, alt='', sizes='100vw', loading='lazy', min_width=640, **attrs):
+    """
+    Render a <picture> with a WebP source and a JPEG fallback <img>.
+
+    ``sizes`` may be a preset name from SIZES or a literal sizes value.
+    ``min_width`` picks the fallback src for browsers without srcset
+    support. Extra keyword arguments become attributes on the <img>, with
+    underscores turned into hyphens (``data_full_src`` -> ``data-full-src``).
+    Images without derivatives render a plain <img> of the original.
+    """
+    if not image or not image.image:
+        return ''
+    sizes = SIZES.get(sizes, sizes)
+    extra = format_html_join(
+        '', ' {}="{}"', ((name.replace('_', '-'), value) for name, value in attrs.items())
+    )
+    jpeg_srcset = build_srcset(image, 'jpeg')
+    if not jpeg_srcset:
+        return format_html(
+            '<img src="{}" alt="{}" loading="{}"{}>',
+            image.image.url, alt, loading, extra,
+        )
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" loading="{}"{}></picture>',
+        build_srcset(image, 'webp'), sizes,
+        derivative_url(image, min_width), jpeg_srcset, sizes, alt, loading, extra,
+    )
+
+
+@register.simple_tag
+def image_url(image, min_width=320):
+    """URL of the smallest derivative at least ``min_width`` wide."""
+    if not image or not image.image:
+        return ''
+    return derivative_url(image, min_width)
+
+
+@register.simple_tag
+def image_srcset(image, fmt='jpeg'):
+    """srcset string for an image's derivatives in the given format."""
+    if not image or not image.image:
+        return ''
+    return build_srcset(image, fmt)
@@ -0,0 +1,86 @@
+import json
+import re
+import tempfile
+from decimal import Decimal
+from pathlib import Path
+
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from .export import export_site
+from .media import _parse_range, serve_media
+from .models import Item
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_satisfiable_ranges(self):
+        self.assertEqual(_parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(_parse_range('bytes=500-', 1000), (500, 999))
+        self.assertEqual(_parse_range('bytes=900-2000', 1000), (900, 999))
+        self.assertEqual(_parse_range('bytes=-100', 1000), (900, 999))
+
+    def test_last_before_first_is_ignored(self):
+        self.assertIsNone(_parse_range('bytes=500-100', 1000))
+        # Ignored even when the first byte is also past the end
+        self.assertIsNone(_parse_range('bytes=2000-1500', 1000))
+
+    def test_start_past_end_is_unsatisfiable(self):
+        self.assertIs(_parse_range('bytes=1000-', 1000), False)
+        self.assertIs(_parse_range('bytes=1000-1999', 1000), False)
+
+
+class ServeMediaRangeTests(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        Path(media_root.name, 'photo.bin').write_bytes(bytes(range(256)) * 4)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name, MEDIA_SENDFILE_BACKEND='')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get(self, byte_range):
+        request = RequestFactory().get('/media/photo.bin', HTTP_RANGE=byte_range)
+        return serve_media(request, 'photo.bin')
+
+    def test_range(self):
+        response = self.get('bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+
+    def test_last_before_first_serves_whole_file(self):
+        response = self.get('bytes=500-100')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Range', response)
+        self.assertEqual(len(b''.join(response.streaming_content)), 1024)
+
+    def test_start_past_end_is_416(self):
+        response = self.get('bytes=2048-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+
+class ExportScrollTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        output = tempfile.TemporaryDirectory()
+        self.addCleanup(output.cleanup)
+        self.output = Path(output.name)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_exported_list_scrolls_past_first_page(self):
+        for n in range(15):
+            Item.objects.create(title=f'Item {n}', description='For sale', price_amount=Decimal('5.00'))
+        export_site(self.output)
+
+        html = (self.output / 'index.html').read_text()
+        # infinite_scroll.js keeps loading while data-has-next is true,
+        # from the snapshot the page points at
+        self.assertRegex(html, r'class="pagination" data-has-next="true"')
+        snapshot_url = re.search(r'data-snapshot-url="([^"]+)"', html).group(1)
+        snapshot = json.loads((self.output / snapshot_url.lstrip('/')).read_text())
+        self.assertEqual(len(snapshot['items']), 15)
+        self.assertTrue((self.output / 'page' / '2' / 'index.html').exists())
+        self.assertIn('data-has-next="false"', (self.output / 'page' / '2' / 'index.html').read_text())
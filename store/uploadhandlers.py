@@ -0,0 +1,122 @@
+"""
+Upload handler that checks photos while they stream in.
+
+Listed first in FILE_UPLOAD_HANDLERS, ImageUploadHandler sees every
+chunk before Django's memory/temporary-file handlers store it. It:
+
+- sniffs the leading bytes and skips files that aren't JPEG, PNG, GIF or
+  WebP, whatever content type the client claimed;
+- feeds the first part of each file to Pillow's incremental parser to
+  read the dimensions from the header, skipping files it can't parse or
+  that exceed UPLOAD_MAX_IMAGE_PIXELS;
+- skips files larger than UPLOAD_MAX_IMAGE_SIZE as soon as they pass it;
+- stops reading the request altogether once its uploads exceed
+  UPLOAD_MAX_REQUEST_SIZE, or at the first file if the visitor is
+  neither upload-authenticated nor admin staff (CSRF checking parses the
+  body before the view's password check would otherwise run).
+
+Skipped files never reach memory or disk. Their names and the reasons are
+collected on ``request.rejected_uploads`` so views can tell the user.
+Files too short to identify pass through to the model validators.
+"""
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile, StopUpload
+from django.template.defaultfilters import filesizeformat
+from PIL import ImageFile
+
+from .validators import SNIFF_BYTES, max_image_size, sniff_image_type
+
+# Give up on reading dimensions after this much of a file; image headers
+# (including EXIF) come well before it
+HEADER_PARSE_LIMIT = 256 * 1024
+
+
+class ImageUploadHandler(FileUploadHandler):
+    """Validate uploaded images chunk by chunk, passing good data through."""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_file_size = max_image_size()
+        self.max_request_size = getattr(settings, 'UPLOAD_MAX_REQUEST_SIZE', 50 * 1024 * 1024)
+        self.max_pixels = getattr(settings, 'UPLOAD_MAX_IMAGE_PIXELS', 40_000_000)
+        self.request_total = 0
+        self.request_length = 0
+
+    def _record(self, reason):
+        if self.request is not None:
+            if not hasattr(self.request, 'rejected_uploads'):
+                self.request.rejected_uploads = []
+            self.request.rejected_uploads.append((self.file_name, reason))
+
+    def reject(self, reason):
+        """Record why the current file was dropped and skip the rest of it."""
+        self._record(reason)
+        raise SkipFile(reason)
+
+    def reject_request(self, reason=None):
+        """Record why the whole request was refused and stop reading its body."""
+        self._record(reason or f'Upload too large. The total limit is {filesizeformat(self.max_request_size)}.')
+        # connection_reset: don't read (or store) any more of the body
+        raise StopUpload(connection_reset=True)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.request_length = content_length
+        return None
+
+    def upload_allowed(self):
+        """Only upload-authenticated visitors and admin staff may send files."""
+        if self.request is None:
+            return True
+        session = getattr(self.request, 'session', None)
+        if session is not None and session.get('item_upload_authenticated', False):
+            return True
+        user = getattr(self.request, 'user', None)
+        return bool(user is not None and user.is_staff)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if not self.upload_allowed():
+            self.reject_request('Sign in before uploading photos.')
+        # A declared body over the limit is refused before any file is read
+        if self.request_length > self.max_request_size:
+            self.reject_request()
+        self.header = b''
+        self.parser = ImageFile.Parser()
+        self.dimensions = None
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        self.request_total += len(raw_data)
+        if self.request_total > self.max_request_size:
+            self.reject_request()
+        if self.size > self.max_file_size:
+            self.reject(f'File too large. Maximum size is {filesizeformat(self.max_file_size)}.')
+
+        if len(self.header) < SNIFF_BYTES:
+            self.header += raw_data[:SNIFF_BYTES - len(self.header)]
+            if len(self.header) >= SNIFF_BYTES and sniff_image_type(self.header) is None:
+                self.reject('Not a JPEG, PNG, GIF or WebP image.')
+
+        if self.dimensions is None:
+            self._read_dimensions(raw_data, start)
+        return raw_data
+
+    def _read_dimensions(self, raw_data, start):
+        if start >= HEADER_PARSE_LIMIT:
+            self.reject('Could not read the image dimensions.')
+        try:
+            self.parser.feed(raw_data)
+        except Exception:
+            self.reject('The image file is damaged.')
+        if self.parser.image is not None:
+            width, height = self.parser.image.size
+            self.dimensions = (width, height)
+            # Release Pillow's buffered data now that the header is read
+            self.parser = None
+            if width * height > self.max_pixels:
+                self.reject(f'Image is too large ({width}x{height} pixels).')
+
+    def file_complete(self, file_size):
+        # Let the storing handlers build the file object
+        return None
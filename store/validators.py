@@ -1,23 +1,62 @@
 """
 Validators for image uploads.
 """
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.template.defaultfilters import filesizeformat
 
+# Leading bytes of each accepted image format
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+]
+# Enough leading bytes to tell every accepted format apart
+SNIFF_BYTES = 12
+
+
+def sniff_image_type(header):
+    """
+    Return the MIME type of an accepted image format from its first bytes,
+    or None if the data is not one of them.
+    """
+    for signature, mime in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime
+    # WebP: RIFF container with a WEBP form type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def max_image_size():
+    """Largest accepted image upload, in bytes."""
+    return getattr(settings, 'UPLOAD_MAX_IMAGE_SIZE', 5 * 1024 * 1024)
+
 
 def validate_image_file_type(value):
-    """Validate that uploaded file is an image."""
-    valid_types = ['image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'image/webp']
-    if hasattr(value, 'content_type'):
-        if value.content_type not in valid_types:
-            raise ValidationError(
-                f'File type not supported. Allowed types: {", ".join(valid_types)}'
-            )
+    """
+    Validate that uploaded file is an image.
+
+    Checks the file's leading bytes rather than the client-supplied
+    content type, which browsers derive from the file name.
+    """
+    try:
+        value.seek(0)
+        header = value.read(SNIFF_BYTES)
+        value.seek(0)
+    except (AttributeError, OSError, ValueError):
+        return
+    if sniff_image_type(header) is None:
+        raise ValidationError(
+            'File type not supported. Allowed types: JPEG, PNG, GIF, WebP'
+        )
 
 
 def validate_image_file_size(value):
-    """Validate that uploaded file size is reasonable (max 5MB)."""
-    max_size = 5 * 1024 * 1024  # 5MB in bytes
+    """Validate that uploaded file size is reasonable (max 5MB by default)."""
+    max_size = max_image_size()
     if hasattr(value, 'size'):
         if value.size > max_size:
             raise ValidationError(
@@ -2,27 +2,164 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.views.generic import ListView, DetailView, TemplateView, FormView
 from django.contrib import messages
 from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.urls import reverse_lazy
-from django.http import JsonResponse
-from django.urls import reverse
+from django.http import HttpResponse, JsonResponse
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+import hashlib
 import logging
-from .models import Category, Item, ItemImage
+from .models import Category, Item
 from .forms import ItemCreateForm
-from .stripe_service import create_payment_link_for_item
+from .validators import validate_image_file_size, validate_image_file_type
+from .imaging import save_uploads
+from .pagination import paginate_by_cursor, paginate_by_offset
+from .search import search_items
+from .snapshots import (
+    item_card, refresh_in_background, snapshot_url, snapshots_current, snapshots_enabled,
+)
+from . import cache as catalogue_cache
 
 logger = logging.getLogger(__name__)
 
 
-class ItemListView(ListView):
-    """Display all items (both live and sold) with category filtering."""
+class ConditionalGetMixin:
+    """
+    Answer GET/HEAD with 304 Not Modified when the client's copy is current.
+    
+    Subclasses implement get_validators() returning (etag_parts,
+    last_modified); both may be None to opt a request out. Validators
+    are checked before any template rendering or page-cache lookup.
+    """
+    
+    def get_validators(self):
+        raise NotImplementedError
+    
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        
+        etag_parts, last_modified = self.get_validators()
+        etag = None
+        if etag_parts is not None:
+            digest = hashlib.md5(repr(etag_parts).encode()).hexdigest()
+            etag = quote_etag(digest)
+        last_modified_ts = int(last_modified.timestamp()) if last_modified else None
+        
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified_ts)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code == 200:
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+                if last_modified_ts:
+                    response.headers.setdefault('Last-Modified', http_date(last_modified_ts))
+        # Always revalidate: a 304 is cheap and pages change when items sell
+        patch_cache_control(response, no_cache=True)
+        patch_vary_headers(response, ['Cookie', 'X-Requested-With'])
+        return response
+
+
+def has_pending_messages(request):
+    """True if the next page rendered for this visitor will show flash messages."""
+    return bool(len(messages.get_messages(request)))
+
+
+class ItemListView(ConditionalGetMixin, ListView):
+    """Display all items (both live and sold) with category filtering and search."""
     model = Item
     template_name = 'store/item_list.html'
     context_object_name = 'items'
     paginate_by = 12
+    snapshots_stale = False
+    
+    def is_json_request(self):
+        """Infinite scroll fetches pages as JSON via XMLHttpRequest."""
+        return self.request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    
+    def get_page_cache_key(self):
+        """
+        Key for this page in the catalogue cache, or None if page caching
+        is off or the response is specific to the visitor (upload session
+        or pending messages).
+        """
+        if not catalogue_cache.page_cache_enabled():
+            return None
+        if self.is_json_request():
+            return catalogue_cache.page_cache_key('json', self.request.GET)
+        if check_upload_password(self.request) or has_pending_messages(self.request):
+            return None
+        return catalogue_cache.page_cache_key('html', self.request.GET)
+    
+    def get_validators(self):
+        """
+        ETag from the catalogue version plus the newest item change.
+        
+        With a shared cache, deletes and category changes bump the
+        version; the Max(updated_at) lookup (an index scan) catches item
+        edits. Without one each process has its own version, which misses
+        changes made in other processes, so the item count (for deletes)
+        and the categories are added instead. The aggregate covers all
+        items rather than the filtered category so an unknown category
+        slug, which falls back to all items, still revalidates correctly.
+        No Last-Modified is sent: deleting the newest item would move it
+        backwards.
+        """
+        if has_pending_messages(self.request):
+            return None, None
+        if catalogue_cache.page_cache_enabled():
+            catalogue = (
+                catalogue_cache.catalogue_version(),
+                Item.objects.aggregate(last=Max('updated_at'))['last'],
+            )
+        else:
+            stats = Item.objects.aggregate(last=Max('updated_at'), count=Count('id'))
+            catalogue = (
+                stats['last'],
+                stats['count'],
+                list(Category.objects.order_by('pk').values_list('pk', 'name', 'slug', 'order')),
+            )
+        return (
+            'list',
+            self.is_json_request(),
+            sorted(self.request.GET.items()),
+            check_upload_password(self.request),
+            catalogue,
+            # Pages served before the snapshots caught up must not revalidate
+            snapshots_current(),
+        ), None
+    
+    def get(self, request, *args, **kwargs):
+        """Serve the page from the catalogue cache, filling it on a miss."""
+        cache_key = self.get_page_cache_key()
+        if cache_key:
+            cached = catalogue_cache.get_page(cache_key)
+            if cached is not None:
+                return HttpResponse(cached['content'], content_type=cached['content_type'])
+        
+        response = super().get(request, *args, **kwargs)
+        
+        # A page rendered while the snapshots are stale would keep
+        # paging from the server for as long as it stayed cached
+        if cache_key and response.status_code == 200 and not self.snapshots_stale:
+            def store(rendered):
+                catalogue_cache.set_page(cache_key, {
+                    'content': rendered.content,
+                    'content_type': rendered['Content-Type'],
+                })
+            if getattr(response, 'is_rendered', True):
+                store(response)
+            else:
+                response.add_post_render_callback(store)
+        return response
+    
+    def get_search_query(self):
+        return self.request.GET.get('q', '').strip()
     
     def get_queryset(self):
-        """Show all items, with optional category filtering."""
-        queryset = Item.objects.all().prefetch_related('images', 'category')
+        """Show all items, with optional category filtering and ?q= search."""
+        queryset = Item.objects.all().select_related('category', 'primary_image')
         
         # Filter by category if specified
         category_slug = self.request.GET.get('category')
@@ -33,68 +170,101 @@ class ItemListView(ListView):
             except Category.DoesNotExist:
                 pass  # Invalid category, show all items
         
+        # Ranked full-text search, best matches first
+        query = self.get_search_query()
+        if query:
+            queryset = search_items(queryset, query)
+        
         return queryset
     
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginate by cursor unless an old-style ?page=N link was followed.
+        
+        Cursor pages skip the COUNT query and stay fast however deep the
+        infinite scroll goes; ?page=N keeps working for existing links.
+        Search results keep their relevance order with offset cursors.
+        """
+        if 'page' in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        if self.get_search_query():
+            page = paginate_by_offset(queryset, self.request.GET.get('cursor'), page_size)
+        else:
+            page = paginate_by_cursor(queryset, self.request.GET.get('cursor'), page_size)
+        return (None, page, page.object_list, page.has_other_pages())
+    
     def get_context_data(self, **kwargs):
         """Add categories to context for filter buttons."""
         context = super().get_context_data(**kwargs)
         context['categories'] = Category.objects.all().order_by('order', 'name')
         context['active_category'] = self.request.GET.get('category', '')
+        context['search_query'] = self.get_search_query()
+        # Scrolling continues through the precomputed snapshot from the
+        # page's last card; searches keep fetching pages from the server,
+        # as does every page while the snapshots catch up with a change
+        if not context['search_query'] and snapshots_enabled():
+            if snapshots_current():
+                context['snapshot_url'] = snapshot_url(context['active_category'])
+            else:
+                refresh_in_background()
+                self.snapshots_stale = True
         return context
     
     def render_to_response(self, context, **response_kwargs):
         """Return JSON for AJAX requests, HTML otherwise."""
-        if self.request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if self.is_json_request():
             # AJAX request - return JSON
-            items_data = []
-            for item in context['items']:
-                primary_image_url = ''
-                if item.primary_image:
-                    primary_image_url = item.primary_image.image.url
-                
-                items_data.append({
-                    'id': item.id,
-                    'title': item.title,
-                    'price_amount': str(item.price_amount),
-                    'currency': item.currency,
-                    'status': item.status,
-                    'primary_image_url': primary_image_url,
-                    'detail_url': reverse('store:item_detail', kwargs={'pk': item.pk}),
-                    'is_sold': item.status == Item.STATUS_SOLD,
-                })
+            items_data = [item_card(item) for item in context['items']]
             
             # Get pagination info
+            # Cursor pages carry next_cursor; ?page=N requests get next_page
             page_obj = context.get('page_obj')
             has_next = False
             next_page = None
+            next_cursor = None
             if page_obj:
-                try:
-                    has_next = page_obj.has_next()
-                    if has_next:
-                        next_page = page_obj.next_page_number()
-                except AttributeError:
-                    # page_obj exists but doesn't have pagination methods
-                    has_next = False
+                has_next = page_obj.has_next()
+                next_cursor = getattr(page_obj, 'next_cursor', None)
+                if has_next and next_cursor is None:
+                    next_page = page_obj.next_page_number()
             
             return JsonResponse({
                 'items': items_data,
                 'has_next': has_next,
                 'next_page': next_page,
+                'next_cursor': next_cursor,
             })
         
         # Regular request - return HTML
         return super().render_to_response(context, **response_kwargs)
 
 
-class ItemDetailView(DetailView):
+class ItemDetailView(ConditionalGetMixin, DetailView):
     """Display details of a single item."""
     model = Item
     template_name = 'store/item_detail.html'
     context_object_name = 'item'
     
+    def get_validators(self):
+        """ETag and Last-Modified from the item's updated_at (one indexed lookup)."""
+        if has_pending_messages(self.request):
+            return None, None
+        updated_at = Item.objects.filter(pk=self.kwargs['pk']).values_list(
+            'updated_at', flat=True
+        ).first()
+        if updated_at is None:
+            # Let the view raise its normal 404
+            return None, None
+        return (
+            'detail',
+            self.kwargs['pk'],
+            check_upload_password(self.request),
+            updated_at,
+        ), updated_at
+    
     def get_queryset(self):
         """Allow viewing all items."""
-        return Item.objects.all().prefetch_related('images')
+        return Item.objects.all().select_related('primary_image').prefetch_related('images')
 
 
 def check_upload_password(request):
@@ -123,7 +293,32 @@ class ItemCreateView(FormView):
         return super().dispatch(request, *args, **kwargs)
     
     def form_valid(self, form):
-        """Save item and images, create Stripe payment link."""
+        """
+        Save item and images.
+        
+        The Stripe Payment Link is created afterwards by the background
+        worker (store.payment_links), so the upload doesn't wait on Stripe.
+        """
+        # Photos are checked before the item is saved so a rejected
+        # upload doesn't leave an item without images behind.
+        # ImageUploadHandler has already dropped files that aren't images
+        # or are too large; tell the user which ones
+        for name, reason in getattr(self.request, 'rejected_uploads', []):
+            form.add_error(None, f'{name}: {reason}')
+        images = self.request.FILES.getlist('images')
+        for image_file in images:
+            try:
+                validate_image_file_type(image_file)
+                validate_image_file_size(image_file)
+            except ValidationError as e:
+                form.add_error(None, f'{image_file.name}: {e.messages[0]}')
+        if form.errors:
+            return self.form_invalid(form)
+        if not images:
+            # No images uploaded - this is a validation error
+            form.add_error(None, 'At least one photo is required.')
+            return self.form_invalid(form)
+        
         try:
             # Save the item
             item = form.save(commit=False)
@@ -139,46 +334,15 @@ class ItemCreateView(FormView):
             )
             return self.form_invalid(form)
         
-        # Handle image uploads
-        images = self.request.FILES.getlist('images')
-        if not images:
-            # No images uploaded - this is a validation error
-            form.add_error(None, 'At least one photo is required.')
-            return self.form_invalid(form)
-        
-        for index, image_file in enumerate(images):
-            ItemImage.objects.create(
-                item=item,
-                image=image_file,
-                sort_order=index,
-                is_primary=(index == 0)  # First image is primary
-            )
+        # Normalized in parallel and inserted in one query; first is primary
+        save_uploads(item, images)
         
-        # Create Stripe Payment Link
-        try:
-            payment_link_id, payment_link_url, product_id, price_id = \
-                create_payment_link_for_item(item)
-            item.stripe_payment_link_id = payment_link_id
-            item.stripe_payment_link_url = payment_link_url
-            item.stripe_product_id = product_id
-            item.stripe_price_id = price_id
-            item.save()
-            messages.success(
-                self.request,
-                f'Item "{item.title}" created successfully! '
-                f'<a href="{item.get_absolute_url()}" class="alert-link">View item</a>'
-            )
-        except Exception as e:
-            logger.exception(
-                "Stripe payment link creation failed for item_id=%s title=%r",
-                item.pk,
-                item.title,
-            )
-            messages.warning(
-                self.request,
-                f'Item created but Stripe payment link failed: {str(e)}. '
-                f'You can create it manually in admin.'
-            )
+        messages.success(
+            self.request,
+            f'Item "{item.title}" created successfully! '
+            f'<a href="{item.get_absolute_url()}" class="alert-link">View item</a> '
+            f'(the Buy Now button appears once its payment link is ready)'
+        )
         
         return redirect('store:item_detail', pk=item.pk)
     
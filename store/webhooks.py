@@ -3,20 +3,50 @@ Stripe webhook handlers.
 
 Webhooks are the source of truth for completed sales.
 All payment verification happens server-side via verified webhook events.
+
+The view only verifies the signature and records the event in the
+WebhookEvent inbox, so Stripe gets its 200 in milliseconds. The
+run_worker management command drains the inbox (process_pending_events),
+retrying failed events with backoff.
 """
+import hashlib
+import hmac
+import json
 import logging
+import time
+from datetime import timedelta
 import stripe
 from django.http import HttpResponse, HttpResponseBadRequest
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
-from django.core.mail import send_mail
-from .models import Item
-from .stripe_service import deactivate_payment_link
+from .models import Item, WebhookEvent
+from .mail import enqueue_email
+from .retry import next_attempt_at
+from .stripe_service import get_gateway
 
 logger = logging.getLogger(__name__)
 
+# Events recorded in the inbox; everything else is acknowledged and dropped
+HANDLED_EVENT_TYPES = {'checkout.session.completed'}
+
+# A PROCESSING event whose worker hasn't finished after this long is
+# assumed to belong to a crashed worker and may be claimed again
+PROCESSING_TIMEOUT = timedelta(minutes=10)
+
+
+def signature_header(payload, secret, timestamp=None):
+    """
+    Stripe-Signature header for ``payload`` (a str) signed with ``secret``,
+    as Stripe would send it. Used to replay events and in benchmarks.
+    """
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
 
 @csrf_exempt
 @require_POST
@@ -24,8 +54,10 @@ def stripe_webhook(request):
     """
     Handle Stripe webhook events.
     
-    Verifies webhook signature using Stripe's signing secret.
-    Listens for checkout.session.completed to mark items as SOLD.
+    Verifies webhook signature using Stripe's signing secret and stores
+    checkout.session.completed events in the inbox for the worker to
+    mark items as SOLD. Redeliveries of an event already in the inbox
+    are acknowledged without being stored twice.
     """
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
@@ -44,108 +76,208 @@ def stripe_webhook(request):
         # Invalid signature - reject the request
         return HttpResponseBadRequest('Invalid signature')
     
-    # Handle the event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        handle_checkout_session_completed(session)
-    # Other event types are ignored as per requirements
+    # Record the event for the worker; other event types are ignored
+    if event['type'] in HANDLED_EVENT_TYPES:
+        WebhookEvent.objects.get_or_create(
+            stripe_event_id=event['id'],
+            defaults={
+                'event_type': event['type'],
+                'payload': json.loads(payload),
+            },
+        )
     
     return HttpResponse(status=200)
 
 
-def handle_checkout_session_completed(session):
+def process_event(event):
+    """Dispatch a stored event payload to its handler."""
+    if event.event_type == 'checkout.session.completed':
+        handle_checkout_session_completed(event.payload['data']['object'])
+
+
+def claim_event(event):
     """
-    Handle checkout.session.completed event.
+    Atomically claim an event for processing.
     
-    This is the source of truth for completed sales.
-    Mark the item as SOLD idempotently and deactivate the Payment Link.
+    Counts the attempt up front so an event whose worker crashes
+    mid-processing still runs out of attempts eventually. Returns False
+    if another worker got there first.
+    """
+    now = timezone.now()
+    claimable = (
+        WebhookEvent.objects.filter(pk=event.pk, status=WebhookEvent.STATUS_PENDING)
+        | WebhookEvent.objects.filter(
+            pk=event.pk,
+            status=WebhookEvent.STATUS_PROCESSING,
+            locked_at__lt=now - PROCESSING_TIMEOUT,
+        )
+    )
+    claimed = claimable.update(
+        status=WebhookEvent.STATUS_PROCESSING,
+        locked_at=now,
+        attempts=F('attempts') + 1,
+    ) == 1
+    if claimed:
+        event.attempts += 1
+    return claimed
+
+
+def process_pending_events(limit=20):
+    """
+    Process due events from the inbox.
     
-    Item identification strategy:
-    1. First try to get item_id from session metadata (if available)
-    2. Fall back to looking up by price_id from line items
+    Failed events are retried with exponential backoff until
+    WEBHOOK_MAX_ATTEMPTS is reached, then left as FAILED for inspection
+    in the admin. Returns the number of events processed.
     """
-    item = None
-    item_id = None
+    now = timezone.now()
+    max_attempts = getattr(settings, 'WEBHOOK_MAX_ATTEMPTS', 8)
+    due = (
+        WebhookEvent.objects.filter(
+            status=WebhookEvent.STATUS_PENDING,
+            next_attempt_at__lte=now,
+        )
+        | WebhookEvent.objects.filter(
+            status=WebhookEvent.STATUS_PROCESSING,
+            locked_at__lt=now - PROCESSING_TIMEOUT,
+        )
+    ).order_by('created_at')[:limit]
     
-    # Strategy 1: Try to get item_id from session metadata
+    processed = 0
+    for event in due:
+        if not claim_event(event):
+            continue
+        try:
+            process_event(event)
+        except Exception as e:
+            logger.exception(
+                "Webhook event %s failed (attempt %s)", event.stripe_event_id, event.attempts
+            )
+            event.last_error = f"{type(e).__name__}: {e}"
+            if event.attempts >= max_attempts:
+                event.status = WebhookEvent.STATUS_FAILED
+            else:
+                event.status = WebhookEvent.STATUS_PENDING
+                event.next_attempt_at = next_attempt_at(event.attempts)
+        else:
+            event.status = WebhookEvent.STATUS_DONE
+            event.processed_at = timezone.now()
+            event.last_error = ''
+        event.locked_at = None
+        event.save(update_fields=[
+            'status', 'attempts', 'next_attempt_at', 'locked_at', 'last_error', 'processed_at',
+        ])
+        processed += 1
+    return processed
+
+
+def find_item(payment_link_id=None, price_id=None):
+    """
+    Return the Item for a payment link or price id, or None.
+
+    Both columns are indexed, so each lookup is a single indexed query.
+    The payment link id is preferred when both are given.
+    """
+    for field, value in (('stripe_payment_link_id', payment_link_id), ('stripe_price_id', price_id)):
+        if value:
+            item = Item.objects.filter(**{field: value}).order_by('pk').first()
+            if item is not None:
+                return item
+    return None
+
+
+def resolve_session_item(session):
+    """Find the Item a checkout session paid for, or None."""
+    # Strategy 1: item_id from session metadata
     # Metadata may be available if passed through Payment Link
-    if 'metadata' in session and 'item_id' in session['metadata']:
-        item_id = session['metadata']['item_id']
+    metadata = session.get('metadata') or {}
+    if 'item_id' in metadata:
+        item_id = metadata['item_id']
         try:
-            item = Item.objects.get(id=item_id)
+            return Item.objects.get(id=item_id)
         except (Item.DoesNotExist, ValueError):
             # item_id not found or invalid, continue to strategy 2
-            logger.warning(f"Item with id {item_id} from metadata not found, trying price_id lookup")
-            item = None
+            logger.warning(f"Item with id {item_id} from metadata not found, trying payment link lookup")
+    
+    # Strategy 2: the payment link the session was created from
+    # Included in the event payload, so no API call is needed
+    payment_link_id = session.get('payment_link')
+    if payment_link_id:
+        item = find_item(payment_link_id=payment_link_id)
+        if item is not None:
+            return item
+        logger.warning(f"Item with payment link {payment_link_id} not found, trying line items")
+    
+    # Strategy 3: look up by price_id from line items (Stripe API call)
+    try:
+        line_items = get_gateway().list_line_items(session['id'], limit=1)
+    except stripe.error.StripeError as e:
+        # Stripe API error - cannot retrieve line items. Re-raise so the
+        # worker retries the event later.
+        logger.error(f"Stripe API error retrieving line items for session {session.get('id', 'unknown')}: {str(e)}")
+        raise
     
-    # Strategy 2: Look up by price_id from line items
-    # This is the most reliable method as price_id is always available
+    if not line_items.data or not line_items.data[0].price:
+        # No line items or price information - cannot identify item
+        return None
+    
+    price_id = line_items.data[0].price.id
+    item = find_item(price_id=price_id)
     if item is None:
-        try:
-            # Retrieve line items for this checkout session
-            line_items = stripe.checkout.Session.list_line_items(
-                session['id'],
-                limit=1
-            )
-            
-            if not line_items.data or not line_items.data[0].price:
-                # No line items or price information - cannot identify item
-                return
-            
-            price_id = line_items.data[0].price.id
-            
-            # Find item by price_id
-            try:
-                item = Item.objects.get(stripe_price_id=price_id)
-            except Item.DoesNotExist:
-                # Item not found - cannot process this webhook
-                logger.error(f"Item with price_id {price_id} not found in database. Webhook session: {session.get('id', 'unknown')}")
-                return
-            except Item.MultipleObjectsReturned:
-                # Shouldn't happen (one price per item), but handle gracefully
-                item = Item.objects.filter(stripe_price_id=price_id).first()
-                if not item:
-                    return
-                    
-        except stripe.error.StripeError as e:
-            # Stripe API error - cannot retrieve line items
-            logger.error(f"Stripe API error retrieving line items for session {session.get('id', 'unknown')}: {str(e)}")
-            return
-    
-    # At this point, we have an item or we've returned early
+        # Item not found - cannot process this webhook
+        logger.error(f"Item with price_id {price_id} not found in database. Webhook session: {session.get('id', 'unknown')}")
+    return item
+
+
+def handle_checkout_session_completed(session):
+    """
+    Handle checkout.session.completed event.
+    
+    This is the source of truth for completed sales.
+    Mark the item as SOLD idempotently and queue its Payment Link for
+    deactivation and the sale emails, in one transaction.
+    
+    Item identification strategy:
+    1. item_id from session metadata (if available)
+    2. The session's payment_link, resolved locally
+    3. Last resort: the price id from the session's line items, which
+       costs a Stripe API round-trip
+    
+    Returns True if this call marked the item as sold.
+    """
+    item = resolve_session_item(session)
     if item is None:
-        return
+        return False
     
-    # Mark item as SOLD idempotently
-    # This is safe to call multiple times - it only updates if needed
-    if item.status != Item.STATUS_SOLD:
-        item.status = Item.STATUS_SOLD
-        if not item.sold_at:
-            item.sold_at = timezone.now()
-        item.save()
-        
-        # Deactivate the Payment Link to prevent further payments
-        # This enforces the "one payment per item" requirement
-        if item.stripe_payment_link_id:
-            deactivate_payment_link(item.stripe_payment_link_id)
-        
-        # Extract buyer information for notifications
-        customer_details = session.get('customer_details', {}) or {}
-        buyer_name = customer_details.get('name') or 'Customer'
-        buyer_email = customer_details.get('email') or session.get('customer_email') or ''
-        buyer_phone = customer_details.get('phone') or ''
+    # Extract buyer information for notifications
+    customer_details = session.get('customer_details', {}) or {}
+    buyer_name = customer_details.get('name') or 'Customer'
+    buyer_email = customer_details.get('email') or session.get('customer_email') or ''
+    buyer_phone = customer_details.get('phone') or ''
+    
+    # The SOLD transition and the queued emails commit together: a crash
+    # in between rolls both back and the retried event does the sale again
+    with transaction.atomic():
+        # Mark item as SOLD atomically and idempotently
+        # Only the delivery that wins the transition runs the side effects;
+        # duplicates and concurrent retries see False and do nothing.
+        # This also queues the Payment Link for deactivation by the worker,
+        # enforcing the "one payment per item" requirement
+        if not item.mark_sold():
+            return False
         
-        # Send email notifications (if email is configured)
+        # Queue email notifications (if email is configured)
         send_sale_notifications(item, buyer_name, buyer_email, buyer_phone)
-        logger.info(f"Item '{item.title}' sold to {buyer_name} ({buyer_email}, {buyer_phone})")
-    
-    # If item is already SOLD, this webhook is a duplicate
-    # This is expected and handled gracefully (idempotent)
+    logger.info(f"Item '{item.title}' sold to {buyer_name} ({buyer_email}, {buyer_phone})")
+    return True
 
 
 def send_sale_notifications(item, buyer_name, buyer_email, buyer_phone=''):
     """
-    Send email notifications to buyer and admin when an item is sold.
+    Queue email notifications to buyer and admin when an item is sold.
+    
+    Messages go to the outbox and are sent by the worker, so sale
+    handling never waits on SMTP.
     
     Args:
         item: The Item object that was sold
@@ -162,9 +294,8 @@ def send_sale_notifications(item, buyer_name, buyer_email, buyer_phone=''):
     
     # Email to buyer (if email provided)
     if buyer_email:
-        try:
-            buyer_subject = f"Thanks for your purchase: {item.title}"
-            buyer_message = f"""Hello {buyer_name},
+        buyer_subject = f"Thanks for your purchase: {item.title}"
+        buyer_message = f"""Hello {buyer_name},
 
 Thanks for buying our stuff!
 
@@ -176,23 +307,14 @@ Next step: Please text Julia on 021 649 477 to arrange pickup.
 Thanks
 J&B
 """
-            send_mail(
-                buyer_subject,
-                buyer_message,
-                from_email,
-                [buyer_email],
-                fail_silently=False,
-            )
-            logger.info(f"Buyer notification email sent to {buyer_email}")
-        except Exception as e:
-            logger.error(f"Failed to send buyer notification email: {str(e)}")
+        enqueue_email(buyer_subject, buyer_message, from_email, [buyer_email])
+        logger.info(f"Buyer notification email queued for {buyer_email}")
     
     # Email to admin
     admin_email = settings.ADMIN_EMAIL or settings.DEFAULT_FROM_EMAIL
     if admin_email:
-        try:
-            admin_subject = f"Item Sold: {item.title}"
-            admin_message = f"""A new sale has been completed!
+        admin_subject = f"Item Sold: {item.title}"
+        admin_message = f"""A new sale has been completed!
 
 Item: {item.title}
 Price: ${item.price_amount} {item.currency}
@@ -207,15 +329,7 @@ Reminder: buyer has been asked to text Julia on 021 649 477 to arrange pickup.
 
 View in admin: https://sell-my-stuff.onrender.com/admin/store/item/{item.id}/
 """
-            send_mail(
-                admin_subject,
-                admin_message,
-                from_email,
-                [admin_email],
-                fail_silently=False,
-            )
-            logger.info(f"Admin notification email sent to {admin_email}")
-        except Exception as e:
-            logger.error(f"Failed to send admin notification email: {str(e)}")
+        enqueue_email(admin_subject, admin_message, from_email, [admin_email])
+        logger.info(f"Admin notification email queued for {admin_email}")
 
 
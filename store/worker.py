@@ -0,0 +1,40 @@
+"""
+Local background worker.
+
+Slow or failure-prone work (Stripe calls, email) is queued in database
+tables and drained here by the run_worker management command, outside the
+request/response cycle. Each task processes a batch of due work and
+returns how many entries it handled. (Catalogue snapshots are refreshed
+by the web service, which serves the media files; see store.snapshots.)
+"""
+import logging
+
+from .mail import send_pending_emails
+from .payment_links import process_pending_deactivations, process_pending_links
+from .webhooks import process_pending_events
+
+logger = logging.getLogger(__name__)
+
+TASKS = [
+    ('webhooks', process_pending_events),
+    ('email', send_pending_emails),
+    ('payment_links', process_pending_links),
+    ('link_deactivations', process_pending_deactivations),
+]
+
+
+def run_once():
+    """
+    Run every task once.
+
+    A failing task is logged and skipped so it can't starve the others.
+    Returns a dict of {task name: entries processed}.
+    """
+    results = {}
+    for name, task in TASKS:
+        try:
+            results[name] = task()
+        except Exception:
+            logger.exception("Worker task %s failed", name)
+            results[name] = 0
+    return results